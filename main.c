@@ -2,6 +2,9 @@
 #include <stdbool.h>
 #include <stdlib.h>
 
+#include "rummage.h"
+#include "test_header.h"
+
 typedef struct {
     int num_blorps;
     float avg_blorp;
@@ -67,6 +70,73 @@ void test_pointer() {
     free(array);
 }
 
+void test_offload() {
+    struct TestStruct a_struct = {.a = 1, .b = 3.5f};
+    const char* text = "offloaded";
+    (void)0;  // @rummage: test_offload
+}
+
+void test_backtrace() {
+    (void)0;  // @rummage: test_backtrace
+}
+
+void test_eval() {
+    struct TestStruct a_struct = {.a = 1, .b = 3.5f};
+    struct TestStruct* a_struct_ptr = &a_struct;
+    int multiplicity[] = {1, 2, 3, 4, 5, 6, 7, 8, 9};
+    int flags = 1;
+    (void)0;  // @rummage: test_eval
+}
+
+struct TestPoint {
+    int x;
+    int y;
+};
+
+void test_formatters() {
+    struct TestPoint point = {.x = 1, .y = 2};
+    struct TestPoint points[] = {{.x = 3, .y = 4}, {.x = 5, .y = 6}};
+    (void)0;  // @rummage: test_formatters
+}
+
+void test_compiled_marker() {
+    int answer = 42;
+    RUMMAGE_MARK("test_compiled_marker");
+}
+
+int global_counter = 0;
+static struct TestPoint static_point = {.x = 7, .y = 8};
+
+void test_global_var() {
+    global_counter += 1;
+    static_point.x += 1;
+    (void)0;  // @rummage: test_global_var
+}
+
+struct TestNode {
+    int id;
+    struct TestNode* next;
+};
+
+void test_capture() {
+    int count = 3;
+    struct TestNode tail = {.id = 2, .next = NULL};
+    struct TestNode head = {.id = 1, .next = &tail};
+    struct TestNode* node = &head;
+    unsigned char buf[] = {1, 2, 3, 4, 5, 6, 7, 8};
+    (void)0;  // @rummage: capture(count, node->id, node->next->id, buf[2:6], global_counter)
+}
+
+void test_spans() {
+    (void)0;  // @rummage: begin outer
+    for (int i = 0; i < 3; ++i) {
+        (void)0;  // @rummage: begin inner
+        global_counter += i;
+        (void)0;  // @rummage: end inner
+    }
+    (void)0;  // @rummage: end outer
+}
+
 void run_tests() {
     test_int();
     test_float();
@@ -74,6 +144,17 @@ void run_tests() {
     test_struct();
     test_array();
     test_pointer();
+    test_eval();
+    test_offload();
+    test_backtrace();
+    test_formatters();
+    test_compiled_marker();
+    test_header_marker(1);
+    test_header_marker(2);
+    test_global_var();
+    test_global_var();
+    test_capture();
+    test_spans();
     (void)0;  // @rummage: tests_done
 }
 
@@ -1,5 +1,13 @@
+from . import callbacks
+from .aggregate import *
+from .common import *
+from .delta import *
+from .formatters import *
+from .offload import *
+from .replay import *
+from .trace import *
+
 try:
-    from . import callbacks
     from .core import *
 except ImportError:
     # .core internally imports the lldb module, which is only defined when running within lldb.
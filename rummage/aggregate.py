@@ -0,0 +1,371 @@
+from __future__ import annotations
+
+import bisect
+import heapq
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+__all__ = [
+    "Counter",
+    "Histogram",
+    "HdrHistogram",
+    "TopK",
+    "Reservoir",
+    "Aggregators",
+    "GlobalAggregators",
+]
+
+
+class Counter:
+    def __init__(self) -> None:
+        self._value = 0
+
+    def add(self, n: int = 1) -> None:
+        self._value += n
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def summary(self) -> Dict[str, Any]:
+        return {"value": self._value}
+
+
+class Histogram:
+    """
+    Histogram with fixed, user-provided bucket upper bounds.
+
+    Values greater than the last bound are counted in an overflow bucket.
+    """
+
+    def __init__(self, bounds: Iterable[float]) -> None:
+        self._bounds = sorted(bounds)
+        if not self._bounds:
+            raise ValueError("Histogram needs at least one bucket bound")
+
+        # One extra bucket for values above the last bound
+        self._counts = array("Q", [0] * (len(self._bounds) + 1))
+        self._total = 0
+        self._sum = 0.0
+        self._min = math.inf
+        self._max = -math.inf
+
+    def record(self, value: float) -> None:
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self._total += 1
+        self._sum += value
+        if value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self._total,
+            "sum": self._sum,
+            "min": self._min if self._total else None,
+            "max": self._max if self._total else None,
+            "buckets": [
+                {"le": bound, "count": count}
+                for bound, count in zip([*self._bounds, "+inf"], self._counts)
+            ],
+        }
+
+
+class HdrHistogram:
+    """
+    Log-linear histogram in the spirit of HdrHistogram.
+
+    Non-negative integer values are bucketed with a relative error of at most 2^-significant_bits,
+    so a wide dynamic range (e.g. nanoseconds to minutes) fits in a few kB. Finding the bucket of a
+    value takes a handful of integer operations.
+    """
+
+    def __init__(self, significant_bits: int = 7, max_value_bits: int = 48) -> None:
+        self._sub_bits = significant_bits
+        self._sub_count = 1 << significant_bits
+        self._max_value = (1 << max_value_bits) - 1
+
+        # Values below `sub_count` get exact buckets, every power of two above that gets
+        # `sub_count / 2` buckets.
+        num_buckets = self._sub_count + (max_value_bits - significant_bits) * (
+            self._sub_count >> 1
+        )
+        self._counts = array("Q", [0] * num_buckets)
+        self._total = 0
+        self._min = math.inf
+        self._max = -math.inf
+
+    def _index(self, value: int) -> int:
+        if value < self._sub_count:
+            return value
+        shift = value.bit_length() - self._sub_bits
+        half = self._sub_count >> 1
+        return self._sub_count + (shift - 1) * half + ((value >> shift) - half)
+
+    def _lowest_in_bucket(self, index: int) -> int:
+        if index < self._sub_count:
+            return index
+        half = self._sub_count >> 1
+        shift, offset = divmod(index - self._sub_count, half)
+        return (half + offset) << (shift + 1)
+
+    def record(self, value: float) -> None:
+        value = min(max(int(value), 0), self._max_value)
+        self._counts[self._index(value)] += 1
+        self._total += 1
+        if value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    def percentile(self, p: float) -> Optional[int]:
+        if self._total == 0:
+            return None
+        target = max(1, math.ceil(self._total * p / 100))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                return self._lowest_in_bucket(index)
+        return int(self._max)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self._total,
+            "min": self._min if self._total else None,
+            "max": self._max if self._total else None,
+            "percentiles": {
+                str(p): self.percentile(p) for p in (50, 90, 99, 99.9, 100)
+            },
+        }
+
+
+class TopK:
+    """
+    Approximate most frequent keys, using the Space-Saving algorithm.
+
+    Keeps `capacity` counters, along with a min-heap of them to find the least frequent key to
+    evict when a new key comes in. Adding to a key is O(log capacity) amortised, whether the key
+    is tracked already or evicts another.
+    """
+
+    def __init__(self, k: int, capacity: Optional[int] = None) -> None:
+        self._k = k
+        self._capacity = max(capacity or 4 * k, k)
+        self._counts: Dict[Any, int] = {}
+        self._errors: Dict[Any, int] = {}
+        # (count, sequence number, key) entries; keys need not be comparable. Adding to a key
+        # pushes a new entry, leaving the old one behind: entries whose count isn't that of their
+        # key are stale, and are skipped when popped and dropped when the heap is rebuilt.
+        self._heap: List[Tuple[int, int, Any]] = []
+        self._sequence = 0
+
+    def _push(self, key: Any, count: int):
+        self._sequence += 1
+        heapq.heappush(self._heap, (count, self._sequence, key))
+
+        if len(self._heap) > 2 * self._capacity:
+            self._heap = []
+            for tracked, tracked_count in self._counts.items():
+                self._sequence += 1
+                self._heap.append((tracked_count, self._sequence, tracked))
+            heapq.heapify(self._heap)
+
+    def add(self, key: Any, n: int = 1) -> None:
+        counts = self._counts
+        if key in counts:
+            counts[key] += n
+            self._push(key, counts[key])
+            return
+
+        if len(counts) < self._capacity:
+            counts[key] = n
+            self._errors[key] = 0
+            self._push(key, n)
+            return
+
+        while True:
+            floor, _, victim = heapq.heappop(self._heap)
+            if counts.get(victim) == floor:
+                break
+        del counts[victim]
+        del self._errors[victim]
+        counts[key] = floor + n
+        self._errors[key] = floor
+        self._push(key, floor + n)
+
+    def top(self) -> List[Tuple[Any, int]]:
+        return sorted(self._counts.items(), key=lambda kv: kv[1], reverse=True)[
+            : self._k
+        ]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "top": [
+                {"key": str(key), "count": count, "max_error": self._errors[key]}
+                for key, count in self.top()
+            ]
+        }
+
+
+class Reservoir:
+    """Uniform random sample of at most `size` items out of everything added (Algorithm R)."""
+
+    def __init__(self, size: int, seed: Optional[int] = None) -> None:
+        self._size = size
+        self._items: List[Any] = []
+        self._seen = 0
+        self._random = random.Random(seed)
+
+    def add(self, item: Any) -> None:
+        self._seen += 1
+        if len(self._items) < self._size:
+            self._items.append(item)
+            return
+        slot = self._random.randrange(self._seen)
+        if slot < self._size:
+            self._items[slot] = item
+
+    @property
+    def items(self) -> List[Any]:
+        return list(self._items)
+
+    def summary(self) -> Dict[str, Any]:
+        return {"seen": self._seen, "items": [str(item) for item in self._items]}
+
+
+class Aggregators:
+    """
+    Collection of named aggregators, created on first use.
+
+    Aggregators are identified by their kind, name and an optional set of labels, e.g.
+    `aggregators.counter("hits", hook=extra["hook_name"])`.
+
+    Aggregators may be looked up from several threads, e.g. by offloaded hooks. Recording into the
+    same aggregator from several threads at once needs a lock of its own.
+    """
+
+    def __init__(self) -> None:
+        self._aggregators: Dict[Tuple[str, str, Tuple[Tuple[str, Any], ...]], Any] = {}
+        # Reentrant, as flushing GlobalAggregators on lookup takes it again for the summary
+        self._lock = threading.RLock()
+
+    def _get(self, kind, name, labels, factory):
+        key = (kind, name, tuple(sorted(labels.items())))
+        with self._lock:
+            aggregator = self._aggregators.get(key)
+            if aggregator is None:
+                aggregator = factory()
+                self._aggregators[key] = aggregator
+        return aggregator
+
+    def counter(self, name: str, **labels) -> Counter:
+        return self._get("counter", name, labels, Counter)
+
+    def histogram(self, name: str, bounds: Iterable[float], **labels) -> Histogram:
+        return self._get("histogram", name, labels, lambda: Histogram(bounds))
+
+    def hdr_histogram(
+        self, name: str, significant_bits: int = 7, **labels
+    ) -> HdrHistogram:
+        return self._get(
+            "hdr_histogram", name, labels, lambda: HdrHistogram(significant_bits)
+        )
+
+    def top_k(self, name: str, k: int, **labels) -> TopK:
+        return self._get("top_k", name, labels, lambda: TopK(k))
+
+    def reservoir(self, name: str, size: int, **labels) -> Reservoir:
+        return self._get("reservoir", name, labels, lambda: Reservoir(size))
+
+    def __len__(self) -> int:
+        return len(self._aggregators)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._aggregators.clear()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "kind": kind,
+                    "name": name,
+                    "labels": dict(labels),
+                    **aggregator.summary(),
+                }
+                for (kind, name, labels), aggregator in self._aggregators.items()
+            ]
+
+
+class GlobalAggregators(Aggregators):
+    """
+    Session-wide aggregators, written out as a JSON summary file at `path` when the session ends,
+    if a path is given.
+
+    If `flush_interval` is given, the summary file is also rewritten at most that often (in
+    seconds) while the session is running, checked whenever an aggregator is looked up.
+    """
+
+    _instance: Optional[GlobalAggregators] = None
+
+    def __init__(
+        self, path: Optional[str] = None, flush_interval: Optional[float] = None
+    ) -> None:
+        super().__init__()
+        self._path = path
+        self._flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+
+    @staticmethod
+    def instance() -> GlobalAggregators:
+        assert (
+            GlobalAggregators._instance is not None
+        ), "Initialise using context manager: `with GlobalAggregators():`"
+        return GlobalAggregators._instance
+
+    def _get(self, kind, name, labels, factory):
+        if (
+            self._flush_interval is not None
+            and time.monotonic() - self._last_flush >= self._flush_interval
+        ):
+            self.flush()
+        return super()._get(kind, name, labels, factory)
+
+    def flush(self) -> None:
+        # Also keeps threads flushing at the same time from writing the same temporary file
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if self._path is None or len(self) == 0:
+                return
+
+            logging.info(f"Writing aggregator summary to {self._path}")
+            tmp_path = f"{self._path}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(self.summary(), file, indent=2)
+            os.replace(tmp_path, self._path)
+
+    def __enter__(self):
+        if GlobalAggregators._instance is None:
+            GlobalAggregators._instance = self
+        return GlobalAggregators._instance
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        GlobalAggregators.instance().flush()
+        GlobalAggregators._instance = None
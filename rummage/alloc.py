@@ -0,0 +1,346 @@
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import random
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import lldb
+
+from .core import StackFrame, StackTable
+
+# Registers holding the first three integer arguments and the return value, by architecture
+ABI_REGISTERS = {
+    "x86_64": (("rdi", "rsi", "rdx"), "rax"),
+    "aarch64": (("x0", "x1", "x2"), "x0"),
+    "arm64": (("x0", "x1", "x2"), "x0"),
+    "arm64e": (("x0", "x1", "x2"), "x0"),
+}
+
+_ALLOCATORS = ["malloc", "calloc", "realloc"]
+
+
+def entry_breakpoint(target: lldb.SBTarget, name: str) -> lldb.SBBreakpoint:
+    """
+    Set a breakpoint at the first instruction of the functions named `name`, resolved as shared
+    libraries are loaded. Breakpoints by name skip the prologue of functions with line info, by
+    which point argument registers may have been overwritten.
+    """
+
+    return target.BreakpointCreateByNames(
+        [name],
+        lldb.eFunctionNameTypeAuto,
+        lldb.eLanguageTypeUnknown,
+        0,
+        False,
+        lldb.SBFileSpecList(),
+        lldb.SBFileSpecList(),
+    )
+
+
+class _LiveTable:
+    """
+    Live allocations in parallel arrays, with slots of freed allocations reused. Only the address
+    to slot mapping is a dict.
+    """
+
+    def __init__(self) -> None:
+        self.addresses = array("Q")
+        self.sizes = array("Q")
+        self.stack_ids = array("I")
+        self._slots: Dict[int, int] = dict()
+        self._free_slots: List[int] = []
+
+    def add(self, address: int, size: int, stack_id: int):
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self.addresses[slot] = address
+            self.sizes[slot] = size
+            self.stack_ids[slot] = stack_id
+        else:
+            slot = len(self.addresses)
+            self.addresses.append(address)
+            self.sizes.append(size)
+            self.stack_ids.append(stack_id)
+        self._slots[address] = slot
+
+    def remove(self, address: int) -> bool:
+        slot = self._slots.pop(address, None)
+        if slot is None:
+            return False
+        self.sizes[slot] = 0
+        self._free_slots.append(slot)
+        return True
+
+    def __contains__(self, address: int) -> bool:
+        return address in self._slots
+
+    def __iter__(self):
+        for slot in self._slots.values():
+            yield self.addresses[slot], self.sizes[slot], self.stack_ids[slot]
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+
+class _PendingCall:
+    def __init__(
+        self,
+        kind: str,
+        size: int,
+        old_address: int,
+        stack_id: int,
+        return_pc: int,
+        sp: int,
+    ) -> None:
+        self.kind = kind
+        self.size = size
+        self.old_address = old_address
+        self.stack_id = stack_id
+        self.return_pc = return_pc
+        self.sp = sp
+
+
+class AllocationTracker:
+    """
+    Tracks calls to malloc, calloc, realloc and free in the target, keeping a table of live
+    allocations and per call stack totals.
+
+    Allocator entries are caught by breakpoints on the functions themselves. Returns are caught by
+    auto-continuing breakpoints on the return addresses, created the first time each call site is
+    seen, and the result is read from the return register.
+
+    To bound overhead, only one in about `sample_every` calls to malloc and calloc is tracked;
+    skipped calls are counted down natively by lldb (breakpoint ignore counts), without running
+    Python. Totals are scaled up accordingly. Calls to realloc and free are always checked, so that
+    tracked allocations are never lost track of.
+
+    Hooks can write a report at any point with `AllocationTracker.instance().write_report(path)`.
+    """
+
+    _instance: Optional[AllocationTracker] = None
+
+    def __init__(
+        self, target: lldb.SBTarget, sample_every: int = 1, max_depth: int = 16
+    ) -> None:
+        self._target = target
+        self._sample_every = sample_every
+        self._max_depth = max_depth
+
+        arch = target.GetTriple().split("-")[0]
+        if arch not in ABI_REGISTERS:
+            raise ValueError(f"Allocation tracking isn't supported on {arch}")
+        self._arg_registers, self._return_register = ABI_REGISTERS[arch]
+
+        self._live = _LiveTable()
+        # Per stack ID: number of allocations and bytes allocated
+        self._sites: Dict[int, List[int]] = dict()
+        self._pending: Dict[int, List[_PendingCall]] = dict()
+        self._return_sites: Dict[int, lldb.SBBreakpoint] = dict()
+        # Countdown to the next sampled realloc of an untracked address
+        self._realloc_skip = self._next_skip()
+
+        self._kinds: Dict[int, str] = dict()
+        self._breakpoints: Dict[str, lldb.SBBreakpoint] = dict()
+        for kind in [*_ALLOCATORS, "free"]:
+            # Arguments are read from registers on entry
+            breakpoint = entry_breakpoint(target, kind)
+            breakpoint.SetAutoContinue(True)
+            breakpoint.SetScriptCallbackFunction("launch._alloc_entry")
+            self._kinds[breakpoint.GetID()] = kind
+            self._breakpoints[kind] = breakpoint
+
+        self._breakpoints["malloc"].SetIgnoreCount(self._next_skip())
+        self._breakpoints["calloc"].SetIgnoreCount(self._next_skip())
+
+    @staticmethod
+    def instance() -> AllocationTracker:
+        assert (
+            AllocationTracker._instance is not None
+        ), "Initialise using context manager: `with AllocationTracker():`"
+        return AllocationTracker._instance
+
+    def _next_skip(self) -> int:
+        """Number of calls to skip before the next sampled one; geometrically distributed."""
+
+        if self._sample_every <= 1:
+            return 0
+        p = 1.0 / self._sample_every
+        return int(math.log(1.0 - random.random()) / math.log(1.0 - p))
+
+    def _register(self, frame: lldb.SBFrame, name: str) -> int:
+        return frame.FindRegister(name).GetValueAsUnsigned()
+
+    def on_entry(self, frame: lldb.SBFrame, bp_loc: lldb.SBBreakpointLocation):
+        kind = self._kinds[bp_loc.GetBreakpoint().GetID()]
+        thread = frame.GetThread()
+        pending = self._pending.setdefault(thread.GetThreadID(), [])
+
+        # Calls whose frames are gone returned without hitting their return site (e.g. longjmp)
+        sp = frame.GetSP()
+        while pending and pending[-1].sp <= sp:
+            pending.pop()
+        if pending:
+            # Called by an allocator itself, e.g. realloc calling malloc or free
+            return False
+
+        first, second = (self._register(frame, r) for r in self._arg_registers[:2])
+
+        if kind == "free":
+            if first != 0:
+                self._live.remove(first)
+            return False
+
+        if kind == "malloc":
+            size, old_address = first, 0
+        elif kind == "calloc":
+            size, old_address = first * second, 0
+        else:
+            size, old_address = second, first
+            if old_address not in self._live:
+                if self._realloc_skip > 0:
+                    self._realloc_skip -= 1
+                    return False
+                self._realloc_skip = self._next_skip()
+
+        if kind != "realloc":
+            # Count down to the next sample natively
+            self._breakpoints[kind].SetIgnoreCount(self._next_skip())
+
+        caller = thread.GetFrameAtIndex(1)
+        if not caller.IsValid():
+            return False
+        return_pc = caller.GetPC()
+        stack_id = StackFrame(caller).stack_id(self._max_depth)
+        pending.append(
+            _PendingCall(kind, size, old_address, stack_id, return_pc, sp)
+        )
+
+        if return_pc not in self._return_sites:
+            breakpoint = self._target.BreakpointCreateByAddress(return_pc)
+            breakpoint.SetAutoContinue(True)
+            breakpoint.SetScriptCallbackFunction("launch._alloc_return")
+            self._return_sites[return_pc] = breakpoint
+
+        return False
+
+    def on_return(self, frame: lldb.SBFrame):
+        pending = self._pending.get(frame.GetThread().GetThreadID())
+        # Return sites are also hit by calls that weren't sampled
+        if not pending or pending[-1].return_pc != frame.GetPC():
+            return False
+
+        call = pending.pop()
+        address = self._register(frame, self._return_register)
+
+        if call.old_address != 0 and (address != 0 or call.size == 0):
+            # Moved or freed by realloc
+            self._live.remove(call.old_address)
+
+        if address != 0:
+            self._live.add(address, call.size, call.stack_id)
+            site = self._sites.setdefault(call.stack_id, [0, 0])
+            site[0] += 1
+            site[1] += call.size
+
+        return False
+
+    def on_exec(self):
+        """
+        Start afresh in the new image the target exec'd: the old address space is gone, along
+        with all live allocations. Totals per call stack are kept.
+        """
+
+        for breakpoint in self._return_sites.values():
+            self._target.BreakpointDelete(breakpoint.GetID())
+        self._return_sites.clear()
+        self._pending.clear()
+        self._live = _LiveTable()
+
+    def _scale(self, n: int) -> int:
+        return n * max(self._sample_every, 1)
+
+    def top_sites(self, n: int = 20) -> List[Tuple[int, int, int]]:
+        """Call stacks allocating the most bytes, as (stack ID, allocations, bytes) tuples."""
+
+        sites = [
+            (stack_id, self._scale(count), self._scale(size))
+            for stack_id, (count, size) in self._sites.items()
+        ]
+        sites.sort(key=lambda site: site[2], reverse=True)
+        return sites[:n]
+
+    def leaks(self, n: int = 20) -> List[Tuple[int, int, int]]:
+        """
+        Call stacks with the most bytes still allocated, as (stack ID, allocations, bytes) tuples.
+        """
+
+        live: Dict[int, List[int]] = dict()
+        for _, size, stack_id in self._live:
+            site = live.setdefault(stack_id, [0, 0])
+            site[0] += 1
+            site[1] += size
+
+        sites = [
+            (stack_id, self._scale(count), self._scale(size))
+            for stack_id, (count, size) in live.items()
+        ]
+        sites.sort(key=lambda site: site[2], reverse=True)
+        return sites[:n]
+
+    def write_report(self, path: str, n: int = 20):
+        """
+        Write the top allocation sites and leaks (allocations still live) as text to `path`, and
+        as JSON next to it, with a .json suffix. May be called at any time, e.g. from a hook.
+        """
+
+        table = StackTable.instance()
+        top_sites, leaks = self.top_sites(n), self.leaks(n)
+
+        logging.info(f"Writing allocation report to {path}")
+        with open(path, "w") as file:
+            file.write(
+                f"Tracked allocations: {sum(c for (c, _) in self._sites.values())}, "
+                f"live: {len(self._live)}, sampling 1 in {max(self._sample_every, 1)}\n"
+            )
+            for title, sites in [
+                ("Top allocation sites", top_sites),
+                ("Leaks", leaks),
+            ]:
+                file.write(f"\n{title}\n")
+                for stack_id, count, size in sites:
+                    file.write(f"  {size:>14} B  {count:>10}\n")
+                    for function, source, line in table.stack(stack_id)[:4]:
+                        file.write(f"      {function} {source}:{line}\n")
+
+        json_path = os.path.splitext(path)[0] + ".json"
+        with open(json_path, "w") as file:
+            json.dump(
+                {
+                    "sample_every": max(self._sample_every, 1),
+                    **{
+                        key: [
+                            {
+                                "bytes": size,
+                                "allocations": count,
+                                "stack": table.stack(stack_id),
+                            }
+                            for stack_id, count, size in sites
+                        ]
+                        for key, sites in [("top_sites", top_sites), ("leaks", leaks)]
+                    },
+                },
+                file,
+                indent=2,
+            )
+
+    def __enter__(self):
+        if AllocationTracker._instance is None:
+            AllocationTracker._instance = self
+        return AllocationTracker._instance
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        AllocationTracker._instance = None
@@ -1,4 +1,11 @@
-from rummage.core import BreakpointLocation, StackFrame
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Only for type hints, so that callbacks can also be overridden when replaying hooks outside of
+    # lldb.
+    from rummage.core import BreakpointLocation, StackFrame
 
 
 def on_hook_enter(frame: StackFrame, bp_loc: BreakpointLocation, extra):
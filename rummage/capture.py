@@ -0,0 +1,441 @@
+"""
+Declarative capture markers: `// @rummage: capture(count, node->id, buf[0:16])` records the
+values of the given expressions at every hit, without any hook code.
+
+Expressions are variable paths (`a`, `a.b`, `a->b`, `a[3]`), optionally ending in a slice of an
+array or pointer (`buf[0:16]`), of scalars: integers, floating point numbers, characters, bools
+and pointers.
+
+On the first hit of each breakpoint location, every expression is compiled into a read plan: the
+address of its variable (relative to the frame's CFA for locals, absolute for globals) and the
+offsets to apply after each pointer it goes through. Later hits only execute the plans, with the
+reads of all expressions of a marker batched into as few memory reads as possible, and append the
+decoded values to array-backed columns, which are written out as JSON at exit. Hits are
+timestamped with `time.perf_counter_ns()`, the clock of span traces (see rummage.spans).
+
+`capture` is a reserved marker name: hooks named `capture` are not called.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import re
+import sys
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import lldb
+
+from .core import MarkerIndex, Target, Type, marker_breakpoints
+
+MARKER_NAME = "capture"
+
+# Reads closer than this to each other are merged into one
+_MAX_READ_GAP = 64
+_MAX_READ_SIZE = 4096
+
+_ROOT_REGEX = re.compile(r"\s*([A-Za-z_]\w*)")
+_STEP_REGEX = re.compile(r"\s*(?:(\.|->)\s*([A-Za-z_]\w*)|\[\s*(\d+)\s*\])")
+_SLICE_REGEX = re.compile(r"\s*\[\s*(\d+)\s*:\s*(\d+)\s*\]\s*$")
+
+_LOCAL_VALUE_TYPES = [
+    lldb.eValueTypeVariableLocal,
+    lldb.eValueTypeVariableArgument,
+]
+
+
+def split_arguments(args: str) -> List[str]:
+    """Split the arguments of a capture marker, `(a, b[0:2], ...)`, into expressions."""
+
+    args = args.strip()
+    if not (args.startswith("(") and args.endswith(")")):
+        raise ValueError(
+            f"Capture markers take a parenthesised list of expressions: {args}"
+        )
+
+    expressions, depth, start = [], 0, 1
+    for i, char in enumerate(args[1:-1], start=1):
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        elif char == "," and depth == 0:
+            expressions.append(args[start:i].strip())
+            start = i + 1
+    expressions.append(args[start:-1].strip())
+    return [expression for expression in expressions if expression]
+
+
+def _parse(expression: str) -> Tuple[str, List[str], Optional[Tuple[int, int]]]:
+    """Split `expression` into its root variable, path steps (e.g. "->b") and slice, if any."""
+
+    match = _ROOT_REGEX.match(expression)
+    if match is None:
+        raise ValueError(f"Unsupported capture expression: {expression}")
+    root, offset = match[1], match.end()
+
+    slice_ = None
+    slice_match = _SLICE_REGEX.search(expression, offset)
+    end = len(expression)
+    if slice_match is not None:
+        slice_ = (int(slice_match[1]), int(slice_match[2]))
+        end = slice_match.start()
+
+    steps = []
+    while offset < end:
+        match = _STEP_REGEX.match(expression, offset, end)
+        if match is None:
+            raise ValueError(f"Unsupported capture expression: {expression}")
+        steps.append(f"{match[1]}{match[2]}" if match[1] else f"[{match[3]}]")
+        offset = match.end()
+
+    if slice_ is not None and slice_[1] <= slice_[0]:
+        raise ValueError(f"Empty slice in capture expression: {expression}")
+    return root, steps, slice_
+
+
+def _typecode(sb_type: lldb.SBType) -> str:
+    """Array typecode of scalars of `sb_type`, which are read as raw little-endian bytes."""
+
+    canonical = sb_type.GetCanonicalType()
+    type_ = Type(canonical)
+    size = canonical.GetByteSize()
+    if type_.is_floating_point and size in (4, 8):
+        return "f" if size == 4 else "d"
+
+    codes = {1: "b", 2: "h", 4: "i", 8: "q"}
+    is_scalar = (
+        type_.is_numeric
+        or type_.is_character
+        or type_.is_pointer
+        or canonical.GetTypeClass() == lldb.eTypeClassEnumeration
+    )
+    if not is_scalar or size not in codes:
+        raise ValueError(f"Only scalars can be captured, not {sb_type.GetName()}")
+    return codes[size] if type_.is_integral_signed else codes[size].upper()
+
+
+class _Unresolved(ValueError):
+    """A capture expression couldn't be resolved on this hit, but may be on later ones."""
+
+
+class _ReadPlan:
+    """
+    How to read the value of one capture expression: start at `base` (relative to the CFA if
+    `is_local`), add `offsets[0]`, then for each further offset load the pointer there and add the
+    offset to it. `count` values of `typecode` are read at the final address.
+    """
+
+    def __init__(self, frame: lldb.SBFrame, expression: str) -> None:
+        root, steps, slice_ = _parse(expression)
+
+        value = frame.FindVariable(root)
+        if not value.IsValid():
+            value = frame.FindValue(root, lldb.eValueTypeVariableStatic)
+        if not value.IsValid():
+            value = frame.FindValue(root, lldb.eValueTypeVariableGlobal)
+        if not value.IsValid():
+            raise KeyError(f"Variable '{root}' not found")
+
+        address = value.GetLoadAddress()
+        if address == lldb.LLDB_INVALID_ADDRESS:
+            raise ValueError(f"'{root}' isn't in memory (e.g. it lives in a register)")
+
+        self.is_local = value.GetValueType() in _LOCAL_VALUE_TYPES
+        self.base = address - frame.GetCFA() if self.is_local else address
+        self.offsets = [0]
+
+        for step in steps:
+            child = value.GetValueForExpressionPath(step)
+            if not child.IsValid() or not child.GetError().Success():
+                raise _Unresolved(f"Failed to resolve {step} of {expression}")
+            self._step(value, child, step.startswith("->") or value.TypeIsPointerType())
+            value = child
+
+        self.count = 1
+        element_type = value.GetType()
+        if slice_ is not None:
+            start, end = slice_
+            if value.TypeIsPointerType():
+                element_type = value.GetType().GetPointeeType()
+                self.offsets.append(start * element_type.GetByteSize())
+            elif value.GetType().IsArrayType():
+                element_type = value.GetType().GetArrayElementType()
+                self.offsets[-1] += start * element_type.GetByteSize()
+            else:
+                raise ValueError(
+                    f"Only arrays and pointers can be sliced: {expression}"
+                )
+            self.count = end - start
+
+        self.typecode = _typecode(element_type)
+        self.size = element_type.GetByteSize() * self.count
+
+    def _step(self, value: lldb.SBValue, child: lldb.SBValue, through_pointer: bool):
+        if through_pointer:
+            # Layout is the same on every hit, wherever the pointer points to
+            self.offsets.append(child.GetLoadAddress() - value.GetValueAsUnsigned())
+        else:
+            self.offsets[-1] += child.GetLoadAddress() - value.GetLoadAddress()
+
+
+def _read_batch(
+    process: lldb.SBProcess, requests: List[Tuple[int, int]]
+) -> List[Optional[bytes]]:
+    """
+    Read (address, size) requests, merging those close to each other into single reads. Requests
+    of a merged read that fails, e.g. as it spans an unmapped page, are read one by one.
+    """
+
+    results: List[Optional[bytes]] = [None] * len(requests)
+    order = sorted(range(len(requests)), key=lambda i: requests[i][0])
+
+    error = lldb.SBError()
+    i = 0
+    while i < len(order):
+        start = requests[order[i]][0]
+        end = start + requests[order[i]][1]
+        j = i + 1
+        while j < len(order):
+            address, size = requests[order[j]]
+            if address - end > _MAX_READ_GAP or address + size - start > _MAX_READ_SIZE:
+                break
+            end = max(end, address + size)
+            j += 1
+
+        data = process.ReadMemory(start, end - start, error)
+        if error.Success():
+            for k in order[i:j]:
+                address, size = requests[k]
+                results[k] = data[address - start : address - start + size]
+        elif j - i > 1:
+            for k in order[i:j]:
+                address, size = requests[k]
+                data = process.ReadMemory(address, size, error)
+                if error.Success():
+                    results[k] = data
+        i = j
+
+    return results
+
+
+class _Column:
+    def __init__(self, expression: str) -> None:
+        self.expression = expression
+        self.typecode: Optional[str] = None
+        self.count = 1
+        # `count` values per row, for the rows in `rows`; rows whose value couldn't be read are
+        # left out
+        self.values: Optional[array] = None
+        self.rows = array("Q")
+
+    def append(self, row: int, plan: _ReadPlan, data: bytes):
+        if self.values is None:
+            self.typecode, self.count = plan.typecode, plan.count
+            self.values = array(plan.typecode)
+        elif (plan.typecode, plan.count) != (self.typecode, self.count):
+            # Same expression, different type at another location of the marker
+            return
+
+        values = array(plan.typecode, data)
+        if sys.byteorder != "little":
+            values.byteswap()
+        self.values.extend(values)
+        self.rows.append(row)
+
+    def to_list(self, num_rows: int) -> List:
+        rows: List = [None] * num_rows
+        if self.values is None:
+            return rows
+
+        values, count = self.values.tolist(), self.count
+        for i, row in enumerate(self.rows):
+            chunk = values[i * count : (i + 1) * count]
+            rows[row] = chunk[0] if count == 1 else chunk
+        return rows
+
+
+class _Site:
+    """A capture marker, with a column of captured values per expression."""
+
+    def __init__(self, where: str, expressions: List[str]) -> None:
+        self.where = where
+        self.columns = [_Column(expression) for expression in expressions]
+        self.timestamps = array("Q")
+        # Read plans are compiled per breakpoint location, as locals are laid out differently in
+        # each function a marker is inlined into. Expressions that can never be read there (e.g.
+        # variables in registers) have no plan.
+        self.plans: Dict[int, List[Optional[_ReadPlan]]] = dict()
+        # Per breakpoint location, expressions to compile again on the next hit, as they couldn't
+        # be resolved on earlier hits
+        self.retries: Dict[int, List[int]] = dict()
+        # Expressions that failed to compile, which are only reported once
+        self.failed = set()
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+
+class CaptureSession:
+    """
+    Sets auto-continuing breakpoints at all capture markers of a target and captures the values
+    of their expressions on each hit. Hits don't go through hook wrappers, StackFrame or Var.
+    """
+
+    _instance: Optional[CaptureSession] = None
+
+    def __init__(self, target: Target, marker_index: MarkerIndex) -> None:
+        self._target = target._inner
+        self._pointer_size = self._target.GetAddressByteSize()
+        # By breakpoint ID
+        self._sites: Dict[int, _Site] = dict()
+
+        for breakpoint, where, args in marker_breakpoints(
+            target, marker_index, MARKER_NAME
+        ):
+            try:
+                expressions = split_arguments(args)
+                for expression in expressions:
+                    _parse(expression)
+            except ValueError as e:
+                logging.error(f"Ignoring capture marker at {where}: {e}")
+                self._target.BreakpointDelete(breakpoint.GetID())
+                continue
+
+            logging.info(f"Capturing {', '.join(expressions)} at {where}")
+            breakpoint.SetAutoContinue(True)
+            breakpoint.SetScriptCallbackFunction("launch._capture_hit")
+            self._sites[breakpoint.GetID()] = _Site(where, expressions)
+
+    @staticmethod
+    def instance() -> CaptureSession:
+        assert (
+            CaptureSession._instance is not None
+        ), "Initialise using context manager: `with CaptureSession():`"
+        return CaptureSession._instance
+
+    def __len__(self) -> int:
+        return len(self._sites)
+
+    def _compile(
+        self,
+        frame: lldb.SBFrame,
+        site: _Site,
+        plans: List[Optional[_ReadPlan]],
+        columns: Iterable[int],
+    ) -> List[int]:
+        """Compile the plans of `columns` into `plans`. Returns the columns to try again later."""
+
+        retries = []
+        for i in columns:
+            expression = site.columns[i].expression
+            try:
+                plans[i] = _ReadPlan(frame, expression)
+            except (KeyError, ValueError) as e:
+                if isinstance(e, _Unresolved):
+                    retries.append(i)
+                if expression not in site.failed:
+                    site.failed.add(expression)
+                    later = " (yet)" if isinstance(e, _Unresolved) else ""
+                    logging.warning(
+                        f"Can't capture {expression} at {site.where}{later}: {e}"
+                    )
+        return retries
+
+    def on_hit(self, frame: lldb.SBFrame, bp_loc: lldb.SBBreakpointLocation):
+        site = self._sites.get(bp_loc.GetBreakpoint().GetID())
+        if site is None:
+            return False
+
+        row = len(site)
+        site.timestamps.append(time.perf_counter_ns())
+
+        location_id = bp_loc.GetID()
+        plans: Optional[List[Optional[_ReadPlan]]] = site.plans.get(location_id)
+        retries: Iterable[int]
+        if plans is None:
+            plans = [None] * len(site.columns)
+            site.plans[location_id] = plans
+            retries = range(len(site.columns))
+        else:
+            retries = site.retries.get(location_id, [])
+        if retries:
+            # Expressions that couldn't be resolved are tried again, e.g. pointers that were null
+            # on earlier hits
+            site.retries[location_id] = self._compile(frame, site, plans, retries)
+
+        process = frame.GetThread().GetProcess()
+        cfa = frame.GetCFA()
+        addresses: List[Optional[int]] = [
+            None
+            if plan is None
+            else plan.base + (cfa if plan.is_local else 0) + plan.offsets[0]
+            for plan in plans
+        ]
+
+        # Pointers are followed one level at a time, for all expressions at once
+        depth = max(
+            (len(plan.offsets) for plan in plans if plan is not None), default=0
+        )
+        for level in range(1, depth):
+            chasing = [
+                i
+                for (i, plan) in enumerate(plans)
+                if plan is not None
+                and addresses[i] is not None
+                and len(plan.offsets) > level
+            ]
+            pointers = _read_batch(
+                process, [(addresses[i], self._pointer_size) for i in chasing]
+            )
+            for i, pointer in zip(chasing, pointers):
+                addresses[i] = (
+                    None
+                    if pointer is None
+                    else int.from_bytes(pointer, "little") + plans[i].offsets[level]
+                )
+
+        reading = [i for (i, address) in enumerate(addresses) if address is not None]
+        data = _read_batch(process, [(addresses[i], plans[i].size) for i in reading])
+        for i, value in zip(reading, data):
+            if value is not None:
+                site.columns[i].append(row, plans[i], value)
+
+        return False
+
+    def on_exec(self):
+        """Compile plans afresh, as globals may live elsewhere in the new image."""
+
+        for site in self._sites.values():
+            site.plans.clear()
+            site.retries.clear()
+
+    def write(self, path: str):
+        """Write the captured values as JSON, with a column per expression for each marker."""
+
+        logging.info(f"Writing captured values to {path}")
+        with open(path, "w") as file:
+            json.dump(
+                {
+                    site.where: {
+                        "timestamp_ns": site.timestamps.tolist(),
+                        "values": {
+                            column.expression: column.to_list(len(site))
+                            for column in site.columns
+                        },
+                    }
+                    for site in self._sites.values()
+                },
+                file,
+                indent=2,
+            )
+
+    def __enter__(self):
+        if CaptureSession._instance is None:
+            CaptureSession._instance = self
+        return CaptureSession._instance
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        CaptureSession._instance = None
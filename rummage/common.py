@@ -0,0 +1,347 @@
+from __future__ import annotations
+
+import abc
+import importlib.util
+import inspect
+import logging
+import os
+import shlex
+import sys
+import types
+from pathlib import Path
+from typing import Any, Iterable, Optional, Tuple
+
+__all__ = [
+    "LineLocation",
+    "detach",
+    "GlobalFileWriter",
+    "get_hook_fns",
+]
+
+
+class ValueOps:
+    """
+    Arithmetic and comparison operators for wrappers of scalar values, stored in `self._value`.
+    """
+
+    _value: Any
+
+    def __int__(self):
+        return int(self._value)  # type: ignore - we should get a runtime error if this is not valid
+
+    def __index__(self):
+        return int(self._value)  # type: ignore - we should get a runtime error if this is not valid
+
+    def __float__(self):
+        return float(self._value)  # type: ignore - we should get a runtime error if this is not valid
+
+    def __add__(self, other):
+        return self._value + other
+
+    def __radd__(self, other):
+        return other + self._value
+
+    def __sub__(self, other):
+        return self._value - other
+
+    def __rsub__(self, other):
+        return other - self._value
+
+    def __mul__(self, other):
+        return self._value * other
+
+    def __rmul__(self, other):
+        return other * self._value
+
+    def __truediv__(self, other):
+        return self._value / other
+
+    def __rtruediv__(self, other):
+        return other / self._value
+
+    def __floordiv__(self, other):
+        return self._value // other
+
+    def __rfloordiv__(self, other):
+        return other // self._value
+
+    def __mod__(self, other):
+        return self._value % other
+
+    def __rmod__(self, other):
+        return other % self._value
+
+    def __pow__(self, other):
+        return self._value**other
+
+    def __rpow__(self, other):
+        return other**self._value
+
+    def __neg__(self):
+        return -self._value  # type: ignore - we should get a runtime error if this is not valid
+
+    def __abs__(self):
+        return abs(self._value)  # type: ignore - we should get a runtime error if this is not valid
+
+    def __eq__(self, other):
+        return self._value == other
+
+    def __ne__(self, other):
+        return self._value != other
+
+    def __lt__(self, other):
+        return self._value < other
+
+    def __le__(self, other):
+        return self._value <= other
+
+    def __gt__(self, other):
+        return self._value > other
+
+    def __ge__(self, other):
+        return self._value >= other
+
+
+class VarOps(ValueOps, abc.ABC):
+    """
+    Operations on wrappers of variables, shared by `rummage.Var` and its stand-in during replay.
+
+    Built on `self._traits` (what is known about the type of the variable, see `_TypeTraits` in
+    rummage.core) and the `_deref`, `_as_array` and `_members` primitives of each wrapper.
+    """
+
+    _traits: Any
+
+    @abc.abstractmethod
+    def _deref(self) -> VarOps:
+        """The variable a pointer points to."""
+
+    @abc.abstractmethod
+    def _as_array(self, len: int) -> VarOps:
+        """A pointer as an array of `len` elements."""
+
+    @abc.abstractmethod
+    def _members(self) -> Iterable[Tuple[str, VarOps]]:
+        """Members of a struct, as (name, variable) tuples."""
+
+    def _method(self, name: str):
+        """Methods emulated on variables, looked up if the variable has no member `name`."""
+
+        if name == "deref":
+            return types.MethodType(deref, self)
+        if name == "is_null":
+            return types.MethodType(is_null, self)
+        if name == "as_array":
+            return types.MethodType(as_array, self)
+
+        raise AttributeError(f"Attribute '{name}' is not defined")
+
+
+def deref(var: VarOps) -> VarOps:
+    type_ = var._traits.type
+    if not type_.is_pointer:
+        raise ValueError(f"Can't dereference a variable of type {type_.name}")
+
+    return var._deref()
+
+
+def is_null(var: VarOps) -> bool:
+    type_ = var._traits.type
+    if not type_.is_pointer:
+        raise ValueError(f"Variable of type {type_.name} can't be NULL")
+
+    return var == 0
+
+
+def as_array(var: VarOps, len: int) -> VarOps:
+    type_ = var._traits.type
+    if not type_.is_pointer:
+        raise ValueError(f"Can't cast a variable of type {type_.name} to an array.")
+
+    return var._as_array(len)
+
+
+def detach(var: VarOps, max_depth: int = 8) -> Any:
+    """
+    Copy the value of a variable into plain Python objects which remain valid after the target
+    resumes.
+
+    Scalars become ints, floats, bools or single-character strings, C strings become strings and
+    other pointers become their address. Arrays become lists and structs become dicts of their
+    members, down to `max_depth` levels; deeper levels are replaced by None.
+    """
+
+    traits = var._traits
+    if traits.converter is not None:
+        return traits.converter(var)
+
+    if var._value is not None:
+        if traits.is_character:
+            return str(var)
+        if traits.is_c_string and var._value != 0:
+            return str(var)
+        return var._value
+
+    if max_depth == 0:
+        return None
+
+    if traits.is_array:
+        return [detach(element, max_depth - 1) for element in var]
+
+    return {name: detach(member, max_depth - 1) for name, member in var._members()}
+
+
+class BreakpointLocationOps:
+    """`__str__` of breakpoint locations, which have a `line_location` and a `hit_count`."""
+
+    line_location: Any
+    hit_count: int
+
+    def __str__(self) -> str:
+        attrs = ["line_location", "hit_count"]
+        return f"<BreakpointLocation ({', '.join(f'{attr}: {getattr(self, attr)}' for attr in attrs)})>"
+
+
+class LineLocation:
+    def __init__(self, file_path, line_number) -> None:
+        self._file_path = file_path
+        self._line_number = line_number
+
+    @property
+    def file_path(self):
+        return self._file_path
+
+    @property
+    def line_number(self):
+        return self._line_number
+
+    def __str__(self):
+        return f"{self.file_path}:{self.line_number}"
+
+
+class GlobalFileWriter:
+    _instance: Optional[GlobalFileWriter] = None
+
+    def __init__(self) -> None:
+        self._files = dict()
+
+    @staticmethod
+    def instance():
+        assert (
+            GlobalFileWriter._instance is not None
+        ), "Initialise using context manager: `with FileOutput():"
+        return GlobalFileWriter._instance
+
+    def write(self, path: str, text):
+        file = self._files.get(path)
+        if file is None:
+            file = open(path, "w")
+            self._files[path] = file
+
+        assert not file.closed
+
+        file.write(f"{text}\n")
+
+    def __enter__(self):
+        if GlobalFileWriter._instance is None:
+            GlobalFileWriter._instance = GlobalFileWriter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for file in GlobalFileWriter.instance()._files.values():
+            file.close()
+        # Start from scratch in the next session, e.g. the next run served by a daemon
+        GlobalFileWriter._instance = None
+
+
+def get_hook_fns(module):
+    """
+    Retrieve all public function members and their names from a given module.
+
+    Args:
+        module: The module object from which to retrieve function members.
+
+    Returns:
+        A list of tuples, each containing the name of the function and
+        the function object itself.
+    """
+
+    # Note for the future: here we collect names of all function members as they appear as keys in
+    # the members dict of the module. It's important to distinguish between member names and the
+    # __name__ attribute of the members. They are not necessarily equal, e.g. in the case of
+    # hook wrappers that were bolted onto the module using setattr.
+    return [
+        (name, fn)
+        for (name, fn) in inspect.getmembers(module, inspect.isfunction)
+        if not name.startswith("_")
+    ]
+
+
+def import_module_from_file(file_path):
+    logging.info(f"Dynamically importing module from {file_path}")
+
+    module_name = file_path.replace("/", ".").replace("\\", ".").rstrip(".py")
+
+    spec = importlib.util.spec_from_file_location(module_name, file_path)
+    assert spec
+
+    module = importlib.util.module_from_spec(spec)
+
+    assert spec.loader
+    spec.loader.exec_module(module)
+
+    sys.modules[module_name] = module
+
+    return module
+
+
+def absolute_path(path) -> Path:
+    path = Path(path)
+    if not path.is_absolute():
+        path = Path(os.getcwd()) / path
+    return path
+
+
+def lldb_command_line(lldb_cmds):
+    # Generate flag to interleave with lldb commands
+    def flag():
+        while True:
+            yield "--one-line-before-file"
+
+    return [
+        "lldb",
+        "--batch",
+        "--source-quietly",
+        *[x for pair in zip(flag(), lldb_cmds) for x in pair],
+    ]
+
+
+def lldb_commands(hook_file, exe, args, *, log_level, launch_options=None):
+    """lldb commands that load the hooks and run `exe` with them."""
+
+    rummage_dir = Path(__file__).parent
+
+    prelude_file = rummage_dir / "prelude.py"
+    wrappers_file = rummage_dir / "hook_wrappers.py"
+    launch_file = rummage_dir / "launch.py"
+
+    hook_file = absolute_path(hook_file)
+
+    lldb_cmds = [
+        f"command script import {prelude_file}",
+        f"rummage_set_log_level {log_level}",
+        "rummage_load_venv",
+        f"command script import {wrappers_file}",
+        f"rummage_load_hooks {hook_file}",
+        f"command script import {launch_file}",
+        f"rummage_set_launch_exe {exe}",
+        f"rummage_set_launch_args {shlex.join(args)}",
+        # Options that are not set keep the defaults from rummage.LaunchConfig
+        *(
+            f"rummage_set_{name} {value}"
+            for name, value in (launch_options or {}).items()
+            if value is not None
+        ),
+        "rummage_launch",
+    ]
+
+    return lldb_cmds
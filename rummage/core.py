@@ -1,27 +1,40 @@
 from __future__ import annotations
 
-import inspect
 import json
 import logging
 import os
 import re
-import types
-from typing import Any, Iterable, List, Optional
+import struct
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 import lldb
 
+from . import formatters
+from .common import (
+    BreakpointLocationOps,
+    GlobalFileWriter,
+    LineLocation,
+    VarOps,
+    detach,
+    get_hook_fns,
+)
+from .replay import ARRAY, CHILD, DEREF, INDEX, MEMBER, TYPE_FLAGS, Recorder
+
 __all__ = [
     "BreakpointLocation",
     "LineLocation",
     "StackFrame",
     "Var",
     "VarInfo",
+    "detach",
     "GlobalFileWriter",
+    "StackTable",
     # TODO: Below are actually lib internals, could be moved somewhere else
     "Breakpoint",
     "Debugger",
     "Target",
     "LaunchConfig",
+    "MarkerIndex",
     "get_hook_fns",
 ]
 
@@ -257,40 +270,145 @@ class Type:
         return self.name
 
 
-class Var:
-    def __init__(self, sb_value: lldb.SBValue):
+def _record_type(type_: Type) -> int:
+    recorder = Recorder.current()
+    assert recorder is not None
+
+    pointee_type = type_.pointee_type
+    return recorder.type_id(
+        {
+            "name": type_.name,
+            "flags": [flag for flag in TYPE_FLAGS if getattr(type_, flag)],
+            "pointee": None if pointee_type is None else _record_type(pointee_type),
+        }
+    )
+
+
+class _TypeTraits:
+    """
+    Everything `Var` needs to know about a canonical type, worked out once per type: how to
+    extract its value, how to format and convert it, and the field names of structs.
+    """
+
+    # By the module of the type, its name and its size: types of different modules, or of different
+    # compile units of a module, may share names
+    _cache: Dict[Tuple[Tuple[str, str], str, int], _TypeTraits] = dict()
+    # Registry generation the cache was filled with; hooks are reloaded (clearing the registry)
+    # before every launch, so this also keeps types of different targets apart.
+    _generation = -1
+
+    def __init__(self, sb_type: lldb.SBType) -> None:
+        self.type = Type(sb_type)
+
+        type_ = self.type
+        self.extract: Optional[Callable[[lldb.SBValue], Any]] = None
+        if type_.is_integral_signed:
+            self.extract = lambda sb_value: int(sb_value.GetValueAsSigned())
+        elif type_.is_integral_unsigned:
+            self.extract = lambda sb_value: int(sb_value.GetValueAsUnsigned())
+        elif type_.is_floating_point:
+            self.extract = lambda sb_value: float(sb_value.GetValue())
+        elif type_.is_boolean:
+            self.extract = lambda sb_value: bool(sb_value.GetValueAsUnsigned())
+        elif type_.is_pointer:
+            self.extract = lambda sb_value: int(sb_value.GetValueAsUnsigned())
+
+        self.is_character = type_.is_character
+        self.is_pointer = type_.is_pointer
+        pointee_type = type_.pointee_type
+        self.is_c_string = pointee_type is not None and pointee_type.is_character
+        self.is_array = type_.is_array
+
+        self.formatter = formatters.find_formatter(type_.name)
+        self.converter = formatters.find_converter(type_.name)
+
+        # Members of plain structs and unions, in child order. Left as None where children don't
+        # map one-to-one to named fields (base classes, anonymous members), which are then named
+        # child by child.
+        self.field_names: Optional[List[str]] = None
+        if (
+            type_.type_class
+            in [lldb.eTypeClassStruct, lldb.eTypeClassClass, lldb.eTypeClassUnion]
+            and sb_type.GetNumberOfDirectBaseClasses() == 0
+        ):
+            names = [
+                sb_type.GetFieldAtIndex(i).GetName()
+                for i in range(sb_type.GetNumberOfFields())
+            ]
+            if all(names):
+                self.field_names = names
+
+    @staticmethod
+    def of(sb_type: lldb.SBType) -> _TypeTraits:
+        if _TypeTraits._generation != formatters.generation():
+            _TypeTraits._cache.clear()
+            _TypeTraits._generation = formatters.generation()
+
+        canonical_type = sb_type.GetCanonicalType()
+        name = canonical_type.GetName()
+        key = (
+            _module_key(canonical_type.GetModule()),
+            name,
+            canonical_type.GetByteSize(),
+        )
+        traits = _TypeTraits._cache.get(key)
+        if traits is None:
+            traits = _TypeTraits(canonical_type)
+            # Anonymous types of different layouts share names
+            if "(anonymous" not in name and "(unnamed" not in name:
+                _TypeTraits._cache[key] = traits
+        return traits
+
+
+class Var(VarOps):
+    def __init__(self, sb_value: lldb.SBValue, _rec: Optional[dict] = None):
         # TODO: Careful, any member here might clash with underlying struct's members.
         self._sb_value = sb_value
+        # What hooks read from this variable, when recording for replay (see rummage.replay)
+        self._rec = _rec
 
-        var_type = VarInfo(self).canonical_type
-        if var_type.is_integral_signed:
-            self._value = int(sb_value.GetValueAsSigned())
-        elif var_type.is_integral_unsigned:
-            self._value = int(sb_value.GetValueAsUnsigned())
-        elif var_type.is_floating_point:
-            self._value = float(sb_value.GetValue())
-        elif var_type.is_boolean:
-            self._value = bool(sb_value.GetValueAsUnsigned())
-        elif var_type.is_pointer:
-            self._value = int(sb_value.GetValueAsUnsigned())
-        else:
-            self._value = None
+        self._traits = _TypeTraits.of(sb_value.GetType())
+        extract = self._traits.extract
+        self._value = None if extract is None else extract(sb_value)
+
+        if _rec is not None:
+            _rec["t"] = _record_type(self._traits.type)
+            _rec["v"] = self._value
+
+    def _child(self, key: str, sb_value: lldb.SBValue) -> Var:
+        if self._rec is None:
+            return Var(sb_value)
+        return Var(sb_value, self._rec.setdefault("c", {}).setdefault(key, {}))
 
     def __getattr__(self, name) -> Any:
         # Search underlying variable for members with the given name
         child_sbvalue = self._sb_value.GetChildMemberWithName(name)
         if child_sbvalue and child_sbvalue.IsValid():
-            return Var(child_sbvalue)
+            return self._child(MEMBER + name, child_sbvalue)
 
         # If member of underlying variable don't clash, emulate methods on the Var object
-        if name == "deref":
-            return types.MethodType(deref, self)
-        if name == "is_null":
-            return types.MethodType(is_null, self)
-        if name == "as_array":
-            return types.MethodType(as_array, self)
+        return self._method(name)
+
+    def _deref(self) -> Var:
+        return self._child(DEREF, self._sb_value.Dereference())
 
-        raise AttributeError(f"Attribute '{name}' is not defined")
+    def _as_array(self, len: int) -> Var:
+        pointee_type = self._sb_value.GetType().GetCanonicalType().GetPointeeType()
+        return self._child(
+            ARRAY + str(len),
+            # Not sure why the deref, but it fixes tests...
+            self._sb_value.Dereference().Cast(pointee_type.GetArrayType(len)),
+        )
+
+    def _members(self) -> Iterable[Tuple[str, Var]]:
+        field_names = self._traits.field_names
+        if field_names is not None and self._rec is None:
+            # Names come from the struct's layout instead of being looked up member by member
+            return (
+                (name, self._child(CHILD + str(i), self._sb_value.GetChildAtIndex(i)))
+                for i, name in enumerate(field_names)
+            )
+        return ((VarInfo(member).name, member) for member in self)
 
     def __getitem__(self, key):
         if type(key) not in [int, Var]:
@@ -307,107 +425,40 @@ class Var:
 
         child_sb_value = self._sb_value.GetValueForExpressionPath(f"[{key}]")
         if child_sb_value and child_sb_value.IsValid():
-            return Var(child_sb_value)
+            return self._child(INDEX + str(int(key)), child_sb_value)
 
         raise IndexError(f"Index {key} is out of range")
 
     def __iter__(self):
         for i in range(len(self)):
-            yield Var(self._sb_value.GetChildAtIndex(i))
+            yield self._child(CHILD + str(i), self._sb_value.GetChildAtIndex(i))
 
     def __len__(self):
-        return self._sb_value.GetNumChildren()
-
-    def __int__(self):
-        return int(self._value)  # type: ignore - we should get a runtime error if this is not valid
-
-    def __index__(self):
-        return int(self._value)  # type: ignore - we should get a runtime error if this is not valid
-
-    def __float__(self):
-        return float(self._value)  # type: ignore - we should get a runtime error if this is not valid
-
-    def __add__(self, other):
-        return self._value + other
-
-    def __radd__(self, other):
-        return other + self._value
-
-    def __sub__(self, other):
-        return self._value - other
-
-    def __rsub__(self, other):
-        return other - self._value
-
-    def __mul__(self, other):
-        return self._value * other
-
-    def __rmul__(self, other):
-        return other * self._value
-
-    def __truediv__(self, other):
-        return self._value / other
-
-    def __rtruediv__(self, other):
-        return other / self._value
-
-    def __floordiv__(self, other):
-        return self._value // other
-
-    def __rfloordiv__(self, other):
-        return other // self._value
-
-    def __mod__(self, other):
-        return self._value % other
-
-    def __rmod__(self, other):
-        return other % self._value
-
-    def __pow__(self, other):
-        return self._value**other
-
-    def __rpow__(self, other):
-        return other**self._value
-
-    def __neg__(self):
-        return -self._value  # type: ignore - we should get a runtime error if this is not valid
-
-    def __abs__(self):
-        return abs(self._value)  # type: ignore - we should get a runtime error if this is not valid
-
-    def __eq__(self, other):
-        return self._value == other
-
-    def __ne__(self, other):
-        return self._value != other
-
-    def __lt__(self, other):
-        return self._value < other
+        length = self._sb_value.GetNumChildren()
+        if self._rec is not None:
+            self._rec["n"] = length
+        return length
 
-    def __le__(self, other):
-        return self._value <= other
-
-    def __gt__(self, other):
-        return self._value > other
+    def __str__(self) -> str:
+        string = self._format()
+        if self._rec is not None:
+            self._rec["s"] = string
+        return string
 
-    def __ge__(self, other):
-        return self._value >= other
+    def _format(self) -> str:
+        traits = self._traits
+        if traits.formatter is not None:
+            return traits.formatter(self)
 
-    def __str__(self) -> str:
-        var_info = VarInfo(self)
         if self._value is not None:
-            type_ = var_info.canonical_type
-
             # Special char handling
-            if type_.is_character:
+            if traits.is_character:
                 assert type(self._value) == int
                 return chr(self._value)
 
-            if type_.is_pointer:
-                assert type_.pointee_type is not None
-
+            if traits.is_pointer:
                 # Special C string handling
-                if type_.pointee_type.is_character:
+                if traits.is_c_string:
                     max_chars = 20
                     string, i, c = "", 0, "\0"
 
@@ -428,7 +479,8 @@ class Var:
 
             return str(self._value)
 
-        return f"<({var_info.canonical_type}) {var_info.name}>"
+        var_info = VarInfo(self)
+        return f"<({traits.type}) {var_info.name}>"
 
     def __repr__(self):
         var_info = VarInfo(self)
@@ -437,35 +489,6 @@ class Var:
         )
 
 
-def deref(var: Var) -> Var:
-    type_ = VarInfo(var).canonical_type
-    if not type_.is_pointer:
-        raise ValueError(f"Can't dereference a variable of type {type_.name}")
-
-    return Var(var._sb_value.Dereference())
-
-
-def is_null(var: Var) -> bool:
-    type_ = VarInfo(var).canonical_type
-    if not type_.is_pointer:
-        raise ValueError(f"Variable of type {type_.name} can't be NULL")
-
-    return var == 0
-
-
-def as_array(var: Var, len: int) -> Var:
-    type_ = var._sb_value.GetType()
-    if not type_.IsPointerType():
-        raise ValueError(
-            f"Can't cast a variable of type {type_.GetName()} to an array."
-        )
-
-    return Var(
-        # Not sure why the deref, but it fixes tests...
-        var._sb_value.Dereference().Cast(type_.GetPointeeType().GetArrayType(len))
-    )
-
-
 class VarInfo:
     """
     Class for accessing info about a variable.
@@ -476,42 +499,198 @@ class VarInfo:
 
     def __init__(self, var: Var) -> None:
         self._sb_value = var._sb_value
+        self._rec = var._rec
+        self._traits = var._traits
 
     @property
     def canonical_type(self) -> Type:
-        return Type(self._sb_value.GetType().GetCanonicalType())
+        return self._traits.type
 
     @property
     def name(self) -> str:
-        return self._sb_value.GetName()
+        name = self._sb_value.GetName()
+        if self._rec is not None:
+            self._rec["N"] = name
+        return name
 
     def __str__(self) -> str:
-        return f"<{self._sb_value}>"
+        info = f"<{self._sb_value}>"
+        if self._rec is not None:
+            self._rec["i"] = info
+        return info
+
+
+class _ExpressionPlan:
+    """How to evaluate an expression passed to `StackFrame.eval`, worked out once per hook."""
+
+    # Variables, members and constant indices, e.g. `node->children[3].value`
+    VARIABLE_PATH_REGEX = re.compile(
+        r"^\s*[A-Za-z_]\w*(\s*(\.|->)\s*[A-Za-z_]\w*|\s*\[\s*\d+\s*\])*\s*$"
+    )
+
+    # Calls, assignments and increments may change the state of the target. Comparisons aside,
+    # any `=` is an assignment, including compound ones like `+=` and the shifts `<<=` and `>>=`.
+    SIDE_EFFECT_REGEX = re.compile(r"\(|\+\+|--|<<=|>>=|(?<![=!<>])=(?!=)")
+
+    def __init__(self, expr: str) -> None:
+        self.is_variable_path = bool(_ExpressionPlan.VARIABLE_PATH_REGEX.match(expr))
+        self.is_cacheable = not _ExpressionPlan.SIDE_EFFECT_REGEX.search(expr)
+
+        self.options = lldb.SBExpressionOptions()
+        self.options.SetFetchDynamicValue(lldb.eNoDynamicValues)
+        # Don't fill the target with $0, $1, ... result variables
+        self.options.SetSuppressPersistentResult(True)
+        self.options.SetAutoApplyFixIts(False)
+
+
+# Expression plans, per hook name and expression
+_expression_plans: Dict[Optional[str], Dict[str, _ExpressionPlan]] = dict()
+
+
+def clear_expression_plans():
+    """Forget expression plans, e.g. as hooks are reloaded and may be gone or changed."""
+
+    _expression_plans.clear()
 
 
 class StackFrame:
-    def __init__(self, frame: lldb.SBFrame) -> None:
+    def __init__(
+        self,
+        frame: lldb.SBFrame,
+        hook_name: Optional[str] = None,
+        _rec: Optional[dict] = None,
+    ) -> None:
         self._inner = frame
+        self._hook_name = hook_name
+        # Results of side-effect free expressions, valid while the target stays stopped
+        self._eval_results: Dict[str, Var] = dict()
+        # What the hook read during this hit, when recording for replay (see rummage.replay)
+        self._rec = _rec
+
+    def _rec_node(self, section: str, key: str) -> Optional[dict]:
+        if self._rec is None:
+            return None
+        return self._rec.setdefault(section, {}).setdefault(key, {})
+
+    def _rec_missing(self, section: str, key: str):
+        if self._rec is not None:
+            self._rec.setdefault(section, {})[key] = None
 
     def var(self, name) -> Var:
         var = self._inner.FindVariable(name)
         if not var.IsValid():
+            self._rec_missing("vars", name)
             raise KeyError(f"Variable '{name}' not found")
-        return Var(var)
+        return Var(var, self._rec_node("vars", name))
+
+    @property
+    def target(self) -> Target:
+        return Target(self._inner.GetThread().GetProcess().GetTarget(), _rec=self._rec)
 
     @property
     def location(self):
         line_entry = self._inner.GetLineEntry()
         file_path = line_entry.GetFileSpec().GetFilename()
         line_number = line_entry.GetLine()
+        if self._rec is not None:
+            self._rec["location"] = [file_path, line_number]
         return LineLocation(file_path, line_number)
 
-    def eval(self, expr: str) -> lldb.SBValue:
-        # TODO: if value.IsValid() and value.GetError().Success():
-        return self._inner.EvaluateExpression(expr)
-
+    def eval(self, expr: str) -> Var:
+        """
+        Evaluate a C/C++ expression in the context of this frame.
+
+        Plain variable paths like `a.b[3]` are resolved directly, without compiling anything.
+        Other expressions go through lldb's expression parser, which is much slower; their results
+        are reused if the same side-effect free expression is evaluated again during this hit, until
+        an expression with side effects is evaluated.
+        """
+
+        result = self._eval_results.get(expr)
+        if result is not None:
+            return result
+
+        plans = _expression_plans.setdefault(self._hook_name, dict())
+        plan = plans.get(expr)
+        if plan is None:
+            plan = _ExpressionPlan(expr)
+            plans[expr] = plan
+
+        value = None
+        if plan.is_variable_path:
+            value = self._inner.GetValueForVariablePath(expr.strip())
+            if not (value.IsValid() and value.GetError().Success()):
+                # E.g. not a variable of this frame; leave it to the expression parser
+                value = None
+
+        if value is None:
+            value = self._inner.EvaluateExpression(expr, plan.options)
+            if not value.IsValid() or not value.GetError().Success():
+                self._rec_missing("eval", expr)
+                raise ValueError(
+                    f"Failed to evaluate expression '{expr}': {value.GetError()}"
+                )
 
-class BreakpointLocation:
+        result = Var(value, self._rec_node("eval", expr))
+        if plan.is_cacheable:
+            self._eval_results[expr] = result
+        else:
+            # May have changed what earlier expressions evaluate to
+            self._eval_results.clear()
+        return result
+
+    def _unwind(self, max_depth: int) -> Tuple[FrameKey, ...]:
+        table = StackTable.instance()
+        thread = self._inner.GetThread()
+
+        keys = []
+        prev_pc, inline_depth = None, 0
+        start = self._inner.GetFrameID()
+        # Not using GetNumFrames(), as that would unwind the entire stack
+        for index in range(start, start + max_depth):
+            frame = thread.GetFrameAtIndex(index)
+            if not frame.IsValid():
+                break
+
+            # Inlined calls show up as extra frames sharing the PC of the frame they're inlined into
+            pc = frame.GetPC()
+            inline_depth = inline_depth + 1 if pc == prev_pc else 0
+            prev_pc = pc
+
+            key = (pc, inline_depth)
+            table.symbolicate(key, frame)
+            keys.append(key)
+
+        return tuple(keys)
+
+    def backtrace(self, max_depth: int = 64) -> Tuple[Symbol, ...]:
+        """
+        Call stack starting at this frame, innermost first, as (function, file, line) tuples.
+
+        Symbols are cached by PC for the whole session, so only unwinding is repeated for stacks
+        that have been seen before.
+        """
+
+        backtrace = StackTable.instance().symbols(self._unwind(max_depth))
+        if self._rec is not None:
+            self._rec.setdefault("backtrace", {})[str(max_depth)] = backtrace
+        return backtrace
+
+    def stack_id(self, max_depth: int = 64) -> int:
+        """
+        ID of the call stack starting at this frame, as interned in the session's StackTable.
+
+        Cheaper to store than the backtrace itself; use `StackTable.instance().stack(stack_id)` to
+        get the backtrace back.
+        """
+
+        if self._rec is not None:
+            # IDs aren't stable across sessions, replay interns recorded backtraces instead
+            self.backtrace(max_depth)
+        return StackTable.instance().intern(self._unwind(max_depth))
+
+
+class BreakpointLocation(BreakpointLocationOps):
     def __init__(self, bp_loc: lldb.SBBreakpointLocation) -> None:
         self._inner = bp_loc
 
@@ -529,58 +708,73 @@ class BreakpointLocation:
     def hit_count(self) -> int:
         return self._inner.GetHitCount()
 
-    def __str__(self) -> str:
-        attrs = ["line_location", "hit_count"]
-        return f"<BreakpointLocation ({', '.join(f'{attr}: {getattr(self, attr)}' for attr in attrs)})>"
 
+# A PC along with the depth of inlining at that PC, identifying a frame of a backtrace
+FrameKey = Tuple[int, int]
 
-class LineLocation:
-    def __init__(self, file_path, line_number) -> None:
-        self._file_path = file_path
-        self._line_number = line_number
+# Function name, file path and line number
+Symbol = Tuple[str, str, int]
 
-    @property
-    def file_path(self):
-        return self._file_path
 
-    @property
-    def line_number(self):
-        return self._line_number
-
-    def __str__(self):
-        return f"{self.file_path}:{self.line_number}"
+class StackTable:
+    """
+    Session-wide symbol cache and table of interned call stacks.
 
+    Symbols are looked up through the SB API only the first time a PC is seen. Stacks are interned,
+    so that each distinct stack is stored once and identified by a small integer ID.
+    """
 
-class GlobalFileWriter:
-    _instance: Optional[GlobalFileWriter] = None
+    _instance: Optional[StackTable] = None
 
     def __init__(self) -> None:
-        self._files = dict()
+        self._symbols: Dict[FrameKey, Symbol] = dict()
+        self._stack_ids: Dict[Tuple[FrameKey, ...], int] = dict()
+        self._stacks: List[Tuple[FrameKey, ...]] = []
 
     @staticmethod
-    def instance():
+    def instance() -> StackTable:
         assert (
-            GlobalFileWriter._instance is not None
-        ), "Initialise using context manager: `with FileOutput():"
-        return GlobalFileWriter._instance
+            StackTable._instance is not None
+        ), "Initialise using context manager: `with StackTable():`"
+        return StackTable._instance
+
+    def symbolicate(self, key: FrameKey, frame: lldb.SBFrame) -> Symbol:
+        symbol = self._symbols.get(key)
+        if symbol is None:
+            line_entry = frame.GetLineEntry()
+            symbol = (
+                frame.GetFunctionName() or hex(key[0]),
+                line_entry.GetFileSpec().fullpath or "",
+                line_entry.GetLine(),
+            )
+            self._symbols[key] = symbol
+        return symbol
 
-    def write(self, path: str, text):
-        file = self._files.get(path)
-        if file is None:
-            file = open(path, "w")
-            self._files[path] = file
+    def symbols(self, keys: Iterable[FrameKey]) -> Tuple[Symbol, ...]:
+        return tuple(self._symbols[key] for key in keys)
 
-        assert not file.closed
+    def intern(self, keys: Tuple[FrameKey, ...]) -> int:
+        stack_id = self._stack_ids.get(keys)
+        if stack_id is None:
+            stack_id = len(self._stacks)
+            self._stack_ids[keys] = stack_id
+            self._stacks.append(keys)
+        return stack_id
 
-        file.write(f"{text}\n")
+    def stack(self, stack_id: int) -> Tuple[Symbol, ...]:
+        return self.symbols(self._stacks[stack_id])
+
+    def __len__(self) -> int:
+        return len(self._stacks)
 
     def __enter__(self):
-        if GlobalFileWriter._instance is None:
-            GlobalFileWriter._instance = GlobalFileWriter()
+        if StackTable._instance is None:
+            StackTable._instance = self
+        return StackTable._instance
 
     def __exit__(self, exc_type, exc_value, traceback):
-        for file in GlobalFileWriter.instance()._files.values():
-            file.close()
+        # PCs are only meaningful for the process they were collected from
+        StackTable._instance = None
 
 
 class Debugger:
@@ -591,9 +785,47 @@ class Debugger:
         return Target(self._inner.CreateTarget(exe))
 
 
+class _GlobalVar:
+    """Where a global variable lives and what type it is, looked up once by `Target.global_var`."""
+
+    def __init__(
+        self, address: lldb.SBAddress, load_address: int, sb_type: lldb.SBType
+    ) -> None:
+        self.load_address = load_address
+        self.sb_type = sb_type
+        # What the address resolved to: a module, identified by UUID and path, and an address in
+        # its file
+        self.module_key = _module_key(address.GetModule())
+        self.file_address = address.GetFileAddress()
+
+    def is_at(self, address: lldb.SBAddress) -> bool:
+        """
+        Whether the variable is still at `address`, which is resolved against the modules loaded
+        now. It isn't if the module was unloaded, even if another one was loaded in its place.
+        """
+
+        return (
+            address.GetFileAddress() == self.file_address
+            and _module_key(address.GetModule()) == self.module_key
+        )
+
+
+def _module_key(module: lldb.SBModule) -> Tuple[str, str]:
+    return module.GetUUIDString(), module.GetFileSpec().fullpath
+
+
+# Global variables resolved in the current process, by name and module, and the ID of the process
+# they were resolved in. Each variable is also checked to still be in the same place on each read,
+# as modules may be unloaded and others loaded at the same addresses.
+_global_vars: Dict[Tuple[str, Optional[str]], _GlobalVar] = dict()
+_global_vars_process: Optional[int] = None
+
+
 class Target:
-    def __init__(self, target: lldb.SBTarget):
+    def __init__(self, target: lldb.SBTarget, _rec: Optional[dict] = None):
         self._inner = target
+        # What the hook read during this hit, when recording for replay (see rummage.replay)
+        self._rec = _rec
 
     @property
     def modules(self) -> Iterable[lldb.SBModule]:
@@ -618,6 +850,97 @@ class Target:
             for i in range(launch_info.GetNumArguments())
         )
 
+    def _find_global(self, name: str, module: Optional[str]) -> Optional[lldb.SBValue]:
+        if module is None:
+            values = self._inner.FindGlobalVariables(name, 1)
+        else:
+            values = lldb.SBValueList()
+            for sb_module in self.modules:
+                if sb_module.GetFileSpec().GetFilename() == module:
+                    values = sb_module.FindGlobalVariables(self._inner, name, 1)
+                    break
+        return values.GetValueAtIndex(0) if values.GetSize() > 0 else None
+
+    def global_var(self, name: str, module: Optional[str] = None) -> Var:
+        """
+        Global or static variable `name`, looked up in the module whose file is named `module`
+        (e.g. "libfoo.so") if given, in all modules otherwise.
+
+        The address and type of the variable are looked up once; later calls only read its
+        current value, so reading globals from hot hooks costs about as much as reading locals.
+        """
+
+        global _global_vars_process
+
+        key = name if module is None else f"{module}`{name}"
+        rec = None
+        if self._rec is not None:
+            rec = self._rec.setdefault("globals", {}).setdefault(key, {})
+
+        target = self._inner
+        process = target.GetProcess().GetUniqueID()
+        if process != _global_vars_process:
+            _global_vars.clear()
+            _global_vars_process = process
+
+        cached = _global_vars.get((name, module))
+        if cached is not None:
+            address = lldb.SBAddress(cached.load_address, target)
+            if not cached.is_at(address):
+                logging.debug(f"Module of global variable {key} was unloaded")
+                cached = None
+        if cached is None:
+            value = self._find_global(name, module)
+            if value is None:
+                if self._rec is not None:
+                    self._rec["globals"][key] = None
+                raise KeyError(f"Global variable '{name}' not found")
+
+            load_address = value.GetLoadAddress()
+            if load_address == lldb.LLDB_INVALID_ADDRESS:
+                # E.g. thread-local variables, which live at a different address in each thread
+                return Var(value, rec)
+            address = lldb.SBAddress(load_address, target)
+            cached = _GlobalVar(address, load_address, value.GetType())
+            _global_vars[(name, module)] = cached
+
+        value = target.CreateValueFromAddress(name, address, cached.sb_type)
+        return Var(value, rec)
+
+
+_INLINE_STRATEGY_SETTING = "target.inline-breakpoint-strategy"
+
+# Per debugger: value of the setting before resolve_inlined_lines changed it
+_saved_inline_strategies: Dict[str, str] = dict()
+
+
+def resolve_inlined_lines(target: Target):
+    """
+    Make line breakpoints resolve in every compile unit a line was compiled into, which lldb only
+    does by default for files with header extensions.
+
+    This changes a setting of the whole debugger; see `restore_inline_strategy`.
+    """
+
+    debugger = target._inner.GetDebugger()
+    instance_name = debugger.GetInstanceName()
+    if instance_name not in _saved_inline_strategies:
+        values = lldb.SBDebugger.GetInternalVariableValue(
+            _INLINE_STRATEGY_SETTING, instance_name
+        )
+        if values.GetSize() > 0:
+            _saved_inline_strategies[instance_name] = values.GetStringAtIndex(0)
+
+    debugger.HandleCommand(f"settings set {_INLINE_STRATEGY_SETTING} always")
+
+
+def restore_inline_strategy(debugger: lldb.SBDebugger):
+    """Undo `resolve_inlined_lines` once the session that needed it is over."""
+
+    strategy = _saved_inline_strategies.pop(debugger.GetInstanceName(), None)
+    if strategy is not None:
+        debugger.HandleCommand(f"settings set {_INLINE_STRATEGY_SETTING} {strategy}")
+
 
 class Breakpoint:
     def __init__(self, target: Target):
@@ -664,7 +987,63 @@ class Breakpoint:
 
         return this
 
-    def set_callback_via_path(self, cb_name: str):
+    @staticmethod
+    def from_locations(
+        target, locations: Iterable[LineLocation], inlined: bool = False
+    ) -> Breakpoint:
+        """
+        Set breakpoints at the given lines. If `inlined`, lines may have been compiled into other
+        compile units than that of their file, and are looked up in all compile units.
+        """
+
+        this = Breakpoint(target)
+
+        if inlined:
+            resolve_inlined_lines(target)
+
+        for location in locations:
+            breakpoint = target._inner.BreakpointCreateByLocation(
+                location.file_path, location.line_number
+            )
+
+            if breakpoint.IsValid():
+                logging.info(f"Breakpoint set at {location}")
+                this._breakpoints.append(breakpoint)
+            else:
+                logging.warning(f"Failed to set breakpoint at {location}")
+
+        return this
+
+    @staticmethod
+    def from_addresses(target, addresses: Iterable[lldb.SBAddress]) -> Breakpoint:
+        this = Breakpoint(target)
+
+        for address in addresses:
+            breakpoint = target._inner.BreakpointCreateBySBAddress(address)
+
+            if breakpoint.IsValid():
+                logging.info(f"Breakpoint set at {address}")
+                this._breakpoints.append(breakpoint)
+            else:
+                logging.warning(f"Failed to set breakpoint at {address}")
+
+        return this
+
+    def extend(self, other: Breakpoint):
+        """Take over the breakpoints of `other`."""
+
+        self._breakpoints.extend(other._breakpoints)
+        other._breakpoints.clear()
+
+    def __len__(self) -> int:
+        return len(self._breakpoints)
+
+    def set_callback_via_path(self, cb_name: str, extra: Optional[dict] = None):
+        """
+        Call the function at `cb_name` on hits. `extra` is passed to it through extra_args, along
+        with the exe and args of the target.
+        """
+
         logging.debug(f"Breakpoint: adding callback {cb_name}")
         for b in self._breakpoints:
             extra_args = lldb.SBStructuredData()
@@ -673,36 +1052,244 @@ class Breakpoint:
                     {
                         "exe": self._target.exe,
                         "args": self._target.args,
+                        **(extra or {}),
                     }
                 )
             )
             b.SetScriptCallbackFunction(cb_name, extra_args)
 
+    def delete(self):
+        for b in self._breakpoints:
+            self._target._inner.BreakpointDelete(b.GetID())
+        self._breakpoints.clear()
 
-class LaunchConfig:
-    def __init__(self) -> None:
-        self.exe = None
-        self.args = []
 
+class MarkerIndex:
+    """
+    Locations of all rummage markers of a target.
 
-def get_hook_fns(module):
+    Markers compiled in with `RUMMAGE_MARK("<name>")` (see include/rummage.h) are read from the
+    `.rummage_marks` section of each module and located by address. `@rummage: <name>` comments
+    are found by scanning the sources of the target, which only happens once comment markers are
+    first looked up. Sources that aren't on disk, e.g. of binaries built elsewhere, are skipped.
+
+    Sources are the primary files of all compile units and their support files (the files of
+    their line tables, e.g. headers with inline functions). Each distinct file is scanned once, no
+    matter how many compile units include it or how many hooks are later looked up in the index.
+
+    Whatever follows the name of a marker, e.g. the expressions of `capture(a, b)`, is kept as the
+    arguments of the marker.
     """
-    Retrieve all public function members and their names from a given module.
 
-    Args:
-        module: The module object from which to retrieve function members.
+    # Arguments end at the end of the line, or of a block comment
+    MARKER_REGEX = re.compile(r"@rummage\s*:\s*(\w+)(.*?)\s*(?:\*/.*)?$")
+    NAME_REGEX = re.compile(r"\s*(\w+)(.*)", re.DOTALL)
+    SECTION_NAME = ".rummage_marks"
+
+    def __init__(self) -> None:
+        self._locations: Dict[str, List[LineLocation]] = dict()
+        self._addresses: Dict[str, List[lldb.SBAddress]] = dict()
+        # Arguments of each marker, in the same order as its locations or addresses
+        self._location_args: Dict[str, List[str]] = dict()
+        self._address_args: Dict[str, List[str]] = dict()
+        self._scanned_files = set()
+        # Sources to scan for marker comments once needed, in order and without duplicates
+        self._pending_files: Dict[str, None] = dict()
+        self._primary_files = set()
+
+    @staticmethod
+    def from_target(target: Target) -> MarkerIndex:
+        logging.info(f"Indexing rummage markers for {target.exe}...")
+
+        this = MarkerIndex()
+        for module in target.modules:
+            this.read_section(module)
+
+        for comp_unit in target.compile_units:
+            primary_file = this._add_pending_file(comp_unit.GetFileSpec())
+            if primary_file is not None:
+                this._primary_files.add(primary_file)
+
+            for i in range(comp_unit.GetNumSupportFiles()):
+                this._add_pending_file(comp_unit.GetSupportFileAtIndex(i))
+
+        num_compiled = sum(len(addresses) for addresses in this._addresses.values())
+        if num_compiled > 0:
+            logging.info(f"Found {num_compiled} compiled-in markers")
+        else:
+            this._scan_pending_files()
+        return this
+
+    @staticmethod
+    def parse_section(data: bytes, section_address: int) -> List[Tuple[str, int]]:
+        """
+        Parse the entries of a `.rummage_marks` section loaded at `section_address` into
+        (name, address) pairs.
+        """
+
+        marks = []
+        offset = 0
+        while offset + 4 < len(data):
+            (relative,) = struct.unpack_from("<i", data, offset)
+            end = data.index(b"\0", offset + 4)
+            name = data[offset + 4 : end].decode()
+            marks.append((name, section_address + offset + relative))
+            # Next entry starts at the next 4-byte boundary
+            offset = (end + 1 + 3) & ~3
+        return marks
+
+    def read_section(self, module: lldb.SBModule):
+        section = module.FindSection(MarkerIndex.SECTION_NAME)
+        if not section.IsValid():
+            return
+
+        error = lldb.SBError()
+        sb_data = section.GetSectionData()
+        data = sb_data.ReadRawData(error, 0, sb_data.GetByteSize())
+        if not error.Success():
+            logging.warning(
+                f"Failed to read {MarkerIndex.SECTION_NAME} of {module}: {error}"
+            )
+            return
+
+        for text, file_address in MarkerIndex.parse_section(
+            data, section.GetFileAddress()
+        ):
+            match = MarkerIndex.NAME_REGEX.match(text)
+            if match is None:
+                logging.warning(f"Ignoring compiled-in marker without a name: '{text}'")
+                continue
+            name, args = match[1], match[2].strip()
+
+            # Section-relative addresses stay valid wherever the module gets loaded
+            address = module.ResolveFileAddress(file_address)
+            logging.debug(f"Found compiled-in marker '{name}' at {address}")
+            self._addresses.setdefault(name, []).append(address)
+            self._address_args.setdefault(name, []).append(args)
+
+    def _add_pending_file(self, file_spec: lldb.SBFileSpec) -> Optional[str]:
+        if not file_spec.IsValid() or not file_spec.fullpath:
+            return None
+
+        # The same header may be referred to through different paths by different compile units
+        path = os.path.normpath(file_spec.fullpath)
+        if path not in self._scanned_files:
+            self._pending_files[path] = None
+        return path
+
+    def _scan_pending_files(self):
+        for path in self._pending_files:
+            self.scan_file(path)
+        self._pending_files.clear()
+        logging.info(f"Found {len(self)} markers in {len(self._scanned_files)} files")
+
+    def scan_file(self, path: str):
+        if path in self._scanned_files or not os.path.isfile(path):
+            return
+        self._scanned_files.add(path)
+
+        with open(path, "r") as file:
+            for line_number, line in enumerate(file, start=1):
+                match = MarkerIndex.MARKER_REGEX.search(line)
+                if match is None:
+                    continue
+
+                logging.debug(f"Found marker '{match[1]}' at {path}:{line_number}")
+                self._locations.setdefault(match[1], []).append(
+                    LineLocation(path, line_number)
+                )
+                self._location_args.setdefault(match[1], []).append(match[2].strip())
+
+    def is_primary_file(self, path: str) -> bool:
+        """
+        Whether `path` is the primary file of a compile unit. Lines of other files (e.g. inline
+        functions in headers) may have been compiled into any number of compile units.
+        """
+
+        return path in self._primary_files
+
+    def addresses(self, name: str) -> List[lldb.SBAddress]:
+        return self._addresses.get(name, [])
+
+    def locations(self, name: str) -> List[LineLocation]:
+        if self._pending_files:
+            self._scan_pending_files()
+        return self._locations.get(name, [])
+
+    def arguments(self, name: str) -> List[str]:
+        """
+        Arguments of the markers named `name`, in the same order as `addresses(name)`, or as
+        `locations(name)` if there are no compiled-in markers of that name.
+        """
+
+        if name in self._addresses:
+            return self._address_args[name]
+        if self._pending_files:
+            self._scan_pending_files()
+        return self._location_args.get(name, [])
+
+    @property
+    def names(self) -> List[str]:
+        if self._pending_files:
+            self._scan_pending_files()
+        return list(dict.fromkeys([*self._addresses, *self._locations]))
+
+    def __len__(self) -> int:
+        return sum(len(locations) for locations in self._locations.values()) + sum(
+            len(addresses) for addresses in self._addresses.values()
+        )
+
 
-    Returns:
-        A list of tuples, each containing the name of the function and
-        the function object itself.
+def marker_breakpoints(
+    target: Target, marker_index: MarkerIndex, name: str
+) -> List[Tuple[lldb.SBBreakpoint, str, str]]:
+    """
+    Set a breakpoint at each marker named `name`, for markers handled natively rather than by
+    hooks. Returns (breakpoint, description of the marker, arguments of the marker) tuples.
     """
 
-    # Note for the future: here we collect names of all function members as they appear as keys in
-    # the members dict of the module. It's important to distinguish between member names and the
-    # __name__ attribute of the members. They are not necessarily equal, e.g. in the case of
-    # hook wrappers that were bolted onto the module using setattr.
+    markers: List[Tuple[lldb.SBBreakpoint, str]] = []
+    addresses = marker_index.addresses(name)
+    if len(addresses) > 0:
+        for address in addresses:
+            breakpoint = target._inner.BreakpointCreateBySBAddress(address)
+            markers.append((breakpoint, str(address)))
+    else:
+        for location in marker_index.locations(name):
+            breakpoint = target._inner.BreakpointCreateByLocation(
+                location.file_path, location.line_number
+            )
+            markers.append((breakpoint, str(location)))
+
     return [
-        (name, fn)
-        for (name, fn) in inspect.getmembers(module, inspect.isfunction)
-        if not name.startswith("_")
+        (breakpoint, where, args)
+        for ((breakpoint, where), args) in zip(markers, marker_index.arguments(name))
     ]
+
+
+class LaunchConfig:
+    def __init__(self) -> None:
+        self.exe = None
+        self.args = []
+        self.summary_file = None
+        self.summary_interval = None
+        self.offload_workers = 4
+        self.offload_max_pending = 1024
+        self.offload_policy = "block"
+        self.coverage_file = None
+        self.profile_hz = None
+        self.profile_file = "rummage_profile.folded"
+        self.record_file = None
+        self.delta_keyframe_interval = 100
+        self.watch_interval = None
+        self.keep_state = False
+        self.remote_url = None
+        self.remote_platform = "remote-linux"
+        self.memory_cache_line_size = None
+        self.alloc_file = None
+        self.alloc_sample_every = 1
+        self.follow_forks = False
+        self.capture_file = "rummage_capture.json"
+        self.span_trace_file = "rummage_spans.json"
+        self.attach_pid = None
+        self.parent_pid = None
@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+from typing import List, Tuple
+
+import lldb
+
+from .core import LineLocation, MarkerIndex, Target, resolve_inlined_lines
+
+
+def _address_location(address: lldb.SBAddress) -> LineLocation:
+    """Source location of a compiled-in marker, or its module and address without debug info."""
+
+    line_entry = address.GetLineEntry()
+    if line_entry.IsValid():
+        return LineLocation(line_entry.GetFileSpec().fullpath, line_entry.GetLine())
+    return LineLocation(
+        address.GetModule().GetFileSpec().fullpath, address.GetFileAddress()
+    )
+
+
+class MarkerCoverage:
+    """
+    Hit counting for all markers of a target, without running any Python code on hits.
+
+    Every marker gets an auto-continuing breakpoint without a script callback, so lldb only counts
+    hits natively. Counts are read back from the breakpoint locations once the target has exited.
+    """
+
+    def __init__(self, target: Target, marker_index: MarkerIndex) -> None:
+        self._breakpoints: List[Tuple[str, LineLocation, lldb.SBBreakpoint]] = []
+
+        names = marker_index.names
+        if any(
+            not marker_index.is_primary_file(location.file_path)
+            for name in names
+            for location in marker_index.locations(name)
+        ):
+            resolve_inlined_lines(target)
+
+        for name in names:
+            for address in marker_index.addresses(name):
+                breakpoint = target._inner.BreakpointCreateBySBAddress(address)
+                self._add(name, _address_location(address), breakpoint)
+
+            for location in marker_index.locations(name):
+                breakpoint = target._inner.BreakpointCreateByLocation(
+                    location.file_path, location.line_number
+                )
+                self._add(name, location, breakpoint)
+
+        logging.info(f"Counting hits of {len(self._breakpoints)} markers")
+
+    def _add(self, name: str, location: LineLocation, breakpoint: lldb.SBBreakpoint):
+        if not breakpoint.IsValid():
+            logging.warning(f"Failed to set breakpoint at {location}")
+            return
+
+        breakpoint.SetAutoContinue(True)
+        self._breakpoints.append((name, location, breakpoint))
+
+    def hit_counts(self) -> List[Tuple[str, LineLocation, int]]:
+        counts = []
+        for name, location, breakpoint in self._breakpoints:
+            # Inlined code may give a marker more than one location
+            hits = sum(
+                breakpoint.GetLocationAtIndex(i).GetHitCount()
+                for i in range(breakpoint.GetNumLocations())
+            )
+            counts.append((name, location, hits))
+
+        counts.sort(key=lambda c: (c[1].file_path, c[1].line_number))
+        return counts
+
+    def write_report(self, path: str):
+        """
+        Write a text report to `path` and the same data as JSON next to it, with a .json suffix.
+        """
+
+        counts = self.hit_counts()
+        num_hit = sum(1 for _, _, hits in counts if hits > 0)
+
+        logging.info(f"Writing marker coverage report to {path}")
+        with open(path, "w") as file:
+            file.write(f"Markers hit: {num_hit}/{len(counts)}\n")
+            current_file = None
+            for name, location, hits in counts:
+                if location.file_path != current_file:
+                    current_file = location.file_path
+                    file.write(f"\n{current_file}\n")
+                file.write(f"  {location.line_number:>6}  {hits:>10}  {name}\n")
+
+        json_path = os.path.splitext(path)[0] + ".json"
+        with open(json_path, "w") as file:
+            json.dump(
+                {
+                    "markers_hit": num_hit,
+                    "markers_total": len(counts),
+                    "markers": [
+                        {
+                            "file": location.file_path,
+                            "line": location.line_number,
+                            "marker": name,
+                            "hits": hits,
+                        }
+                        for name, location, hits in counts
+                    ],
+                },
+                file,
+                indent=2,
+            )
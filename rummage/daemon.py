@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import shlex
+import socket
+from typing import Dict, Optional, Tuple
+
+import hook_wrappers  # type: ignore
+import launch  # type: ignore
+import lldb
+
+import rummage
+from rummage.core import restore_inline_strategy
+
+
+class _LoadedTarget:
+    def __init__(
+        self,
+        target: lldb.SBTarget,
+        stamp: Tuple[int, int, int],
+        marker_index: rummage.MarkerIndex,
+    ) -> None:
+        self.target = target
+        self.stamp = stamp
+        self.marker_index = marker_index
+
+
+# Targets kept alive between runs, keyed by the real path of the executable and the URL of the
+# remote platform they run on, if any
+_loaded_targets: Dict[Tuple[str, Optional[str]], _LoadedTarget] = dict()
+
+
+def _binary_stamp(path: str) -> Tuple[int, int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _get_target(debugger: lldb.SBDebugger, exe: str) -> _LoadedTarget:
+    exe = os.path.realpath(exe)
+    stamp = _binary_stamp(exe)
+    key = (exe, launch.LAUNCH_CONFIG.remote_url)
+
+    loaded = _loaded_targets.get(key)
+    if loaded is not None:
+        if loaded.stamp == stamp:
+            logging.info(f"Reusing loaded target for {exe}")
+            # Breakpoints are set again for the hooks of the incoming request
+            loaded.target.DeleteAllBreakpoints()
+            return loaded
+
+        logging.info(f"{exe} changed since it was loaded, reloading")
+        debugger.DeleteTarget(loaded.target)
+        del _loaded_targets[key]
+
+    target = debugger.CreateTarget(exe)
+    if not target.IsValid():
+        raise ValueError(f"Failed to create target for {exe}")
+
+    loaded = _LoadedTarget(
+        target, stamp, rummage.MarkerIndex.from_target(rummage.Target(target))
+    )
+    _loaded_targets[key] = loaded
+    return loaded
+
+
+def _run_request(debugger: lldb.SBDebugger, request: dict) -> dict:
+    os.chdir(request["cwd"])
+
+    hook_wrappers._cmd_load_wrapper_hooks(debugger, request["hook_file"])
+
+    # Each run starts from the default launch config, exactly like a fresh `rummage` invocation
+    launch.LAUNCH_CONFIG = rummage.LaunchConfig()
+    launch.LAUNCH_CONFIG.exe = request["exe"]
+    launch.LAUNCH_CONFIG.args = request["args"]
+    for name, value in request.get("launch_options", {}).items():
+        if value is not None:
+            debugger.HandleCommand(f"rummage_set_{name} {value}")
+
+    launch.select_platform(debugger)
+    loaded = _get_target(debugger, request["exe"])
+    try:
+        offload_failures = launch.launch(debugger, loaded.target, loaded.marker_index)
+    finally:
+        # The daemon's debugger is shared by all runs, so settings of one mustn't leak into the next
+        restore_inline_strategy(debugger)
+
+    process = loaded.target.GetProcess()
+    exit_status = process.GetExitStatus()
+    if process.IsValid() and process.GetState() != lldb.eStateExited:
+        # A hook asked to stop the target; there is no one to hand it over to, so clean up
+        process.Kill()
+
+    if offload_failures > 0:
+        return {
+            "ok": False,
+            "exit_status": exit_status,
+            "error": f"{offload_failures} calls of offloaded hooks failed",
+        }
+    return {"ok": True, "exit_status": exit_status}
+
+
+def _handle_connection(debugger: lldb.SBDebugger, connection: socket.socket):
+    with connection, connection.makefile("rw") as stream:
+        line = stream.readline()
+        if not line:
+            return
+
+        try:
+            request = json.loads(line)
+            logging.info(
+                f"Running {request['exe']} {shlex.join(request['args'])} "
+                f"with hooks from {request['hook_file']}"
+            )
+            response = _run_request(debugger, request)
+        except Exception as e:
+            logging.exception("Failed to serve request")
+            response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+        stream.write(json.dumps(response) + "\n")
+        stream.flush()
+
+
+def _cmd_serve(debugger, socket_path, *_):
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_path)
+        server.listen()
+        logging.info(f"Rummage daemon listening on {socket_path}")
+
+        try:
+            while True:
+                connection, _ = server.accept()
+                _handle_connection(debugger, connection)
+        finally:
+            os.unlink(socket_path)
+
+
+def __lldb_init_module(debugger, *_):
+    debugger.HandleCommand("command script add -f daemon._cmd_serve rummage_serve")
+
+
+# Just to suppress "unused private function" lints
+__lldb_init_module = __lldb_init_module
+_cmd_serve = _cmd_serve
@@ -0,0 +1,344 @@
+"""
+Delta-encoded snapshot traces.
+
+Hooks that log the same, mostly unchanged state on every hit can use `GlobalDeltaWriter` to only
+store the fields that changed since the previous hit of the same stream (typically one stream per
+hook). Every `keyframe_interval` hits, a full snapshot is written instead, so that the state at any
+hit can be rebuilt without reading the trace from the start.
+
+File layout: an 8-byte magic and a u16 version, followed by records of the form
+`[u8 kind][u32 body length][body]`. All integers are little endian.
+
+  - "S" stream: u32 stream ID, utf8 stream name
+  - "N" field name: u32 field ID, utf8 field path, e.g. `node.children[2].value`
+  - "K" keyframe / "D" delta: u32 stream ID, u64 hit, u32 number of entries, then for each entry
+    u32 field ID, u8 value tag and the value
+"""
+
+from __future__ import annotations
+
+import bisect
+import mmap
+import struct
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from .common import ValueOps
+
+__all__ = [
+    "DeltaTraceWriter",
+    "DeltaTraceReader",
+    "GlobalDeltaWriter",
+]
+
+MAGIC = b"RMGDELTA"
+VERSION = 1
+
+_RECORD_HEADER = struct.Struct("<cI")
+_FRAME_HEADER = struct.Struct("<IQI")
+_ENTRY_HEADER = struct.Struct("<IB")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+
+# Value tags
+_REMOVED = 0
+_NONE = 1
+_FALSE = 2
+_TRUE = 3
+_INT = 4
+_FLOAT = 5
+_STR = 6
+_BIG_INT = 7
+
+# Marks fields that are gone since the previous hit
+_REMOVED_VALUE = object()
+
+
+def flatten(state: Any, prefix: str = "", out: Optional[Dict[str, Any]] = None):
+    """
+    Flatten nested dicts and lists into a dict of field paths to scalar values.
+
+    Vars are copied with `rummage.detach` first.
+    """
+
+    if out is None:
+        out = dict()
+
+    if isinstance(state, ValueOps):
+        # Resolved at call time, so that replay stand-ins are used when replaying
+        import rummage
+
+        state = rummage.detach(state)
+
+    if isinstance(state, dict):
+        for key, value in state.items():
+            flatten(value, f"{prefix}.{key}" if prefix else str(key), out)
+    elif isinstance(state, (list, tuple)):
+        for i, value in enumerate(state):
+            flatten(value, f"{prefix}[{i}]", out)
+    else:
+        out[prefix] = state
+
+    return out
+
+
+def _encode_value(value: Any) -> Tuple[int, bytes]:
+    if value is _REMOVED_VALUE:
+        return _REMOVED, b""
+    if value is None:
+        return _NONE, b""
+    if isinstance(value, bool):
+        return (_TRUE if value else _FALSE), b""
+    if isinstance(value, int) and -(1 << 63) <= value < (1 << 63):
+        return _INT, _I64.pack(value)
+    if isinstance(value, float):
+        return _FLOAT, _F64.pack(value)
+
+    encoded = str(value).encode()
+    return (_BIG_INT if isinstance(value, int) else _STR), _U32.pack(
+        len(encoded)
+    ) + encoded
+
+
+def _decode_value(tag: int, data: bytes, offset: int) -> Tuple[Any, int]:
+    if tag == _REMOVED:
+        return _REMOVED_VALUE, offset
+    if tag == _NONE:
+        return None, offset
+    if tag == _FALSE:
+        return False, offset
+    if tag == _TRUE:
+        return True, offset
+    if tag == _INT:
+        return _I64.unpack_from(data, offset)[0], offset + _I64.size
+    if tag == _FLOAT:
+        return _F64.unpack_from(data, offset)[0], offset + _F64.size
+
+    (length,) = _U32.unpack_from(data, offset)
+    offset += _U32.size
+    text = bytes(data[offset : offset + length]).decode()
+    return (int(text) if tag == _BIG_INT else text), offset + length
+
+
+def _check_keyframe_interval(keyframe_interval: int):
+    if keyframe_interval < 1:
+        raise ValueError(
+            f"Keyframe interval must be at least 1, got {keyframe_interval}"
+        )
+
+
+class DeltaTraceWriter:
+    def __init__(self, path: str, keyframe_interval: int = 100) -> None:
+        _check_keyframe_interval(keyframe_interval)
+        self._file: BinaryIO = open(path, "wb")
+        self._file.write(MAGIC + struct.pack("<H", VERSION))
+        self._keyframe_interval = keyframe_interval
+
+        self._field_ids: Dict[str, int] = dict()
+        self._stream_ids: Dict[str, int] = dict()
+        # Per stream: number of hits so far and the state at the last hit
+        self._hits: Dict[int, int] = dict()
+        self._states: Dict[int, Dict[str, Any]] = dict()
+
+    def _record(self, kind: bytes, body: bytes):
+        self._file.write(_RECORD_HEADER.pack(kind, len(body)))
+        self._file.write(body)
+
+    def _stream_id(self, stream: str) -> int:
+        stream_id = self._stream_ids.get(stream)
+        if stream_id is None:
+            stream_id = len(self._stream_ids)
+            self._stream_ids[stream] = stream_id
+            self._record(b"S", _U32.pack(stream_id) + stream.encode())
+        return stream_id
+
+    def _field_id(self, path: str) -> int:
+        field_id = self._field_ids.get(path)
+        if field_id is None:
+            field_id = len(self._field_ids)
+            self._field_ids[path] = field_id
+            self._record(b"N", _U32.pack(field_id) + path.encode())
+        return field_id
+
+    def write(self, stream: str, state: Any) -> int:
+        """
+        Record `state` (a Var, or nested dicts and lists of Vars and plain values) as the next hit
+        of `stream`. Returns the hit number.
+        """
+
+        stream_id = self._stream_id(stream)
+        hit = self._hits.get(stream_id, 0)
+        self._hits[stream_id] = hit + 1
+
+        current = flatten(state)
+        previous = self._states.get(stream_id)
+        self._states[stream_id] = current
+
+        if previous is None or hit % self._keyframe_interval == 0:
+            kind, changes = b"K", current
+        else:
+            kind = b"D"
+            changes = {
+                path: value
+                for path, value in current.items()
+                if path not in previous
+                or previous[path] != value
+                # E.g. False and 0 compare equal
+                or type(previous[path]) is not type(value)
+            }
+            for path in previous.keys() - current.keys():
+                changes[path] = _REMOVED_VALUE
+
+        entries = []
+        for path, value in changes.items():
+            tag, encoded = _encode_value(value)
+            entries.append(_ENTRY_HEADER.pack(self._field_id(path), tag))
+            entries.append(encoded)
+
+        header = _FRAME_HEADER.pack(stream_id, hit, len(changes))
+        self._record(kind, header + b"".join(entries))
+        return hit
+
+    def close(self):
+        self._file.close()
+
+
+class GlobalDeltaWriter:
+    """Session-wide delta trace writers, keyed by path and closed when the session ends."""
+
+    _instance: Optional[GlobalDeltaWriter] = None
+
+    def __init__(self, keyframe_interval: int = 100) -> None:
+        # Checked here already, as writers are only opened on the first write
+        _check_keyframe_interval(keyframe_interval)
+        self._keyframe_interval = keyframe_interval
+        self._writers: Dict[str, DeltaTraceWriter] = dict()
+
+    @staticmethod
+    def instance() -> GlobalDeltaWriter:
+        assert (
+            GlobalDeltaWriter._instance is not None
+        ), "Initialise using context manager: `with GlobalDeltaWriter():`"
+        return GlobalDeltaWriter._instance
+
+    def write(self, path: str, stream: str, state: Any) -> int:
+        writer = self._writers.get(path)
+        if writer is None:
+            writer = DeltaTraceWriter(path, self._keyframe_interval)
+            self._writers[path] = writer
+        return writer.write(stream, state)
+
+    def __enter__(self):
+        if GlobalDeltaWriter._instance is None:
+            GlobalDeltaWriter._instance = self
+        return GlobalDeltaWriter._instance
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for writer in GlobalDeltaWriter.instance()._writers.values():
+            writer.close()
+        GlobalDeltaWriter._instance = None
+
+
+class DeltaTraceReader:
+    """
+    Reader of delta traces, rebuilding the full (flattened) state of a stream at any hit.
+
+    The trace is memory-mapped. Opening it reads record headers only, to index keyframes and
+    deltas by hit; the frames needed to rebuild a state are read from disk as they're accessed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = memoryview(self._mmap)
+
+        if bytes(self._data[: len(MAGIC)]) != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a rummage delta trace")
+
+        self._names: Dict[int, str] = dict()
+        self._streams: Dict[str, int] = dict()
+        # Per stream: offsets of frame bodies by hit, and hits that have keyframes
+        self._frames: Dict[int, List[int]] = dict()
+        self._keyframes: Dict[int, List[int]] = dict()
+
+        offset = len(MAGIC) + 2
+        while offset < len(self._data):
+            kind, length = _RECORD_HEADER.unpack_from(self._data, offset)
+            offset += _RECORD_HEADER.size
+            body = offset
+            offset += length
+
+            if kind == b"S":
+                (stream_id,) = _U32.unpack_from(self._data, body)
+                name = bytes(self._data[body + 4 : offset]).decode()
+                self._streams[name] = stream_id
+            elif kind == b"N":
+                (field_id,) = _U32.unpack_from(self._data, body)
+                self._names[field_id] = bytes(self._data[body + 4 : offset]).decode()
+            else:
+                stream_id, hit, _ = _FRAME_HEADER.unpack_from(self._data, body)
+                frames = self._frames.setdefault(stream_id, [])
+                assert hit == len(frames), "Hits of a stream must be consecutive"
+                frames.append(body)
+                if kind == b"K":
+                    self._keyframes.setdefault(stream_id, []).append(hit)
+
+    @property
+    def streams(self) -> List[str]:
+        return list(self._streams)
+
+    def num_hits(self, stream: str) -> int:
+        return len(self._frames.get(self._streams[stream], []))
+
+    def _apply(self, state: Dict[str, Any], body: int):
+        _, _, num_entries = _FRAME_HEADER.unpack_from(self._data, body)
+        offset = body + _FRAME_HEADER.size
+        for _ in range(num_entries):
+            field_id, tag = _ENTRY_HEADER.unpack_from(self._data, offset)
+            value, offset = _decode_value(tag, self._data, offset + _ENTRY_HEADER.size)
+            path = self._names[field_id]
+            if value is _REMOVED_VALUE:
+                state.pop(path, None)
+            else:
+                state[path] = value
+
+    def state_at(self, stream: str, hit: int) -> Dict[str, Any]:
+        stream_id = self._streams[stream]
+        frames = self._frames[stream_id]
+        if not 0 <= hit < len(frames):
+            raise IndexError(f"Stream {stream} has no hit {hit}")
+
+        keyframes = self._keyframes[stream_id]
+        start = keyframes[bisect.bisect_right(keyframes, hit) - 1]
+
+        state: Dict[str, Any] = dict()
+        for body in frames[start : hit + 1]:
+            self._apply(state, body)
+        return state
+
+    def states(self, stream: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Iterate over the states at all hits of a stream, in order."""
+
+        stream_id = self._streams[stream]
+        keyframes = set(self._keyframes.get(stream_id, []))
+        state: Dict[str, Any] = dict()
+        for hit, body in enumerate(self._frames.get(stream_id, [])):
+            if hit in keyframes:
+                state = dict()
+            self._apply(state, body)
+            yield hit, dict(state)
+
+    def close(self):
+        self._data.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"<DeltaTraceReader streams: {self.streams}>"
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import logging
+import os
+import signal
+from typing import Callable, Dict, Optional, Tuple
+
+import lldb
+
+from .alloc import ABI_REGISTERS, entry_breakpoint
+
+# Functions creating child processes. Forks return the pid of the child, and so does clone unless
+# it creates a thread; posix_spawn writes it to where its first argument points.
+_FORKS = ["fork", "vfork", "clone", "posix_spawn", "posix_spawnp"]
+_CLONE = "clone"
+_SPAWNS = ["posix_spawn", "posix_spawnp"]
+_CLONE_THREAD = 0x00010000
+
+
+class ForkFollower:
+    """
+    Catches children forked by the target and hands each one to `spawn`, called with the pid of
+    the child and of its parent, which is expected to start a rummage session attaching to the
+    child. Sessions of children run in parallel to the parent's.
+
+    Children created with fork, vfork, clone (other than threads) and posix_spawn are caught on
+    return in the parent, where the pid of the child is read, with the same return site
+    breakpoints as AllocationTracker. lldb detaches from children as they are created, so the
+    child is stopped with SIGSTOP right away and is resumed by its own session once attached.
+    Until then the child runs freely: whatever it does in the short time before it is stopped is
+    not traced. Children of posix_spawn have already exec'd by then.
+
+    Children created with clone3 or raw system calls, which have no function to break on, are not
+    followed.
+    """
+
+    _instance: Optional[ForkFollower] = None
+
+    def __init__(
+        self, target: lldb.SBTarget, spawn: Callable[[int, int], object]
+    ) -> None:
+        self._target = target
+        self._spawn = spawn
+
+        arch = target.GetTriple().split("-")[0]
+        if arch not in ABI_REGISTERS:
+            raise ValueError(f"Following forks isn't supported on {arch}")
+        self._arg_registers, self._return_register = ABI_REGISTERS[arch]
+
+        # Per thread: return address, stack pointer and pid pointer (posix_spawn) of the call in
+        # progress
+        self._pending: Dict[int, Tuple[int, int, int]] = dict()
+        self._return_sites: Dict[int, lldb.SBBreakpoint] = dict()
+
+        self._kinds: Dict[int, str] = dict()
+        for name in _FORKS:
+            # Arguments are read from registers on entry
+            breakpoint = entry_breakpoint(target, name)
+            breakpoint.SetAutoContinue(True)
+            breakpoint.SetScriptCallbackFunction("launch._fork_entry")
+            self._kinds[breakpoint.GetID()] = name
+
+    @staticmethod
+    def instance() -> ForkFollower:
+        assert (
+            ForkFollower._instance is not None
+        ), "Initialise using context manager: `with ForkFollower():`"
+        return ForkFollower._instance
+
+    def _register(self, frame: lldb.SBFrame, name: str) -> int:
+        return frame.FindRegister(name).GetValueAsUnsigned()
+
+    def on_entry(self, frame: lldb.SBFrame, bp_loc: lldb.SBBreakpointLocation):
+        kind = self._kinds[bp_loc.GetBreakpoint().GetID()]
+        thread = frame.GetThread()
+
+        sp = frame.GetSP()
+        pending = self._pending.get(thread.GetThreadID())
+        if pending is not None and pending[1] > sp:
+            # Called by another of the functions, e.g. posix_spawn calling clone
+            return False
+
+        pid_address = 0
+        if kind == _CLONE:
+            if self._register(frame, self._arg_registers[2]) & _CLONE_THREAD:
+                return False
+        elif kind in _SPAWNS:
+            pid_address = self._register(frame, self._arg_registers[0])
+            if pid_address == 0:
+                logging.warning(
+                    f"Not following a child of {kind}, which isn't given its pid"
+                )
+                return False
+
+        caller = thread.GetFrameAtIndex(1)
+        if not caller.IsValid():
+            return False
+        return_pc = caller.GetPC()
+        self._pending[thread.GetThreadID()] = (return_pc, sp, pid_address)
+
+        if return_pc not in self._return_sites:
+            breakpoint = self._target.BreakpointCreateByAddress(return_pc)
+            breakpoint.SetAutoContinue(True)
+            breakpoint.SetScriptCallbackFunction("launch._fork_return")
+            self._return_sites[return_pc] = breakpoint
+
+        return False
+
+    def on_return(self, frame: lldb.SBFrame):
+        thread_id = frame.GetThread().GetThreadID()
+        pending = self._pending.get(thread_id)
+        # Return sites may be shared with other calls
+        if pending is None or pending[0] != frame.GetPC():
+            return False
+        del self._pending[thread_id]
+        _, _, pid_address = pending
+
+        # The register is 64 bits wide, but the functions return a 32-bit int
+        result = self._register(frame, self._return_register) & 0xFFFFFFFF
+        if pid_address != 0:
+            # posix_spawn returns an error number, and the pid through its first argument
+            if result != 0:
+                return False
+            error = lldb.SBError()
+            pid = frame.GetThread().GetProcess().ReadUnsignedFromMemory(
+                pid_address, 4, error
+            )
+            if not error.Success():
+                logging.warning(f"Failed to read the pid of a spawned child: {error}")
+                return False
+        else:
+            # The pid, or -1 on failure
+            pid = result
+            if pid == 0 or pid >= 0x80000000:
+                return False
+
+        try:
+            os.kill(pid, signal.SIGSTOP)
+        except ProcessLookupError:
+            logging.warning(f"Forked child {pid} exited before it could be followed")
+            return False
+
+        ppid = frame.GetThread().GetProcess().GetProcessID()
+        logging.info(f"Following child {pid} forked by {ppid}")
+        self._spawn(pid, ppid)
+        return False
+
+    def on_exec(self):
+        """Forget return sites, which are addresses in the image the target exec'd away from."""
+
+        for breakpoint in self._return_sites.values():
+            self._target.BreakpointDelete(breakpoint.GetID())
+        self._return_sites.clear()
+        self._pending.clear()
+
+    def __enter__(self):
+        if ForkFollower._instance is None:
+            ForkFollower._instance = self
+        return ForkFollower._instance
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        ForkFollower._instance = None
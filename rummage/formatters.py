@@ -0,0 +1,112 @@
+"""
+Registry of per-type formatters and converters.
+
+A formatter decides what `str(var)` returns for variables of a type and a converter decides what
+`rummage.detach(var)` returns. Both are registered for a canonical type name, or for a regex
+matched against it, much like lldb's `type summary add [-x]`:
+
+    @rummage.formatter("Point")
+    def _format_point(point):
+        return f"({point.x}, {point.y})"
+
+The registry is looked up once per canonical type and the result is cached along with everything
+else rummage needs to know about the type, so formatting many values of a type inspects it once.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Any, Callable, List, Optional, Pattern, Tuple, Union
+
+__all__ = [
+    "formatter",
+    "converter",
+]
+
+Formatter = Callable[[Any], str]
+Converter = Callable[[Any], Any]
+
+_formatters: List[Tuple[Union[str, Pattern[str]], Formatter]] = []
+_converters: List[Tuple[Union[str, Pattern[str]], Converter]] = []
+
+# Bumped on every change, so that cached lookups can be invalidated
+_generation = 0
+
+
+def _register(registry: List[Tuple[Any, Any]], type_name: str, regex: bool, fn):
+    global _generation
+
+    key = re.compile(type_name) if regex else type_name
+    # Registering the same name again (e.g. when hooks are reloaded) replaces the previous entry
+    registry[:] = [(k, f) for (k, f) in registry if k != key]
+    registry.append((key, fn))
+    _generation += 1
+
+
+def formatter(type_name: str, regex: bool = False):
+    """
+    Register the decorated function as the formatter of variables whose canonical type is named
+    `type_name` (or fully matches it, if `regex`). It is called with the Var and must return a
+    string.
+    """
+
+    def decorate(fn: Formatter) -> Formatter:
+        _register(_formatters, type_name, regex, fn)
+        return fn
+
+    return decorate
+
+
+def converter(type_name: str, regex: bool = False):
+    """
+    Register the decorated function as the converter of variables whose canonical type is named
+    `type_name` (or fully matches it, if `regex`). It is called with the Var by `rummage.detach`
+    and must return plain Python objects.
+    """
+
+    def decorate(fn: Converter) -> Converter:
+        _register(_converters, type_name, regex, fn)
+        return fn
+
+    return decorate
+
+
+def _find(registry, type_name: str):
+    # Later registrations take precedence
+    for key, fn in reversed(registry):
+        if key == type_name if isinstance(key, str) else key.fullmatch(type_name):
+            return fn
+    return None
+
+
+def find_formatter(type_name: str) -> Optional[Formatter]:
+    return _find(_formatters, type_name)
+
+
+def find_converter(type_name: str) -> Optional[Converter]:
+    return _find(_converters, type_name)
+
+
+def generation() -> int:
+    return _generation
+
+
+def save():
+    """Registered formatters and converters, to go back to with `restore`."""
+
+    return list(_formatters), list(_converters)
+
+
+def restore(saved):
+    global _generation
+
+    _formatters[:], _converters[:] = saved
+    _generation += 1
+
+
+def clear():
+    global _generation
+
+    _formatters.clear()
+    _converters.clear()
+    _generation += 1
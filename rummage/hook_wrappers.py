@@ -1,7 +1,10 @@
-import importlib.util as _import_util
+import importlib as _importlib
 import json as _json
 import logging as _logging
+import os as _os
 import sys as _sys
+import threading as _threading
+import time as _time
 
 import lldb as _lldb
 
@@ -9,23 +12,20 @@ import rummage as _rummage
 
 _this_module = _sys.modules[__name__]
 
+# Names of the hook wrappers currently added to this module
+_hook_names = []
 
-def _import_module_from_file(file_path):
-    _logging.info(f"Dynamically importing module from {file_path}")
+# Hook file currently loaded, and its modification time when it was loaded
+_hook_file = None
+_hook_file_mtime_ns = None
 
-    module_name = file_path.replace("/", ".").replace("\\", ".").rstrip(".py")
-
-    spec = _import_util.spec_from_file_location(module_name, file_path)
-    assert spec
-
-    module = _import_util.module_from_spec(spec)
-
-    assert spec.loader
-    spec.loader.exec_module(module)
-
-    _sys.modules[module_name] = module
-
-    return module
+# Seconds between checks of the hook file for changes while watching it, None if not watching
+_watch_interval = None
+_next_watch_check = 0.0
+# Hooks of processes followed within the same lldb (see launch._Session) run on several threads
+_watch_lock = _threading.Lock()
+# Called with the sets of removed and added hook names whenever hooks are reloaded
+_reload_listeners = []
 
 
 def _create_hook_wrappers(hook_module):
@@ -50,6 +50,8 @@ def _create_hook_wrappers(hook_module):
         # to the current `fn`. Otherwise all wrappers would refer to the last `name` and `fn` in
         # `hook_fns` due to late binding in Python closures.
         def add_hook_wrapper(name=name, fn=fn):
+            offload_spec = getattr(fn, "_rummage_offload", None)
+
             # We ignore args other than `frame`
             def hook_wrapper(
                 frame: _lldb.SBFrame,
@@ -57,6 +59,14 @@ def _create_hook_wrappers(hook_module):
                 extra_args: _lldb.SBStructuredData,
                 *_,
             ):
+                pause_start_ns = _time.perf_counter_ns()
+
+                if _watch_interval is not None and _check_hook_file():
+                    # Hooks were reloaded; this hit goes to the new version of the hook, if any
+                    if name not in _hook_names:
+                        return False
+                    return getattr(_this_module, name)(frame, bp_loc, extra_args)
+
                 _logging.info(f"Executing hook wrapper for hook {name}")
 
                 # TODO: pass Python objects into hooks, e.g. a Target instance
@@ -64,14 +74,49 @@ def _create_hook_wrappers(hook_module):
                 extra_args.GetAsJSON(stream)
                 extra_dict = _json.loads(stream.GetData())
                 extra_dict["hook_name"] = name
+                # Tells apart processes of a tree traced with --follow-forks, along with "ppid"
+                extra_dict["pid"] = frame.GetThread().GetProcess().GetProcessID()
 
-                r_frame = _rummage.StackFrame(frame)
                 r_bp_loc = _rummage.BreakpointLocation(bp_loc)
 
+                recorder = _rummage.Recorder.current()
+                if recorder is None:
+                    r_frame = _rummage.StackFrame(frame, hook_name=name)
+                    return call_hook(r_frame, r_bp_loc, extra_dict, pause_start_ns)
+
+                # Record everything the hook reads during this hit, so it can be replayed later
+                rec = recorder.new_hit(name)
+                rec["extra"] = dict(extra_dict)
+                rec["bp_loc"] = {
+                    "file": r_bp_loc.line_location.file_path,
+                    "line": r_bp_loc.line_location.line_number,
+                    "hit_count": r_bp_loc.hit_count,
+                }
+                r_frame = _rummage.StackFrame(frame, hook_name=name, _rec=rec)
+                try:
+                    return call_hook(r_frame, r_bp_loc, extra_dict, pause_start_ns, rec)
+                finally:
+                    recorder.write_hit(rec)
+
+            def call_hook(r_frame, r_bp_loc, extra_dict, pause_start_ns, rec=None):
                 _rummage.callbacks.on_hook_enter(
                     frame=r_frame, bp_loc=r_bp_loc, extra=extra_dict
                 )
 
+                if offload_spec is not None:
+                    # Only take a snapshot of the requested variables here, the hook itself runs
+                    # on a worker thread while the target keeps going.
+                    values = {
+                        var_name: _rummage.detach(r_frame.var(var_name))
+                        for var_name in offload_spec.var_names
+                    }
+                    if rec is not None:
+                        rec["values"] = values
+                    _rummage.OffloadPool.instance().submit(
+                        name, fn, offload_spec, values, extra_dict, pause_start_ns
+                    )
+                    return False
+
                 # Returning False tells lldb not to stop at the breakpoint.
                 # Hook functions may return a truthy value to request stopping at the breakpoint.
                 return bool(
@@ -87,14 +132,144 @@ def _create_hook_wrappers(hook_module):
                 f"name: {name}, wrapper: {hook_wrapper}"
             )
             setattr(_this_module, name, hook_wrapper)
+            _hook_names.append(name)
 
         add_hook_wrapper()
 
 
+def _remove_hook_wrappers():
+    """
+    Remove the wrappers of previously loaded hooks and undo any overrides of
+    `rummage.callbacks` and formatters registered by the previous hook file. Expression plans of
+    the previous hooks are dropped too.
+    """
+
+    for name in _hook_names:
+        _logging.debug(f"Removing hook wrapper {name} from {_this_module}")
+        delattr(_this_module, name)
+    _hook_names.clear()
+
+    _importlib.reload(_rummage.callbacks)
+    _rummage.formatters.clear()
+    _rummage.core.clear_expression_plans()
+
+
+def _save_hooks():
+    """State of the loaded hooks, to go back to with `_restore_hooks` if loading others fails."""
+
+    return (
+        {name: getattr(_this_module, name) for name in _hook_names},
+        dict(vars(_rummage.callbacks)),
+        _rummage.formatters.save(),
+    )
+
+
+def _restore_hooks(saved):
+    wrappers, callbacks, formatters = saved
+
+    _remove_hook_wrappers()
+    for name, wrapper in wrappers.items():
+        setattr(_this_module, name, wrapper)
+        _hook_names.append(name)
+    vars(_rummage.callbacks).update(callbacks)
+    _rummage.formatters.restore(formatters)
+
+
+def _load_hooks(hook_file):
+    """
+    Load the hooks of `hook_file`, replacing those loaded before. If importing the file fails, the
+    previous hooks stay loaded.
+    """
+
+    global _hook_file, _hook_file_mtime_ns
+
+    # Taken before importing, so that changes made while importing are picked up by the next check
+    _hook_file, _hook_file_mtime_ns = hook_file, _os.stat(hook_file).st_mtime_ns
+
+    # Hook files may register callbacks and formatters as they are imported, so the previous ones
+    # are removed first and put back on failure
+    saved = _save_hooks()
+    _remove_hook_wrappers()
+    try:
+        hook_module = _rummage.common.import_module_from_file(hook_file)
+        _create_hook_wrappers(hook_module)
+    except Exception:
+        _restore_hooks(saved)
+        raise
+
+
+def _check_hook_file():
+    """
+    Reload hooks if the hook file changed since it was loaded, checking at most once every
+    `_watch_interval` seconds. Returns whether hooks were reloaded.
+    """
+
+    with _watch_lock:
+        return _check_hook_file_locked()
+
+
+def _check_hook_file_locked():
+    global _next_watch_check
+
+    now = _time.monotonic()
+    if now < _next_watch_check:
+        return False
+    _next_watch_check = now + _watch_interval
+
+    try:
+        mtime_ns = _os.stat(_hook_file).st_mtime_ns
+    except OSError:
+        # E.g. editors replacing the file on save; try again on the next check
+        return False
+    if mtime_ns == _hook_file_mtime_ns:
+        return False
+
+    _logging.info(f"Hook file {_hook_file} changed, reloading hooks")
+    old_names = set(_hook_names)
+    try:
+        _load_hooks(_hook_file)
+    except Exception:
+        # E.g. saving a half-edited file; tried again once the file changes again
+        _logging.exception(
+            f"Failed to reload hooks from {_hook_file}, keeping the previous hooks"
+        )
+        return False
+
+    new_names = set(_hook_names)
+    if len(new_names) == 0:
+        _logging.warning(
+            f"No hooks left in {_hook_file}; as changes are only checked for on hook hits, "
+            "the file is no longer watched"
+        )
+    for listener in _reload_listeners:
+        listener(old_names - new_names, new_names - old_names)
+    return True
+
+
+def _start_watching(interval, listener):
+    """
+    Reload hooks when the hook file changes, checked on hook hits. `listener` is called with the
+    sets of removed and added hook names after each reload.
+    """
+
+    global _watch_interval, _next_watch_check
+
+    _logging.info(f"Watching {_hook_file} for changes every {interval} s")
+    _watch_interval = interval
+    _next_watch_check = _time.monotonic() + interval
+    _reload_listeners.append(listener)
+
+
+def _stop_watching():
+    global _watch_interval
+
+    _watch_interval = None
+    _reload_listeners.clear()
+
+
 def _cmd_load_wrapper_hooks(debugger, hook_file, *_):
     _ = debugger
-    hook_module = _import_module_from_file(hook_file)
-    _create_hook_wrappers(hook_module)
+    _load_hooks(hook_file)
 
 
 def __lldb_init_module(debugger, *_):
@@ -0,0 +1,32 @@
+/*
+ * Compiled-in rummage markers.
+ *
+ * RUMMAGE_MARK("name") marks a point in the code where hooks called `name` are run, like a
+ * `// @rummage: name` comment, but without rummage needing the sources: the marker's address and
+ * name are stored in the `.rummage_marks` section of the binary, which rummage reads from the
+ * loaded module.
+ *
+ * Each entry is a 4-byte aligned, 32-bit offset from the entry to the marked instruction, followed
+ * by the NUL-terminated name. Code duplicated by the compiler (e.g. inlining, unrolling) gets an
+ * entry per copy.
+ *
+ * On compilers or object formats without support for this, markers compile to nothing.
+ */
+
+#ifndef RUMMAGE_H
+#define RUMMAGE_H
+
+#if defined(__GNUC__) && defined(__ELF__)
+#define RUMMAGE_MARK(name)                      \
+    __asm__ volatile(                           \
+        "1:\n"                                  \
+        ".pushsection .rummage_marks, \"a\"\n"  \
+        ".balign 4\n"                           \
+        ".long 1b - .\n"                        \
+        ".asciz \"" name "\"\n"                 \
+        ".popsection\n")
+#else
+#define RUMMAGE_MARK(name) ((void)0)
+#endif
+
+#endif /* RUMMAGE_H */
@@ -1,22 +1,91 @@
+import contextlib
 import logging
+import os
 import shlex
+import signal
+import subprocess as sp
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import hook_wrappers  # type: ignore
 import lldb
 
 import rummage
+from rummage.alloc import AllocationTracker
+from rummage.capture import MARKER_NAME as CAPTURE_MARKER_NAME
+from rummage.capture import CaptureSession
+from rummage.common import lldb_command_line, lldb_commands
+from rummage.coverage import MarkerCoverage
+from rummage.forks import ForkFollower
+from rummage.profiler import Profiler
+from rummage.spans import MARKER_NAMES as SPAN_MARKER_NAMES
+from rummage.spans import SpanTracker
 
 LAUNCH_CONFIG = rummage.LaunchConfig()
 
+# Every read of remote memory costs a round trip, so bigger cache lines are read at a time. Hooks
+# mostly read variables close to each other, which then come from lldb's memory cache.
+REMOTE_MEMORY_CACHE_LINE_SIZE = 4096
+
+# Markers handled by rummage itself; hooks of the same name would never see a sensible marker
+_BUILTIN_MARKER_NAMES = [CAPTURE_MARKER_NAME, *SPAN_MARKER_NAMES]
+
+# Launch options that only apply to the session they were set for, not to sessions of its children
+_SESSION_OPTIONS = [
+    "exe",
+    "args",
+    "attach_pid",
+    "parent_pid",
+    "profile_hz",
+    "profile_file",
+]
+
+
+def set_breakpoints(
+    target: rummage.Target,
+    marker_index: Optional[rummage.MarkerIndex] = None,
+    hook_names: Optional[Iterable[str]] = None,
+    ppid: Optional[int] = None,
+) -> Dict[str, rummage.Breakpoint]:
+    """
+    Set breakpoints calling the loaded hooks, or only those in `hook_names`, at their markers.
+    `ppid` is passed to the hooks along with the pid, for processes of a tree traced with
+    --follow-forks.
+    """
 
-def set_breakpoints(target: rummage.Target):
     logging.info("Setting breakpoints")
 
-    hook_fn_names = [name for (name, _) in rummage.get_hook_fns(hook_wrappers)]
+    if marker_index is None:
+        marker_index = rummage.MarkerIndex.from_target(target)
+
+    if hook_names is None:
+        hook_names = [name for (name, _) in rummage.get_hook_fns(hook_wrappers)]
+
+    breakpoints = dict()
+    for cb_name in hook_names:
+        if cb_name in _BUILTIN_MARKER_NAMES:
+            logging.warning(
+                f"Not calling hook {cb_name}, `@rummage: {cb_name}` markers are built in"
+            )
+            continue
+
+        # Hooks may have both compiled-in and comment markers, e.g. in code built with and
+        # without rummage.h
+        b = rummage.Breakpoint.from_addresses(target, marker_index.addresses(cb_name))
+        locations = marker_index.locations(cb_name)
+        if len(locations) > 0:
+            inlined = any(
+                not marker_index.is_primary_file(location.file_path)
+                for location in locations
+            )
+            b.extend(rummage.Breakpoint.from_locations(target, locations, inlined))
+        elif len(b) == 0:
+            logging.info(f"No markers found for hook {cb_name}")
 
-    for cb_name in hook_fn_names:
-        b = rummage.Breakpoint.from_regex(target, r"@rummage\s*:\s*" + cb_name)
-        b.set_callback_via_path(f"{hook_wrappers.__name__}.{cb_name}")
+        b.set_callback_via_path(f"{hook_wrappers.__name__}.{cb_name}", {"ppid": ppid})
+        breakpoints[cb_name] = b
+
+    return breakpoints
 
 
 def _cmd_set_launch_exe(debugger, exe, *_):
@@ -31,9 +100,538 @@ def _cmd_set_launch_args(debugger, args, *_):
     LAUNCH_CONFIG.args = shlex.split(args)
 
 
-def _cmd_launch(debugger, *_):
+def _cmd_set_summary_file(debugger, path, *_):
+    _ = debugger
+    logging.info(f"Setting aggregator summary file to: {path}")
+    LAUNCH_CONFIG.summary_file = path
+
+
+def _cmd_set_summary_interval(debugger, seconds, *_):
+    _ = debugger
+    logging.info(f"Setting aggregator summary interval to: {seconds}")
+    LAUNCH_CONFIG.summary_interval = float(seconds)
+
+
+def _cmd_set_offload_workers(debugger, workers, *_):
+    _ = debugger
+    logging.info(f"Setting number of offload workers to: {workers}")
+    LAUNCH_CONFIG.offload_workers = int(workers)
+
+
+def _cmd_set_offload_max_pending(debugger, max_pending, *_):
+    _ = debugger
+    logging.info(f"Setting max pending offloaded hook calls to: {max_pending}")
+    LAUNCH_CONFIG.offload_max_pending = int(max_pending)
+
+
+def _cmd_set_offload_policy(debugger, policy, *_):
+    _ = debugger
+    logging.info(f"Setting offload policy to: {policy}")
+    LAUNCH_CONFIG.offload_policy = policy
+
+
+def _cmd_set_coverage_file(debugger, path, *_):
+    _ = debugger
+    logging.info(f"Enabling marker coverage mode, writing report to: {path}")
+    LAUNCH_CONFIG.coverage_file = path
+
+
+def _cmd_set_profile_hz(debugger, hz, *_):
+    _ = debugger
+    logging.info(f"Enabling sampling profiler at: {hz} Hz")
+    LAUNCH_CONFIG.profile_hz = float(hz)
+
+
+def _cmd_set_profile_file(debugger, path, *_):
+    _ = debugger
+    logging.info(f"Setting profile output file to: {path}")
+    LAUNCH_CONFIG.profile_file = path
+
+
+def _cmd_set_record_file(debugger, path, *_):
+    _ = debugger
+    logging.info(f"Recording hook inputs to: {path}")
+    LAUNCH_CONFIG.record_file = path
+
+
+def _cmd_set_delta_keyframe_interval(debugger, interval, *_):
+    _ = debugger
+    logging.info(f"Setting delta trace keyframe interval to: {interval}")
+    LAUNCH_CONFIG.delta_keyframe_interval = int(interval)
+
+
+def _cmd_set_watch_interval(debugger, seconds, *_):
+    _ = debugger
+    logging.info(f"Watching the hook file for changes every: {seconds} s")
+    LAUNCH_CONFIG.watch_interval = float(seconds)
+
+
+def _cmd_set_keep_state(debugger, keep_state, *_):
+    _ = debugger
+    logging.info(f"Keeping aggregator state across hook reloads: {keep_state}")
+    LAUNCH_CONFIG.keep_state = keep_state.strip().lower() in ["1", "true", "yes"]
+
+
+def _cmd_set_remote_url(debugger, url, *_):
+    _ = debugger
+    logging.info(f"Running the target through the remote platform at: {url}")
+    LAUNCH_CONFIG.remote_url = url
+
+
+def _cmd_set_remote_platform(debugger, platform, *_):
+    _ = debugger
+    logging.info(f"Setting remote platform to: {platform}")
+    LAUNCH_CONFIG.remote_platform = platform
+
+
+def _cmd_set_memory_cache_line_size(debugger, size, *_):
+    _ = debugger
+    logging.info(f"Setting memory cache line size to: {size}")
+    LAUNCH_CONFIG.memory_cache_line_size = int(size)
+
+
+def _cmd_set_alloc_file(debugger, path, *_):
+    _ = debugger
+    logging.info(f"Tracking allocations, writing report to: {path}")
+    LAUNCH_CONFIG.alloc_file = path
+
+
+def _cmd_set_alloc_sample_every(debugger, n, *_):
+    _ = debugger
+    logging.info(f"Tracking one in every {n} allocations")
+    LAUNCH_CONFIG.alloc_sample_every = int(n)
+
+
+def _cmd_set_follow_forks(debugger, follow_forks, *_):
+    _ = debugger
+    logging.info(f"Following forked children and execs: {follow_forks}")
+    LAUNCH_CONFIG.follow_forks = follow_forks.strip().lower() in ["1", "true", "yes"]
+
+
+def _cmd_set_attach_pid(debugger, pid, *_):
+    _ = debugger
+    logging.info(f"Attaching to process: {pid}")
+    LAUNCH_CONFIG.attach_pid = int(pid)
+
+
+def _cmd_set_parent_pid(debugger, pid, *_):
+    _ = debugger
+    logging.info(f"Setting parent process to: {pid}")
+    LAUNCH_CONFIG.parent_pid = int(pid)
+
+
+def _cmd_set_capture_file(debugger, path, *_):
+    _ = debugger
+    logging.info(f"Setting capture output file to: {path}")
+    LAUNCH_CONFIG.capture_file = path
+
+
+def _cmd_set_span_trace_file(debugger, path, *_):
+    _ = debugger
+    logging.info(f"Setting span trace output file to: {path}")
+    LAUNCH_CONFIG.span_trace_file = path
+
+
+def _alloc_entry(frame, bp_loc, *_):
+    allocations = _session_of(frame).allocations
+    assert allocations is not None
+    return allocations.on_entry(frame, bp_loc)
+
+
+def _alloc_return(frame, *_):
+    allocations = _session_of(frame).allocations
+    assert allocations is not None
+    return allocations.on_return(frame)
+
+
+def _capture_hit(frame, bp_loc, *_):
+    captures = _session_of(frame).captures
+    assert captures is not None
+    return captures.on_hit(frame, bp_loc)
+
+
+def _span_hit(frame, bp_loc, *_):
+    spans = _session_of(frame).spans
+    assert spans is not None
+    return spans.on_hit(frame, bp_loc)
+
+
+def _fork_entry(frame, bp_loc, *_):
+    forks = _session_of(frame).forks
+    assert forks is not None
+    return forks.on_entry(frame, bp_loc)
+
+
+def _fork_return(frame, *_):
+    forks = _session_of(frame).forks
+    assert forks is not None
+    return forks.on_return(frame)
+
+
+def select_platform(debugger: lldb.SBDebugger):
+    """
+    Connect to the remote platform from LAUNCH_CONFIG, if any, or select the host platform
+    otherwise. Targets are created on the selected platform, so this must be called first.
+    """
+
+    line_size = LAUNCH_CONFIG.memory_cache_line_size
+
+    if LAUNCH_CONFIG.remote_url is None:
+        debugger.SetSelectedPlatform(lldb.SBPlatform.GetHostPlatform())
+    else:
+        logging.info(f"Connecting to remote platform at {LAUNCH_CONFIG.remote_url}")
+        platform = lldb.SBPlatform(LAUNCH_CONFIG.remote_platform)
+        error = platform.ConnectRemote(
+            lldb.SBPlatformConnectOptions(LAUNCH_CONFIG.remote_url)
+        )
+        if not error.Success():
+            raise ValueError(
+                f"Failed to connect to {LAUNCH_CONFIG.remote_url}: {error}"
+            )
+        debugger.SetSelectedPlatform(platform)
+
+        if line_size is None:
+            line_size = REMOTE_MEMORY_CACHE_LINE_SIZE
+
+    if line_size is None:
+        debugger.HandleCommand("settings clear target.process.memory-cache-line-size")
+    else:
+        debugger.HandleCommand(
+            f"settings set target.process.memory-cache-line-size {line_size}"
+        )
+
+
+def _image(target: rummage.Target) -> Tuple[str, str]:
+    module = next(iter(target.modules), None)
+    return target.exe, module.GetUUIDString() if module is not None else ""
+
+
+class _HookBreakpoints:
+    """
+    Breakpoints calling the loaded hooks, kept up to date as hooks are reloaded and as the target
+    execs other images.
+    """
+
+    def __init__(
+        self,
+        target: rummage.Target,
+        marker_index: rummage.MarkerIndex,
+        ppid: Optional[int],
+    ) -> None:
+        self._target = target
+        self.marker_index = marker_index
+        self._ppid = ppid
+        self._image = _image(target)
+        self._breakpoints = set_breakpoints(target, marker_index, ppid=ppid)
+
+    def on_reload(self, removed, added):
+        for name in removed:
+            # Hooks named after built-in markers have no breakpoints
+            breakpoint = self._breakpoints.pop(name, None)
+            if breakpoint is not None:
+                logging.info(f"Hook {name} was removed, deleting its breakpoints")
+                breakpoint.delete()
+        # Breakpoints of hooks that are still there already call the new wrappers by name
+        self._breakpoints.update(
+            set_breakpoints(
+                self._target, self.marker_index, sorted(added), ppid=self._ppid
+            )
+        )
+
+    def on_exec(self):
+        image = _image(self._target)
+        if image == self._image:
+            # Same markers, and lldb resolves the breakpoints again in the new process
+            return
+
+        logging.info(f"Target exec'd {image[0]}, setting breakpoints at its markers")
+        self._image = image
+        for breakpoint in self._breakpoints.values():
+            breakpoint.delete()
+        self.marker_index = rummage.MarkerIndex.from_target(self._target)
+        self._breakpoints = set_breakpoints(
+            self._target, self.marker_index, ppid=self._ppid
+        )
+
+
+def _child_command(pid: int) -> Tuple[str, List[str]]:
+    """Executable and arguments of the child `pid`, which may have exec'd another image already."""
+
+    try:
+        exe = os.readlink(f"/proc/{pid}/exe")
+        with open(f"/proc/{pid}/cmdline", "rb") as file:
+            # NUL-terminated arguments, starting with argv[0]
+            args = [os.fsdecode(arg) for arg in file.read().split(b"\0")[1:-1]]
+    except OSError:
+        return LAUNCH_CONFIG.exe, LAUNCH_CONFIG.args
+    return exe, args
+
+
+def _spawn_child_session(pid: int, ppid: int) -> sp.Popen:
+    """Start a rummage session in another lldb attaching to the child `pid`, with the same hooks."""
+
+    exe, args = _child_command(pid)
+    options = {
+        name: value
+        for name, value in vars(LAUNCH_CONFIG).items()
+        if name not in _SESSION_OPTIONS
+    }
+    lldb_cmds = lldb_commands(
+        hook_wrappers._hook_file,
+        exe,
+        args,
+        log_level=logging.getLevelName(logging.getLogger().getEffectiveLevel()),
+        launch_options={**options, "attach_pid": pid, "parent_pid": ppid},
+    )
+    return sp.Popen(lldb_command_line(lldb_cmds))
+
+
+def _attach(target: lldb.SBTarget, pid: int) -> lldb.SBProcess:
+    """Attach to `pid`, stopped by the session of its parent when forked, and resume it."""
+
+    error = lldb.SBError()
+    process = target.Attach(lldb.SBAttachInfo(pid), error)
+    if not error.Success():
+        raise ValueError(f"Failed to attach to process {pid}: {error}")
+
+    # The SIGSTOP from the parent's session may still be pending, and SIGCONT clears the stop
+    # for good; neither should end the session
+    signals = process.GetUnixSignals()
+    for signum in [signal.SIGSTOP, signal.SIGCONT]:
+        signals.SetShouldStop(signum, False)
+        signals.SetShouldNotify(signum, False)
+    os.kill(pid, signal.SIGCONT)
+
+    process.Continue()
+    return process
+
+
+def _follow_execs(process: lldb.SBProcess, listeners: List):
+    """Keep the target going past execs, which lldb stops at, notifying `listeners` of each."""
+
+    while process.GetState() == lldb.eStateStopped and any(
+        thread.GetStopReason() == lldb.eStopReasonExec for thread in process
+    ):
+        for listener in listeners:
+            listener.on_exec()
+        process.Continue()
+
+
+class _Session:
+    """
+    Breakpoints and trackers of one traced process, and its output files.
+
+    With --follow-forks, children that run the same image as their parent are followed within this
+    debugger: each gets a target of its own, which shares the modules (and so the symbols) of the
+    parent's, and the parent's marker index. Markers are only indexed again when a process execs
+    another image (see `_follow_execs`). Children that exec'd another image before they were caught
+    get a session in an lldb of their own.
+    """
+
+    def __init__(
+        self,
+        debugger: lldb.SBDebugger,
+        target: lldb.SBTarget,
+        marker_index: rummage.MarkerIndex,
+        pid: Optional[int],
+        ppid: Optional[int],
+    ) -> None:
+        self.debugger = debugger
+        self.target = target
+        self.pid = pid
+        self.ppid = ppid
+
+        r_target = rummage.Target(target)
+        self._marker_index = marker_index
+        # Notified when the target execs another image
+        self.exec_listeners = []
+
+        self.coverage = None
+        self.hooks = None
+        self.captures = None
+        self.spans = None
+        if LAUNCH_CONFIG.coverage_file is not None:
+            # Coverage mode replaces hooks with native hit counting on every marker
+            self.coverage = MarkerCoverage(r_target, marker_index)
+        else:
+            self.hooks = _HookBreakpoints(r_target, marker_index, ppid)
+            self.exec_listeners.append(self.hooks)
+
+            self.captures = CaptureSession(r_target, marker_index)
+            if len(self.captures) > 0:
+                self.exec_listeners.append(self.captures)
+            else:
+                self.captures = None
+
+            self.spans = SpanTracker(r_target, marker_index)
+            if len(self.spans) > 0:
+                self.exec_listeners.append(self.spans)
+            else:
+                self.spans = None
+
+        self.allocations = None
+        if LAUNCH_CONFIG.alloc_file is not None:
+            self.allocations = AllocationTracker(
+                target, LAUNCH_CONFIG.alloc_sample_every
+            )
+            self.exec_listeners.append(self.allocations)
+
+        self.forks = None
+        if LAUNCH_CONFIG.follow_forks:
+            self.forks = ForkFollower(target, self._follow_child)
+            self.exec_listeners.append(self.forks)
+
+        # Children followed within this debugger, and lldb processes of the other children
+        self._child_threads: List[threading.Thread] = []
+        self._child_processes: List[sp.Popen] = []
+
+    @property
+    def marker_index(self) -> rummage.MarkerIndex:
+        # Hook breakpoints index markers again when the target execs another image
+        return self.hooks.marker_index if self.hooks is not None else self._marker_index
+
+    def output_path(self, path, default=None):
+        """Output files of sessions of children get the pid, so they don't clobber the parent's."""
+
+        if self.ppid is None:
+            return path
+        path = path or default
+        if path is None:
+            return None
+        root, ext = os.path.splitext(str(path))
+        return f"{root}.{self.pid}{ext}"
+
+    def run(self, launch_info: Optional[lldb.SBLaunchInfo] = None) -> lldb.SBProcess:
+        """Launch the target with `launch_info`, or attach to `pid`, and run it to completion."""
+
+        # TODO: This blocks only until the debugger stops at a breakpoint.
+        # This is not a problem if we set ALL breakpoints to auto-continue.
+        # Otherwise, we have to switch to async mode and periodically check process status.
+        if self.pid is None:
+            e = lldb.SBError()
+            process = self.target.Launch(launch_info, e)
+        else:
+            process = _attach(self.target, self.pid)
+        if LAUNCH_CONFIG.follow_forks:
+            _follow_execs(process, self.exec_listeners)
+        return process
+
+    def _follow_child(self, pid: int, ppid: int):
+        exe, args = _child_command(pid)
+        try:
+            same_image = exe == os.readlink(f"/proc/{ppid}/exe")
+        except OSError:
+            same_image = False
+
+        if not same_image:
+            # Markers of another image need indexing anyway
+            self._child_processes.append(_spawn_child_session(pid, ppid))
+            return
+
+        thread = threading.Thread(
+            target=self._run_child, args=(exe, args, pid, ppid), name=f"rummage {pid}"
+        )
+        thread.start()
+        self._child_threads.append(thread)
+
+    def _run_child(self, exe: str, args: List[str], pid: int, ppid: int):
+        logging.info(f"Following child {pid} within this debugger")
+
+        target = self.debugger.CreateTarget(exe)
+        try:
+            # Passed to hooks through extra_args
+            target.SetLaunchInfo(lldb.SBLaunchInfo(args))
+            child = _Session(self.debugger, target, self.marker_index, pid, ppid)
+            with _registered(child):
+                child.run()
+                child.finish_tracking()
+            child.write_reports()
+        except Exception:
+            logging.exception(f"Session of forked child {pid} failed")
+        finally:
+            self.debugger.DeleteTarget(target)
+
+    def finish_tracking(self):
+        """
+        Wait for children followed within this debugger and write the outputs of trackers, while
+        the StackTable and aggregators are still around.
+        """
+
+        for thread in self._child_threads:
+            thread.join()
+
+        if self.allocations is not None:
+            # Stacks are symbolised by the StackTable of the launch
+            self.allocations.write_report(self.output_path(LAUNCH_CONFIG.alloc_file))
+
+        if self.spans is not None:
+            # Before the aggregators are written out
+            self.spans.record_durations()
+            self.spans.write_chrome_trace(
+                self.output_path(LAUNCH_CONFIG.span_trace_file)
+            )
+
+    def write_reports(self):
+        """Write coverage and capture outputs, and wait for the lldb processes of children."""
+
+        if self.coverage is not None:
+            self.coverage.write_report(self.output_path(LAUNCH_CONFIG.coverage_file))
+
+        if self.captures is not None:
+            self.captures.write(self.output_path(LAUNCH_CONFIG.capture_file))
+
+        for child in self._child_processes:
+            # Sessions of children write their own output
+            if child.wait() != 0:
+                logging.error("Session of a forked child failed, see its output above")
+
+
+# Sessions of the processes traced within this debugger, see `_session_of`
+_sessions: List[_Session] = []
+
+
+@contextlib.contextmanager
+def _registered(session: _Session):
+    _sessions.append(session)
+    try:
+        yield session
+    finally:
+        _sessions.remove(session)
+
+
+def _session_of(frame: lldb.SBFrame) -> _Session:
+    """Session of the process that `frame` is of, which breakpoints of trackers are handled by."""
+
+    target = frame.GetThread().GetProcess().GetTarget()
+    return next(session for session in list(_sessions) if session.target == target)
+
+
+def _on_reload(removed, added):
+    for session in list(_sessions):
+        if session.hooks is not None:
+            session.hooks.on_reload(removed, added)
+
+    if not LAUNCH_CONFIG.keep_state:
+        rummage.GlobalAggregators.instance().clear()
+
+
+def launch(
+    debugger: lldb.SBDebugger,
+    target: lldb.SBTarget,
+    marker_index: Optional[rummage.MarkerIndex] = None,
+):
+    """
+    Set hook breakpoints in `target` and run it to completion using LAUNCH_CONFIG.
+
+    `marker_index` may be passed in to reuse markers indexed by a previous launch of the same
+    target. Returns the number of calls of offloaded hooks that failed.
+    """
+
+    if LAUNCH_CONFIG.follow_forks and LAUNCH_CONFIG.remote_url is not None:
+        # Children are stopped with signals sent from here
+        raise ValueError("Following forks isn't supported on remote platforms")
+
     debugger.SetAsync(False)
-    target = debugger.CreateTarget(LAUNCH_CONFIG.exe)
 
     # Setting launch info before setting breakpoints so that args are already known as they are
     # passed to breakpoint callbacks through extra_args.
@@ -43,17 +641,76 @@ def _cmd_launch(debugger, *_):
     launch_info = lldb.SBLaunchInfo(LAUNCH_CONFIG.args)
     target.SetLaunchInfo(launch_info)
 
-    set_breakpoints(rummage.Target(target))
+    if LAUNCH_CONFIG.remote_url is not None:
+        # Copies the executable into the working directory of the remote platform
+        error = target.Install()
+        if not error.Success():
+            raise ValueError(f"Failed to install target on remote platform: {error}")
+
+    if marker_index is None:
+        marker_index = rummage.MarkerIndex.from_target(rummage.Target(target))
+
+    session = _Session(
+        debugger,
+        target,
+        marker_index,
+        LAUNCH_CONFIG.attach_pid,
+        LAUNCH_CONFIG.parent_pid,
+    )
+    if session.hooks is not None and LAUNCH_CONFIG.watch_interval is not None:
+        hook_wrappers._start_watching(LAUNCH_CONFIG.watch_interval, _on_reload)
+
+    offload_pool = rummage.OffloadPool(
+        LAUNCH_CONFIG.offload_workers,
+        LAUNCH_CONFIG.offload_max_pending,
+        LAUNCH_CONFIG.offload_policy,
+    )
 
     # Launch
-    with rummage.GlobalFileWriter():
-        # TODO: This blocks only until the debugger stops at a breakpoint.
-        # This is not a problem if we set ALL breakpoints to auto-continue.
-        # Otherwise, we have to switch to async mode and periodically check process status.
+    # Offloaded hooks may still be using the file writer and aggregators, so the pool is shut down
+    # first.
+    with rummage.GlobalFileWriter(), rummage.GlobalAggregators(
+        session.output_path(LAUNCH_CONFIG.summary_file or "rummage_summary.json"),
+        LAUNCH_CONFIG.summary_interval,
+    ), rummage.GlobalDeltaWriter(
+        LAUNCH_CONFIG.delta_keyframe_interval
+    ), rummage.GlobalTraceWriter(), rummage.StackTable(), rummage.Recorder(
+        session.output_path(LAUNCH_CONFIG.record_file)
+    ), offload_pool, (
+        session.allocations or contextlib.nullcontext()
+    ), (
+        session.forks or contextlib.nullcontext()
+    ), (
+        session.captures or contextlib.nullcontext()
+    ), (
+        session.spans or contextlib.nullcontext()
+    ), _registered(
+        session
+    ):
         logging.info("Launching debug target")
-        e = lldb.SBError()
         rummage.callbacks.on_target_launch(debugger)
-        target.Launch(launch_info, e)
+
+        if LAUNCH_CONFIG.profile_hz is None:
+            session.run(launch_info)
+        else:
+            profiler = Profiler(LAUNCH_CONFIG.profile_hz)
+            profiler.run(debugger, target, launch_info)
+            profiler.write_folded(session.output_path(LAUNCH_CONFIG.profile_file))
+
+        session.finish_tracking()
+
+    hook_wrappers._stop_watching()
+    session.write_reports()
+
+    return offload_pool.failures
+
+
+def _cmd_launch(debugger, *_):
+    select_platform(debugger)
+    target = debugger.CreateTarget(LAUNCH_CONFIG.exe)
+    if launch(debugger, target) > 0:
+        # Exit status of lldb, and so of `rummage`
+        debugger.HandleCommand("quit 1")
 
 
 def __lldb_init_module(debugger, *_):
@@ -63,6 +720,77 @@ def __lldb_init_module(debugger, *_):
     debugger.HandleCommand(
         "command script add -f launch._cmd_set_launch_args rummage_set_launch_args"
     )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_summary_file rummage_set_summary_file"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_summary_interval rummage_set_summary_interval"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_offload_workers rummage_set_offload_workers"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_offload_max_pending "
+        "rummage_set_offload_max_pending"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_offload_policy rummage_set_offload_policy"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_coverage_file rummage_set_coverage_file"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_profile_hz rummage_set_profile_hz"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_profile_file rummage_set_profile_file"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_record_file rummage_set_record_file"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_delta_keyframe_interval "
+        "rummage_set_delta_keyframe_interval"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_watch_interval rummage_set_watch_interval"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_keep_state rummage_set_keep_state"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_remote_url rummage_set_remote_url"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_remote_platform rummage_set_remote_platform"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_memory_cache_line_size "
+        "rummage_set_memory_cache_line_size"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_alloc_file rummage_set_alloc_file"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_alloc_sample_every "
+        "rummage_set_alloc_sample_every"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_follow_forks rummage_set_follow_forks"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_attach_pid rummage_set_attach_pid"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_parent_pid rummage_set_parent_pid"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_capture_file rummage_set_capture_file"
+    )
+    debugger.HandleCommand(
+        "command script add -f launch._cmd_set_span_trace_file "
+        "rummage_set_span_trace_file"
+    )
     debugger.HandleCommand("command script add -f launch._cmd_launch rummage_launch")
 
 
@@ -70,4 +798,32 @@ def __lldb_init_module(debugger, *_):
 __lldb_init_module = __lldb_init_module
 _cmd_set_launch_exe = _cmd_set_launch_exe
 _cmd_set_launch_args = _cmd_set_launch_args
+_cmd_set_summary_file = _cmd_set_summary_file
+_cmd_set_summary_interval = _cmd_set_summary_interval
+_cmd_set_offload_workers = _cmd_set_offload_workers
+_cmd_set_offload_max_pending = _cmd_set_offload_max_pending
+_cmd_set_offload_policy = _cmd_set_offload_policy
+_cmd_set_coverage_file = _cmd_set_coverage_file
+_cmd_set_profile_hz = _cmd_set_profile_hz
+_cmd_set_profile_file = _cmd_set_profile_file
+_cmd_set_record_file = _cmd_set_record_file
+_cmd_set_delta_keyframe_interval = _cmd_set_delta_keyframe_interval
+_cmd_set_watch_interval = _cmd_set_watch_interval
+_cmd_set_keep_state = _cmd_set_keep_state
+_cmd_set_remote_url = _cmd_set_remote_url
+_cmd_set_remote_platform = _cmd_set_remote_platform
+_cmd_set_memory_cache_line_size = _cmd_set_memory_cache_line_size
+_cmd_set_alloc_file = _cmd_set_alloc_file
+_cmd_set_alloc_sample_every = _cmd_set_alloc_sample_every
+_cmd_set_follow_forks = _cmd_set_follow_forks
+_cmd_set_attach_pid = _cmd_set_attach_pid
+_cmd_set_parent_pid = _cmd_set_parent_pid
+_cmd_set_capture_file = _cmd_set_capture_file
+_cmd_set_span_trace_file = _cmd_set_span_trace_file
+_alloc_entry = _alloc_entry
+_alloc_return = _alloc_return
+_capture_hit = _capture_hit
+_span_hit = _span_hit
+_fork_entry = _fork_entry
+_fork_return = _fork_return
 _cmd_launch = _cmd_launch
@@ -1,50 +1,177 @@
 import argparse
+import json
+import logging
 import os
+import socket
 import subprocess as sp
+import sys
 from pathlib import Path
 
 import rummage
+from rummage.common import absolute_path, lldb_command_line, lldb_commands
 
 
-def run(hook_file, exe, args, *, log_level):
-    rummage_dir = Path(rummage.__file__).parent
+def default_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "/tmp")
+    return os.path.join(runtime_dir, f"rummage-{os.getuid()}.sock")
+
+
+def _run_lldb(lldb_cmds):
+    return sp.run(lldb_command_line(lldb_cmds)).returncode
 
-    prelude_file = rummage_dir / "prelude.py"
-    wrappers_file = rummage_dir / "hook_wrappers.py"
-    launch_file = rummage_dir / "launch.py"
 
-    hook_file = Path(hook_file)
-    if not hook_file.is_absolute():
-        hook_file = Path(os.getcwd()) / hook_file
+def run(hook_file, exe, args, *, log_level, launch_options=None):
+    """Run `exe` with the hooks in `hook_file`; returns the exit status of lldb."""
+
+    return _run_lldb(
+        lldb_commands(
+            hook_file, exe, args, log_level=log_level, launch_options=launch_options
+        )
+    )
 
-    # Generate flag to interleave with lldb commands
-    def flag():
-        while True:
-            yield "--one-line-before-file"
+
+def serve(socket_path, *, log_level):
+    """
+    Run a rummage daemon: a long-lived lldb process that keeps targets and their marker indexes
+    loaded between runs requested through `run_via_daemon`.
+    """
+
+    rummage_dir = Path(rummage.__file__).parent
 
     lldb_cmds = [
-        f"command script import {prelude_file}",
+        f"command script import {rummage_dir / 'prelude.py'}",
         f"rummage_set_log_level {log_level}",
         "rummage_load_venv",
-        f"command script import {wrappers_file}",
-        f"rummage_load_hooks {hook_file}",
-        f"command script import {launch_file}",
-        f"rummage_set_launch_exe {exe}",
-        f"rummage_set_launch_args {' '.join(args)}",
-        "rummage_launch",
+        f"command script import {rummage_dir / 'hook_wrappers.py'}",
+        f"command script import {rummage_dir / 'launch.py'}",
+        f"command script import {rummage_dir / 'daemon.py'}",
+        f"rummage_serve {socket_path}",
     ]
 
-    cmd = [
-        "lldb",
-        "--batch",
-        "--source-quietly",
-        *[x for pair in zip(flag(), lldb_cmds) for x in pair],
-    ]
+    _run_lldb(lldb_cmds)
 
-    sp.run(cmd)
 
+def run_via_daemon(socket_path, hook_file, exe, args, *, launch_options=None):
+    request = {
+        "cwd": os.getcwd(),
+        "hook_file": str(absolute_path(hook_file)),
+        "exe": str(absolute_path(exe)),
+        "args": args,
+        "launch_options": launch_options or {},
+    }
 
-def main():
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        with client.makefile("rw") as stream:
+            stream.write(json.dumps(request) + "\n")
+            stream.flush()
+            response = json.loads(stream.readline())
+
+    if not response["ok"]:
+        sys.exit(f"rummage daemon failed to run {exe}: {response['error']}")
+
+
+def daemon_main(argv):
+    parser = argparse.ArgumentParser(prog="rummage daemon")
+    parser.add_argument(
+        "--socket",
+        help=f"Path of the Unix socket to listen on (default: {default_socket_path()})",
+        default=default_socket_path(),
+    )
+    parser.add_argument(
+        "--log-level",
+        help="Level of detail for logging rummage internals",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default=None,
+    )
+
+    args = parser.parse_args(argv)
+    serve(args.socket, log_level=args.log_level)
+
+
+def replay_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="rummage replay",
+        description="Run hooks on inputs recorded with --record, without lldb or the target",
+    )
+    parser.add_argument(
+        "hook_file", help="Path to file containing rummage hook functions"
+    )
+    parser.add_argument("recording", help="Path to a recording made with --record")
+    parser.add_argument(
+        "--summary-file",
+        help="Path of the JSON summary written for rummage aggregators (default: none)",
+        default=None,
+    )
+    parser.add_argument(
+        "--log-level",
+        help="Level of detail for logging rummage internals",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default=None,
+    )
+
+    args = parser.parse_args(argv)
+    if args.log_level is not None:
+        logging.basicConfig(level=args.log_level)
+
+    num_failures = rummage.replay_hooks(
+        str(absolute_path(args.hook_file)), args.recording, args.summary_file
+    )
+    if num_failures > 0:
+        sys.exit(f"{num_failures} hook calls failed")
+
+
+def trace_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="rummage trace",
+        description="Filter a trace written with GlobalTraceWriter and convert it to JSON lines "
+        "or CSV",
+    )
+    parser.add_argument("trace", help="Path to the trace")
+    parser.add_argument("--hook", help="Only output records of this hook")
+    parser.add_argument(
+        "--min-hit", type=int, help="Only output records from this hit on"
+    )
+    parser.add_argument(
+        "--max-hit", type=int, help="Only output records up to this hit"
+    )
+    parser.add_argument(
+        "--since", type=int, help="Only output records from this timestamp (ns) on"
+    )
+    parser.add_argument(
+        "--until", type=int, help="Only output records up to this timestamp (ns)"
+    )
+    parser.add_argument(
+        "--format",
+        help="Output format (default: jsonl)",
+        choices=["jsonl", "csv"],
+        default="jsonl",
+    )
+    parser.add_argument("--output", help="Path to write to (default: stdout)")
+
+    args = parser.parse_args(argv)
+
+    with rummage.TraceReader(args.trace) as reader:
+        records = reader.records(
+            hook=args.hook,
+            min_hit=args.min_hit,
+            max_hit=args.max_hit,
+            since_ns=args.since,
+            until_ns=args.until,
+        )
+
+        out = sys.stdout if args.output is None else open(args.output, "w", newline="")
+        try:
+            if args.format == "csv":
+                rummage.trace.write_csv(list(records), out)
+            else:
+                rummage.trace.write_jsonl(records, out)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+
+def _argument_parser():
     parser = argparse.ArgumentParser(prog="rummage")
     parser.add_argument(
         "hook_file", help="Path to file containing rummage hook functions"
@@ -55,11 +182,234 @@ def main():
         choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
         default=None,
     )
+    parser.add_argument(
+        "--summary-file",
+        help="Path of the JSON summary written for rummage aggregators "
+        "(default: rummage_summary.json)",
+        default=None,
+    )
+    parser.add_argument(
+        "--summary-interval",
+        help="Also rewrite the aggregator summary file every N seconds",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--offload-workers",
+        help="Number of worker threads running offloaded hooks (default: 4)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--offload-max-pending",
+        help="Max number of offloaded hook calls queued at a time (default: 1024)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--offload-policy",
+        help="What to do with hits of offloaded hooks once the queue is full: "
+        "wait for a free slot or drop the hit (default: block)",
+        choices=["block", "drop"],
+        default=None,
+    )
+    parser.add_argument(
+        "--coverage",
+        help="Only count how often each @rummage marker is hit, without running hooks",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--coverage-file",
+        help="Path of the text coverage report; a JSON report is written next to it "
+        "(default: rummage_coverage.txt)",
+        default="rummage_coverage.txt",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Sample the call stacks of all threads of the target at the given rate (in Hz)",
+        type=float,
+        default=None,
+        metavar="HZ",
+    )
+    parser.add_argument(
+        "--profile-file",
+        help="Path of the folded stacks written by --profile, ready for flamegraph tools "
+        "(default: rummage_profile.folded)",
+        default=None,
+    )
+    parser.add_argument(
+        "--alloc",
+        help="Track malloc, calloc, realloc and free calls and report the top allocation "
+        "sites and leaks",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--alloc-file",
+        help="Path of the text allocation report; a JSON report is written next to it "
+        "(default: rummage_alloc.txt)",
+        default="rummage_alloc.txt",
+    )
+    parser.add_argument(
+        "--alloc-sample-every",
+        help="Only track about one in every N allocations, scaling up totals (default: 1)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--delta-keyframe-interval",
+        help="Write a full snapshot every N hits of a delta trace stream (default: 100)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--record",
+        help="Record what hooks read from the target into the given file, "
+        "for later use with `rummage replay`",
+        default=None,
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--watch",
+        help="Reload the hook file when it changes, without restarting the target. "
+        "Changes are picked up on the next hit of any hook",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        help="Seconds between checks of the hook file for changes with --watch (default: 1)",
+        type=float,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--keep-state",
+        help="Keep aggregators across hook reloads with --watch, instead of starting afresh",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--remote",
+        help="Run the target through a remote lldb-server platform, e.g. "
+        "connect://host:1234; hooks still run locally",
+        default=None,
+        metavar="URL",
+    )
+    parser.add_argument(
+        "--remote-platform",
+        help="Name of the lldb platform plugin for --remote (default: remote-linux)",
+        default=None,
+    )
+    parser.add_argument(
+        "--memory-cache-line-size",
+        help="Bytes of target memory read at a time and cached by lldb "
+        "(default: 4096 with --remote, lldb's default otherwise)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--capture-file",
+        help="Path of the JSON file of values recorded by `@rummage: capture(...)` markers "
+        "(default: rummage_capture.json)",
+        default=None,
+    )
+    parser.add_argument(
+        "--span-trace-file",
+        help="Path of the Chrome trace (JSON) of spans between `@rummage: begin <span>` and "
+        "`@rummage: end <span>` markers (default: rummage_spans.json)",
+        default=None,
+    )
+    parser.add_argument(
+        "--follow-forks",
+        help="Follow children forked by the target, and the images they exec, with the same "
+        "hooks. Each child is traced in parallel, with the pid appended to output file names. "
+        "Children running the same image as their parent share its lldb, aggregator summary "
+        "and recording",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--daemon",
+        help="Run through an already running `rummage daemon`",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--daemon-socket",
+        help=f"Socket of the rummage daemon (default: {default_socket_path()})",
+        default=default_socket_path(),
+    )
     parser.add_argument("exe", help="Path to the executable to be debugged")
     parser.add_argument("arg", nargs="*", help="Arguments to the debugged executable")
 
-    args = parser.parse_args()
-    run(args.hook_file, args.exe, args.arg, log_level=args.log_level)
+    return parser
+
+
+def _launch_options(args):
+    """Launch options for `lldb_commands` from parsed command line arguments."""
+
+    # Sent to the daemon as JSON, so values must be plain strings, numbers and booleans
+    return {
+        "summary_file": args.summary_file,
+        "summary_interval": args.summary_interval,
+        "offload_workers": args.offload_workers,
+        "offload_max_pending": args.offload_max_pending,
+        "offload_policy": args.offload_policy,
+        "coverage_file": (
+            str(absolute_path(args.coverage_file)) if args.coverage else None
+        ),
+        "profile_hz": args.profile,
+        "profile_file": (
+            str(absolute_path(args.profile_file)) if args.profile_file else None
+        ),
+        "record_file": str(absolute_path(args.record)) if args.record else None,
+        "delta_keyframe_interval": args.delta_keyframe_interval,
+        "watch_interval": args.watch_interval if args.watch else None,
+        "keep_state": True if args.keep_state else None,
+        "remote_url": args.remote,
+        "remote_platform": args.remote_platform,
+        "memory_cache_line_size": args.memory_cache_line_size,
+        "alloc_file": str(absolute_path(args.alloc_file)) if args.alloc else None,
+        "alloc_sample_every": args.alloc_sample_every,
+        "follow_forks": True if args.follow_forks else None,
+        "capture_file": (
+            str(absolute_path(args.capture_file)) if args.capture_file else None
+        ),
+        "span_trace_file": (
+            str(absolute_path(args.span_trace_file)) if args.span_trace_file else None
+        ),
+    }
+
+
+def main():
+    # Subcommands are dispatched by hand, as the default command takes a positional hook file
+    if sys.argv[1:2] == ["daemon"]:
+        daemon_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["replay"]:
+        replay_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["trace"]:
+        trace_main(sys.argv[2:])
+        return
+
+    args = _argument_parser().parse_args()
+    launch_options = _launch_options(args)
+
+    if args.daemon:
+        run_via_daemon(
+            args.daemon_socket,
+            args.hook_file,
+            args.exe,
+            args.arg,
+            launch_options=launch_options,
+        )
+        return
+
+    sys.exit(
+        run(
+            args.hook_file,
+            args.exe,
+            args.arg,
+            log_level=args.log_level,
+            launch_options=launch_options,
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from .aggregate import GlobalAggregators
+
+__all__ = [
+    "offload",
+    "OffloadPool",
+]
+
+
+class OffloadSpec:
+    def __init__(
+        self, var_names: Iterable[str], sink: Optional[Callable[[Any], None]]
+    ) -> None:
+        self.var_names = list(var_names)
+        self.sink = sink
+
+
+def offload(*var_names: str, sink: Optional[Callable[[Any], None]] = None):
+    """
+    Mark a hook to be run on a worker thread, so that the target can resume right away.
+
+    When the hook's breakpoint is hit, only the variables named in `var_names` are read and copied
+    into plain Python objects (see `rummage.detach`). The hook is then called on a worker thread as
+    `hook(values=..., extra=..., hit=...)`, where `values` maps variable names to their copies and
+    `hit` is the sequence number of the hit for this hook. Since the target has moved on by then,
+    offloaded hooks can't request stopping at the breakpoint.
+
+    If given, `sink` is called with the return value of each call of the hook, in hit order.
+    """
+
+    def decorate(fn):
+        fn._rummage_offload = OffloadSpec(var_names, sink)
+        return fn
+
+    return decorate
+
+
+# Placeholder result of hits skipped due to backpressure, so that later results aren't held back
+_DROPPED = object()
+
+
+class _HookQueue:
+    """Per-hook bookkeeping: hit sequence numbers and reordering of results."""
+
+    def __init__(self, sink: Optional[Callable[[Any], None]]) -> None:
+        self.sink = sink
+        self.next_hit = 0
+        self.next_result = 0
+        self.results: Dict[int, Any] = dict()
+        self.lock = threading.Lock()
+
+    def complete(self, hit: int, result: Any):
+        with self.lock:
+            self.results[hit] = result
+            while self.next_result in self.results:
+                result = self.results.pop(self.next_result)
+                self.next_result += 1
+                if self.sink is not None and result is not _DROPPED:
+                    self.sink(result)
+
+
+class OffloadPool:
+    """
+    Worker threads running offloaded hooks.
+
+    At most `max_pending` hits may be queued or running at a time. Once that limit is reached, the
+    `policy` decides what happens to new hits: "block" waits for a free slot (keeping the target
+    stopped), "drop" skips the hit.
+
+    Offloaded hooks that raise don't stop the target, as there is no hit to stop at anymore. They
+    are counted in `failures` instead, which fail the session once it ends.
+    """
+
+    _instance: Optional[OffloadPool] = None
+
+    def __init__(
+        self, workers: int = 4, max_pending: int = 1024, policy: str = "block"
+    ) -> None:
+        if policy not in ("block", "drop"):
+            raise ValueError(f"Unknown offload policy '{policy}'")
+
+        self._workers = workers
+        self._policy = policy
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._queues: Dict[str, _HookQueue] = dict()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._failures = 0
+        self._failures_lock = threading.Lock()
+
+    @staticmethod
+    def instance() -> OffloadPool:
+        assert (
+            OffloadPool._instance is not None
+        ), "Initialise using context manager: `with OffloadPool():`"
+        return OffloadPool._instance
+
+    def submit(
+        self,
+        hook_name: str,
+        fn: Callable,
+        spec: OffloadSpec,
+        values: Dict[str, Any],
+        extra: Dict[str, Any],
+        pause_start_ns: int,
+    ):
+        """
+        Queue a call of an offloaded hook. Called by hook wrappers while the target is stopped;
+        `pause_start_ns` is the `time.perf_counter_ns()` at which the wrapper was entered.
+        """
+
+        assert self._executor is not None
+
+        queue = self._queues.get(hook_name)
+        if queue is None:
+            queue = _HookQueue(spec.sink)
+            self._queues[hook_name] = queue
+
+        hit = queue.next_hit
+        queue.next_hit += 1
+
+        aggregators = GlobalAggregators.instance()
+
+        if not self._slots.acquire(blocking=self._policy == "block"):
+            aggregators.counter("offload_dropped", hook=hook_name).add()
+            queue.complete(hit, _DROPPED)
+        else:
+
+            def work():
+                start_ns = time.perf_counter_ns()
+                try:
+                    result = fn(values=values, extra=extra, hit=hit)
+                except Exception:
+                    logging.exception(f"Offloaded hook {hook_name} failed at hit {hit}")
+                    with self._failures_lock:
+                        self._failures += 1
+                    result = _DROPPED
+                finally:
+                    self._slots.release()
+
+                processing_ns = time.perf_counter_ns() - start_ns
+                with queue.lock:
+                    aggregators.hdr_histogram(
+                        "offload_processing_ns", hook=hook_name
+                    ).record(processing_ns)
+                queue.complete(hit, result)
+
+            self._executor.submit(work)
+
+        aggregators.hdr_histogram("offload_pause_ns", hook=hook_name).record(
+            time.perf_counter_ns() - pause_start_ns
+        )
+
+    @property
+    def failures(self) -> int:
+        """Number of calls of offloaded hooks that raised an exception."""
+
+        with self._failures_lock:
+            return self._failures
+
+    def __enter__(self):
+        if OffloadPool._instance is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._workers, thread_name_prefix="rummage-offload"
+            )
+            OffloadPool._instance = self
+        return OffloadPool._instance
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        this = OffloadPool.instance()
+        logging.info("Waiting for offloaded hooks to finish")
+        assert this._executor is not None
+        this._executor.shutdown(wait=True)
+        if this.failures > 0:
+            logging.error(f"{this.failures} calls of offloaded hooks failed")
+        OffloadPool._instance = None
@@ -0,0 +1,121 @@
+import logging
+import time
+from typing import Dict
+
+import lldb
+
+from .core import StackFrame, StackTable
+
+
+class Profiler:
+    """
+    Sampling profiler: interrupts the target `hz` times per second and records the call stacks of
+    all its threads.
+
+    Stacks are counted by their interned ID (see `StackTable`), so taking a sample costs little
+    more than unwinding. Counts are written in the folded format understood by flamegraph.pl,
+    inferno and speedscope.
+    """
+
+    def __init__(self, hz: float, max_depth: int = 128) -> None:
+        self._interval = 1.0 / hz
+        self._max_depth = max_depth
+        self._counts: Dict[int, int] = dict()
+        self._num_samples = 0
+
+    def _sample(self, process: lldb.SBProcess):
+        self._num_samples += 1
+        for thread in process:
+            frame = thread.GetFrameAtIndex(0)
+            if not frame.IsValid():
+                continue
+            stack_id = StackFrame(frame).stack_id(self._max_depth)
+            self._counts[stack_id] = self._counts.get(stack_id, 0) + 1
+
+    def run(
+        self,
+        debugger: lldb.SBDebugger,
+        target: lldb.SBTarget,
+        launch_info: lldb.SBLaunchInfo,
+    ):
+        """
+        Launch the target and sample it until it exits.
+
+        Breakpoint callbacks keep working as usual. If the target stops for any reason other than
+        a sample (e.g. a hook requested a stop), profiling ends and the target is left stopped.
+        """
+
+        debugger.SetAsync(True)
+        listener = debugger.GetListener()
+
+        error = lldb.SBError()
+        process = target.Launch(launch_info, error)
+        if not error.Success():
+            logging.error(f"Failed to launch target: {error}")
+            return
+
+        logging.info(f"Profiling at {1 / self._interval} Hz")
+
+        event = lldb.SBEvent()
+        interrupting = False
+        next_sample = time.monotonic() + self._interval
+
+        while True:
+            if interrupting:
+                # The stop follows right away
+                has_event = listener.WaitForEvent(1, event)
+            else:
+                delay = next_sample - time.monotonic()
+                if delay >= 1:
+                    # Wakes up early for events, e.g. the target exiting
+                    has_event = listener.WaitForEvent(int(delay), event)
+                else:
+                    # Timeouts of WaitForEvent are whole seconds, so shorter waits sleep and
+                    # leave events that come in meanwhile for after the wait
+                    if delay > 0:
+                        time.sleep(delay)
+                    has_event = listener.GetNextEvent(event)
+
+            if not has_event:
+                if not interrupting and time.monotonic() >= next_sample:
+                    process.SendAsyncInterrupt()
+                    interrupting = True
+                    # Don't try to catch up on samples missed while the target was stopped
+                    next_sample = max(next_sample + self._interval, time.monotonic())
+                continue
+
+            if not lldb.SBProcess.EventIsProcessEvent(event):
+                continue
+
+            state = lldb.SBProcess.GetStateFromEvent(event)
+            if state in (lldb.eStateExited, lldb.eStateDetached, lldb.eStateCrashed):
+                logging.info(f"Took {self._num_samples} samples")
+                return
+
+            # Stops at auto-continuing breakpoints are reported as restarted
+            if state != lldb.eStateStopped or lldb.SBProcess.GetRestartedFromEvent(
+                event
+            ):
+                continue
+
+            if not interrupting:
+                logging.info("Target stopped, ending profiling")
+                return
+
+            self._sample(process)
+            interrupting = False
+            process.Continue()
+
+    def write_folded(self, path: str):
+        logging.info(f"Writing {len(self._counts)} folded stacks to {path}")
+
+        table = StackTable.instance()
+        with open(path, "w") as file:
+            for stack_id, count in sorted(
+                self._counts.items(), key=lambda item: item[1], reverse=True
+            ):
+                # Folded stacks list the outermost frame first
+                functions = [
+                    function for (function, _, _) in reversed(table.stack(stack_id))
+                ]
+                file.write(f"{';'.join(functions)} {count}\n")
@@ -0,0 +1,436 @@
+"""
+Recording of what hooks read from the target, and replaying hooks from such recordings.
+
+Replaying doesn't need lldb nor the target: hooks get stand-ins for `StackFrame`, `Var` etc. which
+return the recorded values. Only what a hook actually read during recording is available during
+replay, so a hook that starts reading other variables has to be recorded again.
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from . import callbacks, formatters
+from .aggregate import GlobalAggregators
+from .common import (
+    BreakpointLocationOps,
+    GlobalFileWriter,
+    LineLocation,
+    VarOps,
+    get_hook_fns,
+    import_module_from_file,
+)
+from .delta import GlobalDeltaWriter
+from .trace import GlobalTraceWriter
+
+__all__ = [
+    "Recorder",
+    "replay_hooks",
+]
+
+# Keys of the children of a recorded variable, by how the child was accessed
+MEMBER = "."
+INDEX = "["
+CHILD = "#"
+DEREF = "*"
+ARRAY = "@"
+
+TYPE_FLAGS = [
+    "is_pointer",
+    "is_array",
+    "is_integral_signed",
+    "is_integral_unsigned",
+    "is_floating_point",
+    "is_boolean",
+    "is_character",
+]
+
+
+class Recorder:
+    """
+    Writer of recordings: gzipped JSON lines, one per hook hit.
+
+    Types are written once, when first used, and referred to by ID from then on.
+    """
+
+    _instance: Optional[Recorder] = None
+
+    def __init__(self, path: Optional[str]) -> None:
+        self._path = path
+        self._file = None
+        self._type_ids: Dict[str, int] = dict()
+        self._hits: Dict[str, int] = dict()
+
+    @staticmethod
+    def current() -> Optional[Recorder]:
+        """The active recorder, or None if not recording."""
+        return Recorder._instance
+
+    def type_id(self, type_info: Dict[str, Any]) -> int:
+        key = json.dumps(type_info, sort_keys=True)
+        type_id = self._type_ids.get(key)
+        if type_id is None:
+            type_id = len(self._type_ids)
+            self._type_ids[key] = type_id
+            self._write({"type": type_id, **type_info})
+        return type_id
+
+    def new_hit(self, hook_name: str) -> Dict[str, Any]:
+        seq = self._hits.get(hook_name, 0)
+        self._hits[hook_name] = seq + 1
+        return {"hook": hook_name, "seq": seq}
+
+    def write_hit(self, hit: Dict[str, Any]):
+        self._write({"hit": hit})
+
+    def _write(self, record: Dict[str, Any]):
+        assert self._file is not None
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def __enter__(self):
+        if self._path is not None and Recorder._instance is None:
+            logging.info(f"Recording hook inputs to {self._path}")
+            self._file = gzip.open(self._path, "wt")
+            Recorder._instance = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if Recorder._instance is self:
+            assert self._file is not None
+            self._file.close()
+            Recorder._instance = None
+
+
+def read_recording(path: str) -> Iterator[Tuple[Dict[str, Any], Dict[int, RecordedType]]]:
+    """Yield the recorded hits along with the types known at that point."""
+
+    types: Dict[int, RecordedType] = dict()
+    with gzip.open(path, "rt") as file:
+        for line in file:
+            record = json.loads(line)
+            if "type" in record:
+                types[record["type"]] = RecordedType(record, types)
+            else:
+                yield record["hit"], types
+
+
+class ReplayError(LookupError):
+    """Raised when a hook reads something that wasn't read when recording."""
+
+
+class RecordedType:
+    def __init__(self, type_info: Dict[str, Any], types: Dict[int, RecordedType]):
+        self._info = type_info
+        self._types = types
+
+    def _flag(self, flag: str) -> bool:
+        return flag in self._info["flags"]
+
+    @property
+    def name(self) -> str:
+        return self._info["name"]
+
+    @property
+    def is_pointer(self) -> bool:
+        return self._flag("is_pointer")
+
+    @property
+    def pointee_type(self) -> Optional[RecordedType]:
+        pointee = self._info.get("pointee")
+        return None if pointee is None else self._types[pointee]
+
+    @property
+    def is_array(self) -> bool:
+        return self._flag("is_array")
+
+    @property
+    def is_integral_signed(self) -> bool:
+        return self._flag("is_integral_signed")
+
+    @property
+    def is_integral_unsigned(self) -> bool:
+        return self._flag("is_integral_unsigned")
+
+    @property
+    def is_integral(self) -> bool:
+        return self.is_integral_signed or self.is_integral_unsigned
+
+    @property
+    def is_floating_point(self) -> bool:
+        return self._flag("is_floating_point")
+
+    @property
+    def is_boolean(self) -> bool:
+        return self._flag("is_boolean")
+
+    @property
+    def is_character(self) -> bool:
+        return self._flag("is_character")
+
+    @property
+    def is_numeric(self) -> bool:
+        return self.is_integral or self.is_floating_point or self.is_boolean
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class _RecordedTraits:
+    """What `rummage.detach` and friends need to know about a recorded type, see `_TypeTraits`."""
+
+    def __init__(self, type_: RecordedType) -> None:
+        self.type = type_
+        self.converter = formatters.find_converter(type_.name)
+        self.is_character = type_.is_character
+        pointee_type = type_.pointee_type
+        self.is_c_string = pointee_type is not None and pointee_type.is_character
+        self.is_array = type_.is_array
+
+
+def _recorded(node: Dict[str, Any], key: str, what: str) -> Any:
+    if key not in node:
+        raise ReplayError(f"{what} was not read when recording")
+    return node[key]
+
+
+class RecordedVar(VarOps):
+    """Stand-in for `rummage.Var` during replay."""
+
+    def __init__(self, node: Dict[str, Any], types: Dict[int, RecordedType]) -> None:
+        self._node = node
+        self._types = types
+        self._value = node.get("v")
+
+    @property
+    def _traits(self) -> _RecordedTraits:
+        return _RecordedTraits(self._types[self._node["t"]])
+
+    def _child(self, key: str) -> Optional[RecordedVar]:
+        node = self._node.get("c", {}).get(key)
+        return None if node is None else RecordedVar(node, self._types)
+
+    def __getattr__(self, name) -> Any:
+        child = self._child(MEMBER + name)
+        if child is not None:
+            return child
+
+        return self._method(name)
+
+    def _deref(self) -> RecordedVar:
+        child = self._child(DEREF)
+        if child is None:
+            raise ReplayError("Dereferenced variable was not read when recording")
+        return child
+
+    def _as_array(self, len: int) -> RecordedVar:
+        child = self._child(ARRAY + str(len))
+        if child is None:
+            raise ReplayError(f"Array of length {len} was not read when recording")
+        return child
+
+    def _members(self) -> Iterator[Tuple[str, RecordedVar]]:
+        return ((RecordedVarInfo(member).name, member) for member in self)
+
+    def __getitem__(self, key):
+        child = self._child(INDEX + str(int(key)))
+        if child is None:
+            raise IndexError(f"Index {key} is out of range or was not read when recording")
+        return child
+
+    def __iter__(self):
+        for i in range(len(self)):
+            child = self._child(CHILD + str(i))
+            if child is None:
+                raise ReplayError(f"Child {i} was not read when recording")
+            yield child
+
+    def __len__(self):
+        return _recorded(self._node, "n", "Length of variable")
+
+    def __str__(self) -> str:
+        return _recorded(self._node, "s", "String representation of variable")
+
+    def __repr__(self):
+        var_info = RecordedVarInfo(self)
+        return (
+            f'({var_info.canonical_type}) {var_info.name} {{ {self._value or "..."} }}'
+        )
+
+
+class RecordedVarInfo:
+    """Stand-in for `rummage.VarInfo` during replay."""
+
+    def __init__(self, var: RecordedVar) -> None:
+        self._node = var._node
+        self._types = var._types
+
+    @property
+    def canonical_type(self) -> RecordedType:
+        return self._types[self._node["t"]]
+
+    @property
+    def name(self) -> str:
+        return _recorded(self._node, "N", "Name of variable")
+
+    def __str__(self) -> str:
+        return _recorded(self._node, "i", "Info of variable")
+
+
+class RecordedStackTable:
+    """Stand-in for `rummage.StackTable` during replay."""
+
+    _instance: Optional[RecordedStackTable] = None
+
+    def __init__(self) -> None:
+        self._stack_ids: Dict[Tuple, int] = dict()
+        self._stacks: List[Tuple] = []
+
+    @staticmethod
+    def instance() -> RecordedStackTable:
+        if RecordedStackTable._instance is None:
+            RecordedStackTable._instance = RecordedStackTable()
+        return RecordedStackTable._instance
+
+    def intern(self, backtrace: Tuple) -> int:
+        stack_id = self._stack_ids.get(backtrace)
+        if stack_id is None:
+            stack_id = len(self._stacks)
+            self._stack_ids[backtrace] = stack_id
+            self._stacks.append(backtrace)
+        return stack_id
+
+    def stack(self, stack_id: int) -> Tuple:
+        return self._stacks[stack_id]
+
+    def __len__(self) -> int:
+        return len(self._stacks)
+
+
+class RecordedFrame:
+    """Stand-in for `rummage.StackFrame` during replay."""
+
+    def __init__(self, hit: Dict[str, Any], types: Dict[int, RecordedType]) -> None:
+        self._hit = hit
+        self._types = types
+
+    def var(self, name) -> RecordedVar:
+        node = _recorded(self._hit.get("vars", {}), name, f"Variable '{name}'")
+        if node is None:
+            raise KeyError(f"Variable '{name}' not found")
+        return RecordedVar(node, self._types)
+
+    @property
+    def target(self) -> RecordedTarget:
+        return RecordedTarget(self._hit, self._types)
+
+    @property
+    def location(self):
+        location = _recorded(self._hit, "location", "Frame location")
+        return LineLocation(*location)
+
+    def eval(self, expr: str) -> RecordedVar:
+        node = _recorded(self._hit.get("eval", {}), expr, f"Expression '{expr}'")
+        if node is None:
+            raise ValueError(f"Failed to evaluate expression '{expr}'")
+        return RecordedVar(node, self._types)
+
+    def backtrace(self, max_depth: int = 64) -> Tuple[Tuple[str, str, int], ...]:
+        backtrace = _recorded(
+            self._hit.get("backtrace", {}), str(max_depth), "Backtrace"
+        )
+        return tuple(tuple(symbol) for symbol in backtrace)
+
+    def stack_id(self, max_depth: int = 64) -> int:
+        return RecordedStackTable.instance().intern(self.backtrace(max_depth))
+
+
+class RecordedTarget:
+    """Stand-in for `rummage.Target`, as returned by `StackFrame.target`, during replay."""
+
+    def __init__(self, hit: Dict[str, Any], types: Dict[int, RecordedType]) -> None:
+        self._hit = hit
+        self._types = types
+
+    def global_var(self, name: str, module: Optional[str] = None) -> RecordedVar:
+        key = name if module is None else f"{module}`{name}"
+        node = _recorded(self._hit.get("globals", {}), key, f"Global variable '{key}'")
+        if node is None:
+            raise KeyError(f"Global variable '{name}' not found")
+        return RecordedVar(node, self._types)
+
+
+class RecordedBreakpointLocation(BreakpointLocationOps):
+    """Stand-in for `rummage.BreakpointLocation` during replay."""
+
+    def __init__(self, hit: Dict[str, Any]) -> None:
+        self._bp_loc = hit["bp_loc"]
+
+    @property
+    def line_location(self) -> LineLocation:
+        return LineLocation(self._bp_loc["file"], self._bp_loc["line"])
+
+    @property
+    def hit_count(self) -> int:
+        return self._bp_loc["hit_count"]
+
+
+def _install_stand_ins():
+    import rummage
+
+    stand_ins = {
+        "StackFrame": RecordedFrame,
+        "Var": RecordedVar,
+        "VarInfo": RecordedVarInfo,
+        "BreakpointLocation": RecordedBreakpointLocation,
+        "StackTable": RecordedStackTable,
+    }
+    for name, stand_in in stand_ins.items():
+        setattr(rummage, name, stand_in)
+
+
+def replay_hooks(
+    hook_file: str, recording_path: str, summary_file: Optional[str] = None
+) -> int:
+    """
+    Call the hooks in `hook_file` with the inputs recorded in `recording_path`, in recorded order.
+    The aggregator summary is only written if a `summary_file` is given.
+
+    Returns the number of hook calls that raised an exception.
+    """
+
+    # Must happen before importing the hooks, which may import names from rummage directly
+    _install_stand_ins()
+    hook_module = import_module_from_file(hook_file)
+    hook_fns = dict(get_hook_fns(hook_module))
+
+    num_hits, num_failures = 0, 0
+    with GlobalFileWriter(), GlobalAggregators(summary_file), GlobalDeltaWriter(), (
+        GlobalTraceWriter()
+    ):
+        callbacks.on_target_launch(None)
+
+        for hit, types in read_recording(recording_path):
+            name = hit["hook"]
+            fn = hook_fns.get(name)
+            if fn is None:
+                logging.warning(f"Hook {name} not found in {hook_file}, skipping")
+                continue
+
+            num_hits += 1
+            frame = RecordedFrame(hit, types)
+            bp_loc = RecordedBreakpointLocation(hit)
+            try:
+                callbacks.on_hook_enter(frame=frame, bp_loc=bp_loc, extra=hit["extra"])
+                if getattr(fn, "_rummage_offload", None) is not None:
+                    fn(values=hit["values"], extra=hit["extra"], hit=hit["seq"])
+                else:
+                    fn(frame=frame, bp_loc=bp_loc, extra=hit["extra"])
+            except Exception:
+                num_failures += 1
+                logging.exception(f"Hook {name} failed at hit {hit['seq']}")
+
+    logging.info(f"Replayed {num_hits} hits, {num_failures} failed")
+    return num_failures
@@ -0,0 +1,259 @@
+"""
+Span markers: `// @rummage: begin <span>` and `// @rummage: end <span>` measure how long the
+target takes from one to the other.
+
+`begin` and `end` are reserved marker names: hooks with either name are not called.
+
+Begin and end markers are matched per thread, innermost first, so spans may nest, e.g. a span
+around a loop with a span around each iteration. Durations are recorded in a session aggregator
+(`span_duration_ns`, one HdrHistogram per span) and the spans are written out as a Chrome trace,
+which can be opened in Perfetto or chrome://tracing. Trace time 0 is the `time.perf_counter_ns()`
+given as `clock_origin_ns` in the trace's `otherData`, the clock that capture markers use too.
+
+Every stop of the target, for span markers as much as for hooks or anything else rummage does,
+takes far longer than most code being measured. While one thread is stopped, all of them are, so
+all stops between the begin and end of a span count towards its duration. The cost of a stop is
+estimated as the shortest time seen between two consecutive stops, and subtracted once for each
+stop within a span: timestamps are moved back by the estimated overhead of all the stops that
+happened before them, which keeps nested spans nested.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import lldb
+
+from .aggregate import GlobalAggregators
+from .core import MarkerIndex, Target, marker_breakpoints
+
+BEGIN = "begin"
+END = "end"
+# Marker names handled by SpanTracker rather than by hooks
+MARKER_NAMES = [BEGIN, END]
+
+
+class SpanTracker:
+    """
+    Sets auto-continuing breakpoints at all begin and end markers of a target and keeps track of
+    the spans between them.
+    """
+
+    _instance: Optional[SpanTracker] = None
+
+    def __init__(self, target: Target, marker_index: MarkerIndex) -> None:
+        self._target = target._inner
+        # Marker kind and span name, by breakpoint ID
+        self._markers: Dict[int, Tuple[str, str]] = dict()
+
+        for kind in MARKER_NAMES:
+            self._set_breakpoints(target, kind, marker_index)
+
+        # Per thread, the spans that are open: span ID, start (ns) and stop ID
+        self._open: Dict[int, List[Tuple[int, int, int]]] = dict()
+
+        # Time and stop ID of the last stop, and the shortest time seen between consecutive stops
+        self._last_stop: Optional[Tuple[int, int]] = None
+        self._min_stop_ns: Optional[int] = None
+        # Time and stop ID of the first stop at a span marker, the origin of the trace
+        self._first_stop: Optional[Tuple[int, int]] = None
+        self._pid = 0
+
+        # Completed spans, in parallel arrays
+        self._span_names: List[str] = []
+        self._span_ids: Dict[str, int] = dict()
+        self._ids = array("I")
+        self._threads = array("Q")
+        self._starts = array("Q")
+        self._ends = array("Q")
+        self._start_stops = array("Q")
+        self._end_stops = array("Q")
+
+    def _set_breakpoints(self, target: Target, kind: str, marker_index: MarkerIndex):
+        for breakpoint, where, span in marker_breakpoints(target, marker_index, kind):
+            if not span:
+                logging.error(f"Ignoring {kind} marker without a span name at {where}")
+                self._target.BreakpointDelete(breakpoint.GetID())
+                continue
+
+            logging.debug(f"Found {kind} of span {span} at {where}")
+            breakpoint.SetAutoContinue(True)
+            breakpoint.SetScriptCallbackFunction("launch._span_hit")
+            self._markers[breakpoint.GetID()] = (kind, span)
+
+    @staticmethod
+    def instance() -> SpanTracker:
+        assert (
+            SpanTracker._instance is not None
+        ), "Initialise using context manager: `with SpanTracker():`"
+        return SpanTracker._instance
+
+    def __len__(self) -> int:
+        return len(self._markers)
+
+    def _span_id(self, span: str) -> int:
+        span_id = self._span_ids.get(span)
+        if span_id is None:
+            span_id = len(self._span_names)
+            self._span_ids[span] = span_id
+            self._span_names.append(span)
+        return span_id
+
+    def on_hit(self, frame: lldb.SBFrame, bp_loc: lldb.SBBreakpointLocation):
+        now = time.perf_counter_ns()
+
+        marker = self._markers.get(bp_loc.GetBreakpoint().GetID())
+        if marker is None:
+            return False
+        kind, span = marker
+
+        thread = frame.GetThread()
+        process = thread.GetProcess()
+        # Counts every stop of the process, including those of auto-continuing breakpoints
+        stop_id = process.GetStopID()
+
+        if self._last_stop is not None and stop_id - self._last_stop[1] == 1:
+            elapsed = now - self._last_stop[0]
+            if self._min_stop_ns is None or elapsed < self._min_stop_ns:
+                self._min_stop_ns = elapsed
+        self._last_stop = (now, stop_id)
+        if self._first_stop is None:
+            self._first_stop = (now, stop_id)
+            self._pid = process.GetProcessID()
+
+        thread_id = thread.GetThreadID()
+        stack = self._open.setdefault(thread_id, [])
+        span_id = self._span_id(span)
+
+        if kind == BEGIN:
+            stack.append((span_id, now, stop_id))
+            return False
+
+        # Innermost open span of the same name
+        depth = len(stack) - 1
+        while depth >= 0 and stack[depth][0] != span_id:
+            depth -= 1
+        if depth < 0:
+            logging.debug(f"Ignoring end of span {span}, which isn't open")
+            return False
+        if depth < len(stack) - 1:
+            logging.warning(
+                f"Span {span} ended with {len(stack) - 1 - depth} spans in it still "
+                "open, dropping them"
+            )
+
+        _, start, start_stop = stack[depth]
+        del stack[depth:]
+
+        self._ids.append(span_id)
+        self._threads.append(thread_id)
+        self._starts.append(start)
+        self._ends.append(now)
+        self._start_stops.append(start_stop)
+        self._end_stops.append(stop_id)
+        return False
+
+    def on_exec(self):
+        """Spans that are open when the target execs another image are never going to end."""
+
+        self._open.clear()
+
+    @property
+    def stop_overhead_ns(self) -> int:
+        """Estimated time the target spends stopped per stop."""
+
+        return self._min_stop_ns or 0
+
+    def _corrected(self, timestamp: int, stop_id: int) -> int:
+        """`timestamp` relative to the first stop, minus the overhead of the stops since."""
+
+        assert self._first_stop is not None
+        first_ns, first_stop_id = self._first_stop
+        return timestamp - first_ns - self.stop_overhead_ns * (stop_id - first_stop_id)
+
+    def spans(self) -> List[Tuple[str, int, int, int]]:
+        """
+        Completed spans as (name, thread ID, start, duration) tuples, in nanoseconds and with
+        the overhead of stops taken out. Starts are relative to the first stop at a span marker.
+        """
+
+        spans = []
+        for i in range(len(self._ids)):
+            start = self._corrected(self._starts[i], self._start_stops[i])
+            end = self._corrected(self._ends[i], self._end_stops[i])
+            # Only the shortest time seen between stops is taken out, so this is hardly ever
+            # negative
+            spans.append(
+                (
+                    self._span_names[self._ids[i]],
+                    self._threads[i],
+                    start,
+                    max(end - start, 0),
+                )
+            )
+        return spans
+
+    def record_durations(self):
+        """Record the duration of each completed span in the session's aggregators."""
+
+        aggregators = GlobalAggregators.instance()
+        num_open = sum(len(stack) for stack in self._open.values())
+        logging.info(
+            f"Recording {len(self._ids)} spans ({num_open} never ended), "
+            f"estimated overhead per stop: {self.stop_overhead_ns} ns"
+        )
+        for span, _, _, duration in self.spans():
+            aggregators.hdr_histogram("span_duration_ns", span=span).record(duration)
+
+    def write_chrome_trace(self, path: str):
+        """Write completed spans as a Chrome trace (JSON), one track per thread."""
+
+        events = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": self._pid,
+                "args": {"name": self._target.GetExecutable().GetFilename()},
+            }
+        ]
+        for span, thread_id, start, duration in self.spans():
+            events.append(
+                {
+                    "name": span,
+                    "cat": "rummage",
+                    "ph": "X",
+                    "pid": self._pid,
+                    "tid": thread_id,
+                    # Microseconds
+                    "ts": start / 1000,
+                    "dur": duration / 1000,
+                }
+            )
+
+        logging.info(f"Writing span trace to {path}")
+        with open(path, "w") as file:
+            json.dump(
+                {
+                    "traceEvents": events,
+                    "displayTimeUnit": "ns",
+                    "otherData": {
+                        "stop_overhead_ns": self.stop_overhead_ns,
+                        "clock_origin_ns": (
+                            None if self._first_stop is None else self._first_stop[0]
+                        ),
+                    },
+                },
+                file,
+            )
+
+    def __enter__(self):
+        if SpanTracker._instance is None:
+            SpanTracker._instance = self
+        return SpanTracker._instance
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        SpanTracker._instance = None
@@ -0,0 +1,442 @@
+"""
+Indexed binary traces.
+
+File layout, all integers little endian:
+
+  - header: 8-byte magic, u16 version
+  - records: u8 kind, u32 hook ID, u64 hit, u64 timestamp (ns), u32 payload length, payload.
+    "H" records name a hook (utf8 payload) before its first "R" record, which has a JSON payload
+  - index, written when the trace is closed: u32 number of hooks, then for each hook a u16 name
+    length and the utf8 name; u64 number of records, then four arrays with an element per record:
+    u64 record offsets, u32 hook IDs, u64 hits, u64 timestamps
+  - trailer: u64 offset of the index, 8-byte index magic
+
+Timestamps come from `time.perf_counter_ns()`, a monotonic clock, so that records stay sorted by
+time even if the wall clock is changed while tracing.
+
+Traces that weren't closed properly (e.g. rummage was killed) have no index; the reader then
+rebuilds it by scanning the records.
+"""
+
+from __future__ import annotations
+
+import bisect
+import csv
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+from .common import ValueOps
+from .delta import flatten
+
+__all__ = [
+    "TraceWriter",
+    "TraceReader",
+    "TraceRecord",
+    "GlobalTraceWriter",
+]
+
+MAGIC = b"RMGTRACE"
+INDEX_MAGIC = b"RMGINDEX"
+VERSION = 1
+
+_HEADER_SIZE = len(MAGIC) + 2
+_RECORD_HEADER = struct.Struct("<cIQQI")
+_TRAILER = struct.Struct("<Q8s")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+# Size of the index columns per record: offset, hook ID, hit and timestamp
+_INDEX_ENTRY_SIZE = 8 + 4 + 8 + 8
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, ValueOps):
+        # Resolved at call time, so that replay stand-ins are used when replaying
+        import rummage
+
+        return rummage.detach(value)
+    return str(value)
+
+
+class TraceWriter:
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "wb")
+        self._file.write(MAGIC + _U16.pack(VERSION))
+        self._offset = _HEADER_SIZE
+
+        self._hook_ids: Dict[str, int] = dict()
+        self._offsets = array("Q")
+        self._hooks = array("I")
+        self._hits = array("Q")
+        self._timestamps = array("Q")
+
+    def write(
+        self, hook: str, hit: int, value: Any, timestamp_ns: Optional[int] = None
+    ):
+        """
+        Append a record. `value` must be JSON serialisable; Vars are copied with `rummage.detach`.
+
+        Timestamps given explicitly must not be lower than that of the previous record, as readers
+        rely on records being sorted by time.
+        """
+
+        if timestamp_ns is None:
+            timestamp_ns = time.perf_counter_ns()
+        if self._timestamps and timestamp_ns < self._timestamps[-1]:
+            raise ValueError(
+                f"Timestamp {timestamp_ns} of a record of {hook} is lower than that of "
+                f"the previous record ({self._timestamps[-1]})"
+            )
+
+        hook_id = self._hook_ids.get(hook)
+        if hook_id is None:
+            hook_id = len(self._hook_ids)
+            self._hook_ids[hook] = hook_id
+            self._write_record(b"H", hook_id, 0, 0, hook.encode())
+
+        payload = json.dumps(value, default=_to_json, separators=(",", ":")).encode()
+        self._offsets.append(self._offset)
+        self._hooks.append(hook_id)
+        self._hits.append(hit)
+        self._timestamps.append(timestamp_ns)
+        self._write_record(b"R", hook_id, hit, timestamp_ns, payload)
+
+    def _write_record(
+        self, kind: bytes, hook_id: int, hit: int, timestamp_ns: int, payload: bytes
+    ):
+        self._file.write(
+            _RECORD_HEADER.pack(kind, hook_id, hit, timestamp_ns, len(payload))
+        )
+        self._file.write(payload)
+        self._offset += _RECORD_HEADER.size + len(payload)
+
+    def close(self):
+        index_offset = self._offset
+
+        self._file.write(_U32.pack(len(self._hook_ids)))
+        for hook in self._hook_ids:
+            encoded = hook.encode()
+            self._file.write(_U16.pack(len(encoded)) + encoded)
+
+        self._file.write(_U64.pack(len(self._offsets)))
+        for column in (self._offsets, self._hooks, self._hits, self._timestamps):
+            if sys.byteorder != "little":
+                column = array(column.typecode, column)
+                column.byteswap()
+            self._file.write(column.tobytes())
+
+        self._file.write(_TRAILER.pack(index_offset, INDEX_MAGIC))
+        self._file.close()
+
+
+class GlobalTraceWriter:
+    """Session-wide trace writers, keyed by path and closed (indexed) when the session ends."""
+
+    _instance: Optional[GlobalTraceWriter] = None
+
+    def __init__(self) -> None:
+        self._writers: Dict[str, TraceWriter] = dict()
+
+    @staticmethod
+    def instance() -> GlobalTraceWriter:
+        assert (
+            GlobalTraceWriter._instance is not None
+        ), "Initialise using context manager: `with GlobalTraceWriter():`"
+        return GlobalTraceWriter._instance
+
+    def write(self, path: str, hook: str, hit: int, value: Any):
+        writer = self._writers.get(path)
+        if writer is None:
+            writer = TraceWriter(path)
+            self._writers[path] = writer
+        writer.write(hook, hit, value)
+
+    def __enter__(self):
+        if GlobalTraceWriter._instance is None:
+            GlobalTraceWriter._instance = self
+        return GlobalTraceWriter._instance
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for writer in GlobalTraceWriter.instance()._writers.values():
+            writer.close()
+        GlobalTraceWriter._instance = None
+
+
+class TraceRecord:
+    def __init__(self, reader: TraceReader, index: int) -> None:
+        self._reader = reader
+        self._index = index
+
+    @property
+    def hook(self) -> str:
+        return self._reader._hook_names[self._reader._hooks[self._index]]
+
+    @property
+    def hit(self) -> int:
+        return self._reader._hits[self._index]
+
+    @property
+    def timestamp_ns(self) -> int:
+        return self._reader._timestamps[self._index]
+
+    @property
+    def value(self) -> Any:
+        """The payload of the record, decoded on access."""
+
+        data = self._reader._data
+        offset = self._reader._offsets[self._index]
+        *_, length = _RECORD_HEADER.unpack_from(data, offset)
+        start = offset + _RECORD_HEADER.size
+        return json.loads(bytes(data[start : start + length]))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "hook": self.hook,
+            "hit": self.hit,
+            "timestamp_ns": self.timestamp_ns,
+            "value": self.value,
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"<TraceRecord {self.hook} hit: {self.hit}, "
+            f"timestamp: {self.timestamp_ns}>"
+        )
+
+
+class TraceReader:
+    """
+    Reader of indexed traces. The trace is memory-mapped and only the parts that are accessed are
+    read from disk.
+
+    Opening a trace also indexes its records by hook and hit: per hook, the records of the hook
+    sorted by hit, so that records of a hook or in a range of hits are looked up without going
+    through all records.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "rb")
+        self._mmap: Optional[mmap.mmap] = None
+        self._data: Optional[memoryview] = None
+        self._offsets: Any = array("Q")
+        self._hooks: Any = array("I")
+        self._hits: Any = array("Q")
+        self._timestamps: Any = array("Q")
+
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            if size < _HEADER_SIZE:
+                # Also keeps mmap from failing on empty files
+                raise ValueError(
+                    f"{path} is not a rummage trace, or is truncated: only {size} bytes"
+                )
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._data = memoryview(self._mmap)
+
+            if bytes(self._data[: len(MAGIC)]) != MAGIC:
+                raise ValueError(f"{path} is not a rummage trace")
+            (version,) = _U16.unpack_from(self._data, len(MAGIC))
+            if version != VERSION:
+                raise ValueError(f"{path} is a trace of unsupported version {version}")
+
+            if not self._read_index(path):
+                self._scan()
+        except BaseException:
+            self.close()
+            raise
+
+        self._hook_ids = {name: i for (i, name) in enumerate(self._hook_names)}
+        self._index_hooks()
+
+    def _read_index(self, path: str) -> bool:
+        data = self._data
+        if len(data) < _HEADER_SIZE + _TRAILER.size:
+            return False
+
+        index_offset, magic = _TRAILER.unpack_from(data, len(data) - _TRAILER.size)
+        if magic != INDEX_MAGIC:
+            return False
+
+        try:
+            offset = index_offset
+            (num_hooks,) = _U32.unpack_from(data, offset)
+            offset += _U32.size
+            self._hook_names: List[str] = []
+            for _ in range(num_hooks):
+                (length,) = _U16.unpack_from(data, offset)
+                offset += _U16.size
+                self._hook_names.append(bytes(data[offset : offset + length]).decode())
+                offset += length
+
+            (count,) = _U64.unpack_from(data, offset)
+            offset += _U64.size
+        except (struct.error, UnicodeDecodeError) as e:
+            raise ValueError(f"Index of trace {path} is corrupt: {e}") from e
+        if offset + count * _INDEX_ENTRY_SIZE != len(data) - _TRAILER.size:
+            raise ValueError(f"Index of trace {path} is corrupt: sizes don't add up")
+
+        def column(typecode: str, size: int):
+            nonlocal offset
+            view = data[offset : offset + count * size]
+            offset += count * size
+            if sys.byteorder == "little":
+                # Zero-copy view into the mapped file
+                return view.cast(typecode)
+            values = array(typecode, view)
+            values.byteswap()
+            return values
+
+        self._offsets = column("Q", 8)
+        self._hooks = column("I", 4)
+        self._hits = column("Q", 8)
+        self._timestamps = column("Q", 8)
+        return True
+
+    def _index_hooks(self):
+        # Per hook: indices of its records, and their hits, sorted by hit
+        records: List[array] = [array("Q") for _ in self._hook_names]
+        for i, hook_id in enumerate(self._hooks):
+            records[hook_id].append(i)
+
+        self._hook_records: List[array] = []
+        self._hook_hits: List[array] = []
+        for indices in records:
+            hits = array("Q", (self._hits[i] for i in indices))
+            if any(hits[i] > hits[i + 1] for i in range(len(hits) - 1)):
+                # Stable, so that records of the same hit stay in file order
+                order = sorted(range(len(indices)), key=hits.__getitem__)
+                indices = array("Q", (indices[i] for i in order))
+                hits = array("Q", (hits[i] for i in order))
+            self._hook_records.append(indices)
+            self._hook_hits.append(hits)
+
+    def _scan(self):
+        data = self._data
+        self._hook_names = []
+        self._offsets, self._hooks = array("Q"), array("I")
+        self._hits, self._timestamps = array("Q"), array("Q")
+
+        offset = _HEADER_SIZE
+        while offset + _RECORD_HEADER.size <= len(data):
+            kind, hook_id, hit, timestamp_ns, length = _RECORD_HEADER.unpack_from(
+                data, offset
+            )
+            start = offset + _RECORD_HEADER.size
+            if start + length > len(data):
+                # Truncated last record
+                break
+
+            if kind == b"H" and hook_id == len(self._hook_names):
+                self._hook_names.append(bytes(data[start : start + length]).decode())
+            elif kind == b"R" and hook_id < len(self._hook_names):
+                self._offsets.append(offset)
+                self._hooks.append(hook_id)
+                self._hits.append(hit)
+                self._timestamps.append(timestamp_ns)
+            else:
+                # Start of a partially written index
+                break
+            offset = start + length
+
+    @property
+    def hooks(self) -> List[str]:
+        return list(self._hook_names)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, index: int) -> TraceRecord:
+        if not 0 <= index < len(self):
+            raise IndexError(f"Record {index} is out of range")
+        return TraceRecord(self, index)
+
+    def records(
+        self,
+        hook: Optional[str] = None,
+        min_hit: Optional[int] = None,
+        max_hit: Optional[int] = None,
+        since_ns: Optional[int] = None,
+        until_ns: Optional[int] = None,
+    ) -> Iterator[TraceRecord]:
+        """Iterate over records in file order, optionally filtered. Bounds are inclusive."""
+
+        # Timestamps are monotonic and writers reject any that aren't, so they are sorted
+        start, end = 0, len(self)
+        if since_ns is not None:
+            start = bisect.bisect_left(self._timestamps, since_ns)
+        if until_ns is not None:
+            end = bisect.bisect_right(self._timestamps, until_ns)
+
+        if hook is None and min_hit is None and max_hit is None:
+            for i in range(start, end):
+                yield TraceRecord(self, i)
+            return
+
+        if hook is None:
+            hook_ids = range(len(self._hook_names))
+        elif hook in self._hook_ids:
+            hook_ids = [self._hook_ids[hook]]
+        else:
+            return
+
+        selected: List[int] = []
+        for hook_id in hook_ids:
+            hits = self._hook_hits[hook_id]
+            low = 0 if min_hit is None else bisect.bisect_left(hits, min_hit)
+            high = len(hits) if max_hit is None else bisect.bisect_right(hits, max_hit)
+            selected.extend(
+                i for i in self._hook_records[hook_id][low:high] if start <= i < end
+            )
+
+        for i in sorted(selected):
+            yield TraceRecord(self, i)
+
+    def close(self):
+        # Views into the mapping must be released before it can be closed
+        for column in (self._offsets, self._hooks, self._hits, self._timestamps):
+            if isinstance(column, memoryview):
+                column.release()
+        if self._data is not None:
+            self._data.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_jsonl(records: Iterator[TraceRecord], out: TextIO):
+    for record in records:
+        out.write(json.dumps(record.to_dict()) + "\n")
+
+
+def write_csv(records: List[TraceRecord], out: TextIO):
+    """Write records as CSV, with a column per (flattened) field of the record values."""
+
+    rows = [
+        {
+            "hook": record.hook,
+            "hit": record.hit,
+            "timestamp_ns": record.timestamp_ns,
+            **flatten(record.value, "value"),
+        }
+        for record in records
+    ]
+
+    columns: Dict[str, None] = dict()
+    for row in rows:
+        columns.update(dict.fromkeys(row))
+
+    writer = csv.DictWriter(out, fieldnames=list(columns))
+    writer.writeheader()
+    writer.writerows(rows)
@@ -0,0 +1,7 @@
+#pragma once
+
+// Markers in headers are only found through the support files of compile units
+static inline int test_header_marker(int x) {
+    int doubled = 2 * x;
+    return doubled;  // @rummage: test_header_marker
+}
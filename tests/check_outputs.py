@@ -0,0 +1,76 @@
+"""
+Checks of output files written by `just` recipes, which can only be checked once rummage is done:
+e.g. span durations are recorded after the last hook has run.
+
+Usage: python tests/check_outputs.py <check> <paths...>
+"""
+
+import json
+import sys
+
+
+def _summary_entries(summary_path, name):
+    with open(summary_path) as file:
+        return {
+            tuple(sorted(entry["labels"].items())): entry
+            for entry in json.load(file)
+            if entry["name"] == name
+        }
+
+
+def check_spans(trace_path, summary_path):
+    with open(trace_path) as file:
+        trace = json.load(file)
+
+    assert trace["otherData"]["stop_overhead_ns"] >= 0
+    events = trace["traceEvents"]
+    assert [event["ph"] for event in events if event["ph"] != "X"] == ["M"]
+
+    spans = [event for event in events if event["ph"] == "X"]
+    outer = [span for span in spans if span["name"] == "outer"]
+    inner = [span for span in spans if span["name"] == "inner"]
+    assert len(outer) == 1, outer
+    assert len(inner) == 3, inner
+    assert len(spans) == 4
+
+    # Inner spans are within the outer one, one after another, all on the same thread. Times are
+    # in microseconds, with rounding errors below a nanosecond.
+    [outer] = outer
+    assert all(span["tid"] == outer["tid"] for span in inner)
+    end = outer["ts"]
+    for span in inner:
+        assert span["ts"] >= end - 0.001, (span, end)
+        end = span["ts"] + span["dur"]
+    assert end <= outer["ts"] + outer["dur"] + 0.001, (end, outer)
+
+    durations = _summary_entries(summary_path, "span_duration_ns")
+    assert durations[(("span", "outer"),)]["count"] == 1
+    assert durations[(("span", "inner"),)]["count"] == 3
+
+
+def check_capture(capture_path):
+    with open(capture_path) as file:
+        capture = json.load(file)
+
+    [(where, site)] = capture.items()
+    assert "main.c" in where, where
+    assert len(site["timestamp_ns"]) == 1
+    assert site["values"] == {
+        "count": [3],
+        "node->id": [1],
+        "node->next->id": [2],
+        "buf[2:6]": [[3, 4, 5, 6]],
+        # Incremented by both calls of test_global_var
+        "global_counter": [2],
+    }
+
+
+CHECKS = {
+    "spans": check_spans,
+    "capture": check_capture,
+}
+
+
+if __name__ == "__main__":
+    CHECKS[sys.argv[1]](*sys.argv[2:])
+    print(f"{sys.argv[1]}: ok")
@@ -14,6 +14,8 @@ def _on_target_launch(debugger):
 
 def _on_hook_enter(bp_loc: BreakpointLocation, extra, **_):
     logging.debug(f"_on_hook_enter called for hook {extra['hook_name']} at {bp_loc}")
+    aggregators = rummage.GlobalAggregators.instance()
+    aggregators.counter("hook_hits", hook=extra["hook_name"]).add()
 
 
 rummage.callbacks.on_hook_enter = _on_hook_enter
@@ -109,6 +111,106 @@ def test_pointer(frame: StackFrame, **_):
     assert billion_dollar_mistake.is_null()
 
 
+def test_eval(frame: StackFrame, **_):
+    logging.debug("testing eval")
+    # Variable paths
+    assert frame.eval("a_struct.a") == 1
+    assert frame.eval("a_struct_ptr->b") == 3.5
+    assert frame.eval("multiplicity[4]") == 5
+    # Proper expressions
+    assert frame.eval("multiplicity[1] * a_struct.a + 1") == 3
+    assert frame.eval("*a_struct_ptr").b == 3.5
+    # Assignments change the target, so they are evaluated again every time
+    assert frame.eval("flags <<= 1") == 2
+    assert frame.eval("flags <<= 1") == 4
+    assert frame.eval("flags >>= 2") == 1
+    assert frame.eval("flags += 1") == 2
+    assert frame.eval("flags += 1") == 3
+    # ...and invalidate results of earlier expressions
+    assert frame.eval("flags * 1") == 3
+    assert frame.eval("flags += 1") == 4
+    assert frame.eval("flags * 1") == 4
+
+    try:
+        frame.eval("no_such_variable")
+        assert False, "eval of an unknown variable should fail"
+    except ValueError:
+        pass
+
+
+@rummage.offload("a_struct", "text")
+def test_offload(values, hit, **_):
+    logging.debug("testing offload")
+    assert hit == 0
+    assert values == {"a_struct": {"a": 1, "b": 3.5}, "text": "offloaded"}
+
+
+def test_backtrace(frame: StackFrame, **_):
+    logging.debug("testing backtrace")
+    backtrace = frame.backtrace()
+    functions = [function for (function, _, _) in backtrace]
+    assert functions[:3] == ["test_backtrace", "run_tests", "main"]
+    assert backtrace[0][1].endswith("main.c")
+
+    stack_id = frame.stack_id()
+    assert frame.stack_id() == stack_id
+    assert rummage.StackTable.instance().stack(stack_id) == backtrace
+    assert frame.backtrace(max_depth=1) == backtrace[:1]
+
+
+@rummage.formatter("TestPoint")
+def _format_point(point):
+    return f"({point.x}, {point.y})"
+
+
+@rummage.converter(r"TestPoint\[\d+\]", regex=True)
+def _convert_points(points):
+    return [(int(point.x), int(point.y)) for point in points]
+
+
+def test_formatters(frame: StackFrame, **_):
+    logging.debug("testing formatters")
+    point = frame.var("point")
+    assert str(point) == "(1, 2)"
+    assert rummage.detach(point) == {"x": 1, "y": 2}
+
+    points = frame.var("points")
+    assert str(points[1]) == "(5, 6)"
+    assert rummage.detach(points) == [(3, 4), (5, 6)]
+
+
+def test_compiled_marker(frame: StackFrame, **_):
+    logging.debug("testing compiled-in marker")
+    assert frame.var("answer") == 42
+    assert frame.backtrace()[0][0] == "test_compiled_marker"
+
+
+def test_header_marker(frame: StackFrame, **_):
+    logging.debug("testing marker in header")
+    assert frame.var("doubled") == 2 * frame.var("x")
+
+
+def test_global_var(frame: StackFrame, **_):
+    logging.debug("testing global variables")
+    hit = frame.target.global_var("global_counter")
+    assert hit > 0
+    # Cached after the first hit, but the value is read anew
+    assert frame.target.global_var("static_point").x == 7 + hit
+    assert VarInfo(frame.target.global_var("global_counter")).name == "global_counter"
+
+    try:
+        frame.target.global_var("no_such_global")
+        assert False, "global_var of an unknown variable should fail"
+    except KeyError:
+        pass
+
+
 def tests_done(**_):
     assert ON_LAUNCH_CALLED
+    aggregators = rummage.GlobalAggregators.instance()
+    assert aggregators.counter("hook_hits", hook="test_int").value == 1
+    assert aggregators.counter("hook_hits", hook="test_compiled_marker").value == 1
+    assert aggregators.counter("hook_hits", hook="test_header_marker").value == 2
+    assert aggregators.counter("hook_hits", hook="test_global_var").value == 2
+    assert aggregators.counter("hook_hits", hook="tests_done").value == 1
     logging.debug("Tests passed")
@@ -0,0 +1,33 @@
+import random
+from collections import Counter
+
+import rummage
+
+
+def test_top_k():
+    rng = random.Random(0)
+    # Zipf-like: a few keys are much more frequent than the rest
+    keys = [int(1000 / (1 + rng.random() * 999)) for _ in range(20000)]
+    exact = Counter(keys)
+
+    top_k = rummage.TopK(5, capacity=50)
+    for key in keys:
+        top_k.add(key)
+
+    top = top_k.top()
+    assert [key for key, _ in top] == [key for key, _ in exact.most_common(5)]
+    for entry in top_k.summary()["top"]:
+        # Space-Saving overestimates by at most the recorded error
+        true_count = exact[int(entry["key"])]
+        assert entry["count"] - entry["max_error"] <= true_count <= entry["count"]
+
+
+def test_top_k_eviction():
+    top_k = rummage.TopK(2, capacity=3)
+    for key, n in [("a", 1), ("b", 5), ("c", 2), ("a", 1), (("t", 1), 3)]:
+        top_k.add(key, n)
+
+    # Keys need not be comparable; ("t", 1) evicts one of the least frequent keys, at 2, and
+    # inherits its count as error
+    assert top_k.top() == [("b", 5), (("t", 1), 5)]
+    assert top_k.summary()["top"][1]["max_error"] == 2
@@ -0,0 +1,43 @@
+import pytest
+
+import rummage
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "trace.delta")
+    states = [
+        {"node": {"id": hit, "children": [1, 2, hit % 2]}, "name": "node"}
+        for hit in range(7)
+    ]
+    # Fields that come and go, and values of different types that compare equal
+    states[3]["extra"] = 1.5
+    states[4]["extra"] = True
+    states[5]["node"]["children"].pop()
+    states[6]["big"] = 1 << 70
+
+    writer = rummage.DeltaTraceWriter(path, keyframe_interval=3)
+    for state in states:
+        writer.write("hook", state)
+    writer.write("other", {"x": None})
+    writer.close()
+
+    with rummage.DeltaTraceReader(path) as reader:
+        assert reader.streams == ["hook", "other"]
+        assert reader.num_hits("hook") == len(states)
+
+        expected = [rummage.delta.flatten(state) for state in states]
+        assert [state for _, state in reader.states("hook")] == expected
+        for hit in reversed(range(len(states))):
+            assert reader.state_at("hook", hit) == expected[hit]
+        assert type(reader.state_at("hook", 4)["extra"]) is bool
+        assert reader.state_at("other", 0) == {"x": None}
+
+        with pytest.raises(IndexError):
+            reader.state_at("hook", len(states))
+
+
+def test_keyframe_interval_must_be_positive(tmp_path):
+    with pytest.raises(ValueError):
+        rummage.DeltaTraceWriter(str(tmp_path / "trace.delta"), keyframe_interval=0)
+    with pytest.raises(ValueError):
+        rummage.GlobalDeltaWriter(0)
@@ -0,0 +1,68 @@
+import json
+import os
+import socket
+import threading
+
+from rummage import main
+
+
+def _fake_daemon(socket_path, requests):
+    """Accept one request the way `rummage daemon` does, keep it in `requests` and succeed."""
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    # Don't hang the test run if the client never connects
+    server.settimeout(10)
+
+    def serve():
+        with server:
+            connection, _ = server.accept()
+            with connection, connection.makefile("rw") as stream:
+                requests.append(json.loads(stream.readline()))
+                stream.write(json.dumps({"ok": True, "exit_status": 0}) + "\n")
+                stream.flush()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_daemon_round_trip(tmp_path):
+    socket_path = str(tmp_path / "rummage.sock")
+    requests = []
+    thread = _fake_daemon(socket_path, requests)
+
+    args = main._argument_parser().parse_args(
+        [
+            "--coverage",
+            "--coverage-file",
+            "coverage.txt",
+            "--record",
+            "hooks.rec.gz",
+            "--span-trace-file",
+            "spans.json",
+            "--profile-file",
+            "profile.folded",
+            "hooks.py",
+            "exe",
+            "arg1",
+        ]
+    )
+    main.run_via_daemon(
+        socket_path,
+        args.hook_file,
+        args.exe,
+        args.arg,
+        launch_options=main._launch_options(args),
+    )
+    thread.join()
+
+    [request] = requests
+    assert request["args"] == ["arg1"]
+    options = request["launch_options"]
+    assert options["coverage_file"] == os.path.join(os.getcwd(), "coverage.txt")
+    assert options["record_file"] == os.path.join(os.getcwd(), "hooks.rec.gz")
+    assert options["span_trace_file"] == os.path.join(os.getcwd(), "spans.json")
+    assert options["profile_file"] == os.path.join(os.getcwd(), "profile.folded")
+    assert options["alloc_file"] is None
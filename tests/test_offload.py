@@ -0,0 +1,41 @@
+import threading
+
+import rummage
+from rummage.offload import OffloadSpec
+
+
+def _failing_hook(values, hit, **_):
+    # Fails for the first two hits
+    assert values["x"] != hit
+    return hit
+
+
+def test_failures_are_counted(tmp_path):
+    results = []
+    with rummage.GlobalAggregators(str(tmp_path / "summary.json")):
+        pool = rummage.OffloadPool(workers=2)
+        with pool:
+            spec = OffloadSpec(["x"], results.append)
+            for hit in range(4):
+                pool.submit("hook", _failing_hook, spec, {"x": hit % 2}, {}, 0)
+
+    assert pool.failures == 2
+    # Results of failed calls are skipped, the rest still reach the sink in hit order
+    assert results == [2, 3]
+
+
+def test_aggregators_from_threads(tmp_path):
+    aggregators = rummage.GlobalAggregators(str(tmp_path / "summary.json"), 0)
+
+    def work(thread):
+        for i in range(100):
+            aggregators.counter("hits", thread=thread, i=i).add()
+
+    threads = [threading.Thread(target=work, args=(t,)) for t in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(aggregators) == 4 * 100
+    assert len(aggregators.summary()) == 4 * 100
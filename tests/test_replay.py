@@ -0,0 +1,75 @@
+import gzip
+import json
+
+import rummage
+
+HOOKS = """
+import rummage
+
+
+def at_point(frame, bp_loc, **_):
+    point = frame.var("point")
+    assert rummage.detach(point) == {"x": 1, "y": 2}
+    assert point.x == 1
+
+    pointer = frame.var("pointer")
+    assert not pointer.is_null()
+    assert pointer.deref() == 5
+    assert rummage.detach(pointer) == 4096
+
+    assert str(bp_loc) == "<BreakpointLocation (line_location: main.c:10, hit_count: 1)>"
+    assert str(frame.location) == "main.c:10"
+
+    rummage.GlobalAggregators.instance().counter("points").add()
+"""
+
+
+def _node(type_id, value=None, name=None, children=None):
+    node = {"t": type_id, "v": value}
+    if name is not None:
+        node["N"] = name
+    if children is not None:
+        node["c"] = children
+        node["n"] = sum(key.startswith("#") for key in children)
+    return node
+
+
+def test_replay(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    hook_file = tmp_path / "hooks.py"
+    hook_file.write_text(HOOKS)
+
+    records = [
+        {"type": 0, "name": "int", "flags": ["is_integral_signed"], "pointee": None},
+        {"type": 1, "name": "TestPoint", "flags": [], "pointee": None},
+        {"type": 2, "name": "int *", "flags": ["is_pointer"], "pointee": 0},
+    ]
+    x, y = _node(0, 1, "x"), _node(0, 2, "y")
+    point = _node(1, children={"#0": x, "#1": y, ".x": x})
+    pointer = _node(2, 4096, "pointer", children={"*": _node(0, 5)})
+    records.append(
+        {
+            "hit": {
+                "hook": "at_point",
+                "seq": 0,
+                "extra": {"hook_name": "at_point"},
+                "bp_loc": {"file": "main.c", "line": 10, "hit_count": 1},
+                "location": ["main.c", 10],
+                "vars": {"point": point, "pointer": pointer},
+            }
+        }
+    )
+
+    recording = str(tmp_path / "hooks.rec.gz")
+    with gzip.open(recording, "wt") as file:
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+
+    assert rummage.replay_hooks(str(hook_file), recording) == 0
+    # Summaries are only written when asked for
+    assert list(tmp_path.glob("*.json")) == []
+
+    summary_file = tmp_path / "summary.json"
+    assert rummage.replay_hooks(str(hook_file), recording, str(summary_file)) == 0
+    [counter] = json.loads(summary_file.read_text())
+    assert counter["name"] == "points"
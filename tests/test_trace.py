@@ -0,0 +1,81 @@
+import pytest
+
+import rummage
+
+
+def _write(path, close=True):
+    writer = rummage.TraceWriter(path)
+    for hit in range(10):
+        writer.write("a", hit, {"hit": hit}, timestamp_ns=100 * hit)
+        writer.write("b", hit, [hit], timestamp_ns=100 * hit + 50)
+    if close:
+        writer.close()
+    else:
+        # As if rummage was killed: no index
+        writer._file.close()
+
+
+@pytest.mark.parametrize("indexed", [True, False])
+def test_records(tmp_path, indexed):
+    path = str(tmp_path / "trace.bin")
+    _write(path, close=indexed)
+
+    with rummage.TraceReader(path) as reader:
+        assert reader.hooks == ["a", "b"]
+        assert len(reader) == 20
+        assert reader[3].to_dict() == {
+            "hook": "b",
+            "hit": 1,
+            "timestamp_ns": 150,
+            "value": [1],
+        }
+
+        # Bounds are inclusive
+        records = reader.records(since_ns=250, until_ns=500)
+        assert [(r.hook, r.hit) for r in records] == [
+            ("b", 2),
+            ("a", 3),
+            ("b", 3),
+            ("a", 4),
+            ("b", 4),
+            ("a", 5),
+        ]
+        records = reader.records(hook="a", since_ns=801, min_hit=0, max_hit=9)
+        assert [r.value for r in records] == [{"hit": 9}]
+        assert list(reader.records(until_ns=-1)) == []
+        assert list(reader.records(hook="c")) == []
+
+
+def test_timestamps_must_not_decrease(tmp_path):
+    writer = rummage.TraceWriter(str(tmp_path / "trace.bin"))
+    writer.write("a", 0, None)
+    writer.write("a", 1, None)
+    with pytest.raises(ValueError):
+        writer.write("a", 2, None, timestamp_ns=0)
+    writer.close()
+
+
+def test_hook_and_hit_lookups(tmp_path):
+    path = str(tmp_path / "trace.bin")
+    writer = rummage.TraceWriter(path)
+    # Hits of a hook aren't necessarily written in order
+    for hit in [3, 1, 2, 1]:
+        writer.write("a", hit, hit)
+        writer.write("b", hit + 10, hit)
+    writer.close()
+
+    with rummage.TraceReader(path) as reader:
+        records = reader.records(hook="a", min_hit=1, max_hit=2)
+        # In file order
+        assert [(r.hook, r.hit) for r in records] == [("a", 1), ("a", 2), ("a", 1)]
+        records = reader.records(min_hit=3, max_hit=11)
+        assert [(r.hook, r.hit) for r in records] == [("a", 3), ("b", 11), ("b", 11)]
+        assert [r.hit for r in reader.records(hook="b")] == [13, 11, 12, 11]
+
+
+@pytest.mark.parametrize("content", [b"", b"RMGT", b"NOTATRACE!"])
+def test_not_a_trace(tmp_path, content):
+    path = tmp_path / "trace.bin"
+    path.write_bytes(content)
+    with pytest.raises(ValueError):
+        rummage.TraceReader(str(path))